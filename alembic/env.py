@@ -1,9 +1,11 @@
+import asyncio
 from logging.config import fileConfig
 
 from alembic import context
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import async_engine_from_config
 
-from app.core.config import get_settings
+from app.core.config import get_settings, to_async_url
 from app.database.database import Base
 
 import app.models  # IMPORTANT: must import models so Base.metadata is populated
@@ -43,21 +45,29 @@ def run_migrations_online():
     connectable = config.attributes.get("connection", None)
 
     if connectable is None:
-        configuration = config.get_section(config.config_ini_section) or {}
-        configuration["sqlalchemy.url"] = get_url()
-        connectable = engine_from_config(
-            configuration,
-            prefix="sqlalchemy.",
-            poolclass=pool.NullPool,
-        )
-
-        with connectable.connect() as connection:
-            do_run_migrations(connection)
+        asyncio.run(run_async_migrations())
     else:
+        # A caller (e.g. the test suite) handed us an already open sync connection.
         do_run_migrations(connectable)
 
+async def run_async_migrations():
+    # Run migrations through the same async driver the application uses.
+    configuration = config.get_section(config.config_ini_section) or {}
+    configuration["sqlalchemy.url"] = to_async_url(get_url())
+    connectable = async_engine_from_config(
+        configuration,
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
 def do_run_migrations(connection):
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # One transaction per migration file, since some migrations commit in batches
+    # (autocommit blocks) to avoid holding locks for the whole upgrade.
+    context.configure(connection=connection, target_metadata=target_metadata, transaction_per_migration=True)
     with context.begin_transaction():
         context.run_migrations()
 
@@ -0,0 +1,86 @@
+"""add compact keys
+
+Revision ID: 3f7b1c9d4e28
+Revises: 9e4a7c2d1f60
+Create Date: 2026-10-18 17:21:09.530461
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.key_codec import compact_columns
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7b1c9d4e28'
+down_revision: Union[str, Sequence[str], None] = '9e4a7c2d1f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows encoded per backfill round; each round commits on its own.
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _table(name: str):
+    return sa.table(
+        name,
+        sa.column('id', sa.Integer),
+        sa.column('key', sa.String),
+        sa.column('secret_key', sa.String),
+        sa.column('key_id', sa.BigInteger),
+        sa.column('secret_token', sa.LargeBinary),
+    )
+
+
+def _backfill(table):
+    last_id = 0
+    while True:
+        rows = op.get_bind().execute(
+            sa.select(table.c.id, table.c.key, table.c.secret_key)
+            .where(table.c.id > last_id, table.c.key_id.is_(None))
+            .order_by(table.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = [
+            {'row_id': row.id, **columns}
+            for row in rows
+            if (columns := compact_columns(row.key or '', row.secret_key or ''))['key_id'] is not None
+        ]
+        if values:
+            op.get_bind().execute(
+                table.update().where(table.c.id == sa.bindparam('row_id'))
+                .values(key_id=sa.bindparam('key_id'), secret_token=sa.bindparam('secret_token')),
+                values,
+            )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable columns without a default: metadata-only changes, no table rewrite.
+    for table in ('urls', 'urls_archive'):
+        op.add_column(table, sa.Column('key_id', sa.BigInteger(), nullable=True))
+        op.add_column(table, sa.Column('secret_token', sa.LargeBinary(length=6), nullable=True))
+
+    # Backfill and index outside of one long transaction so the tables are never locked
+    # for the whole run. Rows created meanwhile already get their compact forms from the
+    # app; `python manage.py compact-keys` encodes any rows written by an older version.
+    with op.get_context().autocommit_block():
+        _backfill(_table('urls'))
+        _backfill(_table('urls_archive'))
+        op.create_index(op.f('ix_urls_key_id'), 'urls', ['key_id'], unique=True, postgresql_concurrently=True)
+        op.create_index(op.f('ix_urls_archive_key_id'), 'urls_archive', ['key_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_urls_archive_key_id'), table_name='urls_archive', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_urls_key_id'), table_name='urls', postgresql_concurrently=True)
+    for table in ('urls', 'urls_archive'):
+        op.drop_column(table, 'secret_token')
+        op.drop_column(table, 'key_id')
@@ -0,0 +1,48 @@
+"""add link expiry
+
+Revision ID: 5b8e2f1a9c3d
+Revises: c4317527dcc4
+Create Date: 2026-10-18 14:20:11.402318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e2f1a9c3d'
+down_revision: Union[str, Sequence[str], None] = 'c4317527dcc4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable columns without a default: metadata-only changes, no table rewrite.
+    op.add_column('urls', sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('urls', sa.Column('max_clicks', sa.Integer(), nullable=True))
+
+    # Partial indexes: only active links with a limit are indexed, so they stay small
+    # and the sweeper never scans the rest of the table. Built without blocking writes.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urls_expires_at_active', 'urls', ['expires_at'], unique=False, postgresql_concurrently=True,
+            postgresql_where=sa.text('is_active AND expires_at IS NOT NULL'),
+            sqlite_where=sa.text('is_active AND expires_at IS NOT NULL'),
+        )
+        op.create_index(
+            'ix_urls_max_clicks_active', 'urls', ['id'], unique=False, postgresql_concurrently=True,
+            postgresql_where=sa.text('is_active AND max_clicks IS NOT NULL'),
+            sqlite_where=sa.text('is_active AND max_clicks IS NOT NULL'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_urls_max_clicks_active', table_name='urls', postgresql_concurrently=True)
+        op.drop_index('ix_urls_expires_at_active', table_name='urls', postgresql_concurrently=True)
+    op.drop_column('urls', 'max_clicks')
+    op.drop_column('urls', 'expires_at')
@@ -0,0 +1,41 @@
+"""add shared links
+
+Revision ID: 7c1e5d3a9b42
+Revises: e2a9f4c7b815
+Create Date: 2026-10-18 23:41:27.118406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e5d3a9b42'
+down_revision: Union[str, Sequence[str], None] = 'e2a9f4c7b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SHARED_ACTIVE = sa.text('is_active AND shared')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable column without a default: a metadata-only change, no table rewrite.
+    # Existing links stay unshared, so repeated targets created before do not conflict;
+    # dedup keeps returning the oldest of them.
+    op.add_column('urls', sa.Column('shared', sa.Boolean(), nullable=True))
+    # The index starts out empty, so building it concurrently is quick.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_urls_shared_target', 'urls', ['target_hash'], unique=True,
+            postgresql_where=SHARED_ACTIVE, sqlite_where=SHARED_ACTIVE, postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('uq_urls_shared_target', table_name='urls', postgresql_concurrently=True)
+    op.drop_column('urls', 'shared')
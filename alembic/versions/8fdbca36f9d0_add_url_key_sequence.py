@@ -0,0 +1,32 @@
+"""add url key sequence
+
+Revision ID: 8fdbca36f9d0
+Revises: 8d6db6ffc255
+Create Date: 2026-10-18 10:12:31.418204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8fdbca36f9d0'
+down_revision: Union[str, Sequence[str], None] = '8d6db6ffc255'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Counter behind KEYGEN_STRATEGY=sequence. Sequences only exist on PostgreSQL;
+    # other databases (e.g. SQLite for local runs) must use KEYGEN_STRATEGY=random.
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(sa.schema.CreateSequence(sa.Sequence('url_key_seq', start=1, cache=1)))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(sa.schema.DropSequence(sa.Sequence('url_key_seq')))
@@ -0,0 +1,67 @@
+"""add url archive
+
+Revision ID: 9e4a7c2d1f60
+Revises: 5b8e2f1a9c3d
+Create Date: 2026-10-18 16:05:37.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4a7c2d1f60'
+down_revision: Union[str, Sequence[str], None] = '5b8e2f1a9c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # All three columns are metadata-only changes: nullable without a default, or (on
+    # PostgreSQL 11+) with the non-volatile now(), which existing rows read as the
+    # migration time without the table being rewritten. SQLite cannot add a column
+    # with a non-constant default; rows created by the app get the ORM default there.
+    created_default = sa.text('now()') if op.get_bind().dialect.name == 'postgresql' else None
+    op.add_column('urls', sa.Column('created_at', sa.DateTime(timezone=True), nullable=True, server_default=created_default))
+    op.add_column('urls', sa.Column('deactivated_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('urls', sa.Column('last_clicked_at', sa.DateTime(timezone=True), nullable=True))
+
+    # A new, empty table: no lock on urls. Rows are moved into it in small batches by the
+    # archiver at runtime, never by this migration.
+    op.create_table(
+        'urls_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(), nullable=True),
+        sa.Column('secret_key', sa.String(), nullable=True),
+        sa.Column('target_url', sa.String(), nullable=True),
+        sa.Column('target_hash', sa.LargeBinary(length=16), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('clicks', sa.Integer(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('max_clicks', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('deactivated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_clicked_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_urls_archive_key'), 'urls_archive', ['key'], unique=False)
+    op.create_index(op.f('ix_urls_archive_secret_key'), 'urls_archive', ['secret_key'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Archived rows are moved back first, so the downgrade loses no links.
+    op.execute(
+        'INSERT INTO urls (id, key, secret_key, target_url, target_hash, is_active, clicks, expires_at, max_clicks) '
+        'SELECT id, key, secret_key, target_url, target_hash, is_active, clicks, expires_at, max_clicks FROM urls_archive'
+    )
+    op.drop_index(op.f('ix_urls_archive_secret_key'), table_name='urls_archive')
+    op.drop_index(op.f('ix_urls_archive_key'), table_name='urls_archive')
+    op.drop_table('urls_archive')
+    op.drop_column('urls', 'last_clicked_at')
+    op.drop_column('urls', 'deactivated_at')
+    op.drop_column('urls', 'created_at')
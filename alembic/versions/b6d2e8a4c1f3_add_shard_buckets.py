@@ -0,0 +1,86 @@
+"""add shard buckets
+
+Revision ID: b6d2e8a4c1f3
+Revises: 3f7b1c9d4e28
+Create Date: 2026-10-18 19:02:44.216307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.shards import bucket_of
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d2e8a4c1f3'
+down_revision: Union[str, Sequence[str], None] = '3f7b1c9d4e28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows given a bucket per backfill round; each round commits on its own.
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _table(name: str):
+    return sa.table(
+        name,
+        sa.column('id', sa.Integer),
+        sa.column('key', sa.String),
+        sa.column('shard_bucket', sa.SmallInteger),
+    )
+
+
+def _backfill(table):
+    last_id = 0
+    while True:
+        rows = op.get_bind().execute(
+            sa.select(table.c.id, table.c.key)
+            .where(table.c.id > last_id, table.c.shard_bucket.is_(None))
+            .order_by(table.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        op.get_bind().execute(
+            table.update().where(table.c.id == sa.bindparam('row_id')).values(shard_bucket=sa.bindparam('bucket')),
+            [{'row_id': row.id, 'bucket': bucket_of(row.key or '')} for row in rows],
+        )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Run on every shard. The shard map is only read on shard 0 and stays empty elsewhere.
+    op.create_table(
+        'shard_map',
+        sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('moving_to', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('bucket'),
+    )
+    # Nullable columns without a default: metadata-only changes, no table rewrite.
+    for table in ('urls', 'urls_archive'):
+        op.add_column(table, sa.Column('shard_bucket', sa.SmallInteger(), nullable=True))
+
+    # Same approach as the compact keys migration: batched backfill and concurrent
+    # index builds outside of one long transaction. Rows written by an older version
+    # in the meantime are given a bucket by `manage.py rebalance` before it moves them.
+    with op.get_context().autocommit_block():
+        _backfill(_table('urls'))
+        _backfill(_table('urls_archive'))
+        op.create_index(op.f('ix_urls_shard_bucket'), 'urls', ['shard_bucket'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_urls_archive_shard_bucket'), 'urls_archive', ['shard_bucket'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Only safe on an unsharded deployment: rows on other shards are not brought back.
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_urls_archive_shard_bucket'), table_name='urls_archive', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_urls_shard_bucket'), table_name='urls', postgresql_concurrently=True)
+    for table in ('urls', 'urls_archive'):
+        op.drop_column(table, 'shard_bucket')
+    op.drop_table('shard_map')
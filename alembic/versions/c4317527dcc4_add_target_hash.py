@@ -0,0 +1,66 @@
+"""add target hash
+
+Revision ID: c4317527dcc4
+Revises: 8fdbca36f9d0
+Create Date: 2026-10-18 11:02:44.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.url_utils import target_url_hash
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4317527dcc4'
+down_revision: Union[str, Sequence[str], None] = '8fdbca36f9d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows hashed per backfill round; each round commits on its own.
+BACKFILL_BATCH_SIZE = 5000
+
+urls = sa.table(
+    'urls',
+    sa.column('id', sa.Integer),
+    sa.column('target_url', sa.String),
+    sa.column('target_hash', sa.LargeBinary),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable column without a default: a metadata-only change, no table rewrite.
+    op.add_column('urls', sa.Column('target_hash', sa.LargeBinary(length=16), nullable=True))
+
+    # Backfill and index outside of one long transaction so the table is never locked
+    # for the whole run. Rows created meanwhile already get their hash from the app.
+    with op.get_context().autocommit_block():
+        last_id = 0
+        while True:
+            rows = op.get_bind().execute(
+                sa.select(urls.c.id, urls.c.target_url)
+                .where(urls.c.id > last_id, urls.c.target_hash.is_(None))
+                .order_by(urls.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            op.get_bind().execute(
+                urls.update().where(urls.c.id == sa.bindparam('row_id')).values(target_hash=sa.bindparam('hash')),
+                [{'row_id': row.id, 'hash': target_url_hash(row.target_url or '')} for row in rows],
+            )
+            last_id = rows[-1].id
+
+        op.create_index(op.f('ix_urls_target_hash'), 'urls', ['target_hash'], unique=False, postgresql_concurrently=True)
+        op.drop_index(op.f('ix_urls_target_url'), table_name='urls', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_urls_target_url'), 'urls', ['target_url'], unique=False, postgresql_concurrently=True)
+        op.drop_index(op.f('ix_urls_target_hash'), table_name='urls', postgresql_concurrently=True)
+    op.drop_column('urls', 'target_hash')
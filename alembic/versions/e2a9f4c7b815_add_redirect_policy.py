@@ -0,0 +1,35 @@
+"""add redirect policy
+
+Revision ID: e2a9f4c7b815
+Revises: b6d2e8a4c1f3
+Create Date: 2026-10-18 21:14:09.532871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9f4c7b815'
+down_revision: Union[str, Sequence[str], None] = 'b6d2e8a4c1f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable columns without a default (NULL = the configured policy): no table rewrite.
+    for table in ('urls', 'urls_archive'):
+        op.add_column(table, sa.Column('redirect_code', sa.SmallInteger(), nullable=True))
+        op.add_column(table, sa.Column('max_age', sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column('s_maxage', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('urls', 'urls_archive'):
+        op.drop_column(table, 's_maxage')
+        op.drop_column(table, 'max_age')
+        op.drop_column(table, 'redirect_code')
@@ -1,9 +1,14 @@
 from fastapi import APIRouter
+from .endpoints.edge import router as edge_router
 from .endpoints.health import router as health_router
+from .endpoints.metrics import router as metrics_router
 from .endpoints.urls import router as urls_router
 
 router = APIRouter()
 router.include_router(health_router, tags=["health"])
+# Registered before the URL routes so /metrics is not taken for a short key.
+router.include_router(metrics_router, tags=["metrics"])
+router.include_router(edge_router, tags=["edge"])
 router.include_router(urls_router, tags=["urls"])
 
 __all__ = ["router"]
\ No newline at end of file
@@ -0,0 +1,175 @@
+# -------------------------------------------------------
+# Admission Control
+# -------------------------------------------------------
+# This module sheds load before it reaches the database when a worker is
+# overloaded, answering 503 with Retry-After straight away instead of letting
+# requests queue up until every request is slow and clients time out.
+#   - Requests are sorted into classes: redirects (GET /{key}), link creation
+#     (POST /url, POST /urls/batch) and admin calls (/admin/..., /edge/...).
+#     Each class handles at most ADMISSION_*_CONCURRENCY requests at once; more
+#     wait in line (FIFO) for a slot.
+#   - Queue-time shedding: a request that waited ADMISSION_MAX_QUEUE_TIME seconds
+#     without getting a slot is shed, and so is one arriving while
+#     ADMISSION_MAX_QUEUE requests of its class are already waiting.
+#   - Redirects are cheap and come first: link creation and admin calls are shed
+#     at once while redirects are waiting for a slot or the primary's connection
+#     pool has no free connection, leaving the capacity to redirects.
+#   - A database pool checkout that times out (DB_POOL_TIMEOUT) is answered with
+#     the same 503, if the response has not started yet.
+# Health probes, /metrics and the docs are never limited, so an overloaded worker
+# still reports itself. Limits are per worker process.
+# -------------------------------------------------------
+
+import asyncio
+import json
+from collections import deque
+from logging import WARNING
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Counter, Gauge
+from app.database.database import async_engine
+from .fast_redirect import KEY_PATH
+
+settings = get_settings()
+
+REDIRECT, CREATE, ADMIN = "redirect", "create", "admin"
+CREATE_PATHS = ("/url", "/urls/batch")
+ADMIN_PREFIXES = ("/admin/", "/edge/")
+
+ADMISSION_SHED = Counter("admission_shed_total", "Requests shed with 503 by admission control.", ("route_class", "reason"))
+
+SHED_BODY = json.dumps({"detail": "The service is overloaded; retry later."}).encode()
+
+
+def route_class(method: str, path: str) -> str | None:
+    # Class of a request, or None for requests that are never limited.
+    if method == "GET" and KEY_PATH.fullmatch(path):
+        return REDIRECT
+    if method == "POST" and path in CREATE_PATHS:
+        return CREATE
+    if path.startswith(ADMIN_PREFIXES):
+        return ADMIN
+    return None
+
+
+def pool_exhausted(engine=async_engine) -> bool:
+    # Whether every connection the pool may open is checked out.
+    return engine.pool.checkedout() >= settings.db_pool_size + settings.db_max_overflow
+
+
+class ConcurrencyLimit:
+    def __init__(self, name: str, limit: int, max_queue: int, max_queue_time: float):
+        # limit 0: no limit.
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> str | None:
+        # None once the request holds a slot (release() it), else why it was shed.
+        if not self.limit or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.max_queue_time, self._expire, waiter)
+        try:
+            # release() hands its slot over with True; _expire() gives up with False.
+            if await waiter:
+                return None
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            # The client went away; pass the slot on if it had just been handed over.
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.set_result(False)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot goes straight to the next request in line.
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, limits: dict[str, ConcurrencyLimit] | None = None):
+        self.app = app
+        self.limits = limits or admission_limits
+
+    async def shed(self, send, route: str, reason: str):
+        ADMISSION_SHED.labels(route, reason).inc()
+        logging.event("load_shed", WARNING, "Shed a %s request: %s", route, reason, route_class=route, reason=reason)
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(SHED_BODY)).encode()),
+            (b"retry-after", str(settings.admission_retry_after).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 503, "headers": headers})
+        await send({"type": "http.response.body", "body": SHED_BODY})
+
+    async def __call__(self, scope, receive, send):
+        route = route_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        limit = self.limits[route]
+        if route != REDIRECT and (self.limits[REDIRECT].queued or pool_exhausted()):
+            await self.shed(send, route, "priority")
+            return
+        if (reason := await limit.acquire()) is not None:
+            await self.shed(send, route, reason)
+            return
+
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except PoolTimeoutError:
+            if started:
+                raise
+            await self.shed(send, route, "pool_timeout")
+        finally:
+            limit.release()
+
+
+admission_limits = {
+    name: ConcurrencyLimit(name, limit, settings.admission_max_queue, settings.admission_max_queue_time)
+    for name, limit in (
+        (REDIRECT, settings.admission_redirect_concurrency),
+        (CREATE, settings.admission_create_concurrency),
+        (ADMIN, settings.admission_admin_concurrency),
+    )
+}
+
+for _limit in admission_limits.values():
+    Gauge(f"admission_{_limit.name}_active", f"{_limit.name.capitalize()} requests being handled.", lambda limit=_limit: limit.active)
+    Gauge(f"admission_{_limit.name}_queued", f"{_limit.name.capitalize()} requests waiting for a slot.", lambda limit=_limit: limit.queued)
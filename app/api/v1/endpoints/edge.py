@@ -0,0 +1,56 @@
+# -------------------------------------------------------
+# CDN Click Reconciliation Endpoint
+# -------------------------------------------------------
+# Redirects sent with s-maxage (app/core/http_cache.py) can be answered by a
+# CDN from its cache without reaching us, so they are missing from the clicks
+# counters. A job reading the CDN's access logs reports them here, per short
+# key, and they are added through the click buffer like any other click.
+#   - The endpoint is disabled (404) unless EDGE_CLICKS_TOKEN is set, and needs
+#     "Authorization: Bearer <EDGE_CLICKS_TOKEN>".
+#   - Only report cache hits: requests the CDN forwarded to us were counted then.
+#   - Unique visitors cannot be reconciled (the CDN logs are not fingerprinted),
+#     and redirects served from browser caches (max-age) are never seen at all.
+# Clicks of links that have been deactivated or archived since are dropped.
+# -------------------------------------------------------
+
+import hmac
+
+from fastapi import APIRouter, Request
+
+from app import schemas
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Counter
+from app.database.clicks import click_buffer
+from app.database.key_filter import key_filter
+
+router = APIRouter()
+settings = get_settings()
+
+EDGE_CLICKS = Counter("edge_clicks_total", "Clicks reported through POST /edge/clicks.")
+
+# Most keys accepted in one report.
+MAX_KEYS_PER_REPORT = 10_000
+
+
+@router.post("/edge/clicks", response_model=schemas.EdgeClicksResult)
+async def report_edge_clicks(report: schemas.EdgeClicksReport, request: Request):
+    if not settings.edge_clicks_token:
+        logging.raise_not_found(request)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.edge_clicks_token.encode()):
+        logging.raise_unauthorized("A valid edge clicks token is required.")
+    if len(report.clicks) > MAX_KEYS_PER_REPORT:
+        logging.raise_bad_request(message=f"A report can contain at most {MAX_KEYS_PER_REPORT} keys.")
+
+    recorded = ignored_keys = 0
+    for url_key, count in report.clicks.items():
+        # Keys that were never issued would only be dropped by the flush.
+        if count < 1 or not key_filter.might_exist(url_key):
+            ignored_keys += 1
+            continue
+        await click_buffer.record(url_key, count)
+        recorded += count
+    EDGE_CLICKS.inc(recorded)
+    logging.logger.info("Recorded %d clicks served by the CDN for %d keys", recorded, len(report.clicks))
+    return schemas.EdgeClicksResult(recorded=recorded, ignored_keys=ignored_keys)
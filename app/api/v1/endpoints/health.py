@@ -1,23 +1,66 @@
 # -------------------------------------------------------
 # Health Check Endpoint
 # -------------------------------------------------------
-# This module provides a simple health check endpoint that verifies the API
-# is running and responsive. Used for monitoring and load balancer health checks.
+# This module provides the health check endpoints used for monitoring, load
+# balancer and container health checks.
+#   - /livez: is this worker still working? Does not depend on Postgres or Redis.
+#   - /readyz: should it get traffic? The latest results of the background
+#     dependency checks (app/database/health.py), with latencies, pool usage,
+#     warm-up status and event loop lag. /ready is kept as an alias.
+#   - /health: the database part of /readyz, in the original format.
+# None of them opens a database session per request.
 # -------------------------------------------------------
 
 from fastapi import APIRouter
-from app.database import get_db
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from fastapi.responses import JSONResponse
+from app.database.caching import redis_breaker
+from app.database.database import replica_router, shard_router
+from app.database.health import health_checker
+from app.database.key_filter import key_filter
+from app.database.local_cache import local_cache, invalidation_listener
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
-    # Check DB connection
-    try:
-        db: Session = next(get_db())
-        db.execute(text("SELECT 1"))
-    except Exception as e:
-        return {"status": "unhealthy", "detail": f"Database connection error: {str(e)}"}
-    return {"status": "db healthy"}
\ No newline at end of file
+    # Database status from the latest background check.
+    report = await health_checker.latest()
+    errors = [f"{name}: {result['error']}" for name, result in report["databases"].items() if not result["ok"]]
+    if errors:
+        body = {"status": "unhealthy", "detail": f"Database connection error: {'; '.join(errors)}"}
+        return JSONResponse(body, status_code=503)
+    return {"status": "db healthy"}
+
+@router.get("/livez")
+async def liveness():
+    # 503 only if the background checker has stopped running (the event loop is stuck
+    # or the checker died); restarting the worker is then the right thing to do.
+    alive = health_checker.alive()
+    return JSONResponse({"status": "alive" if alive else "dead"}, status_code=200 if alive else 503)
+
+@router.get("/readyz")
+@router.get("/ready")
+async def readiness():
+    # Not ready (503) while a database is unreachable, the startup cache warm-up is
+    # running or the event loop is lagging, so load balancers hold traffic back.
+    ready, body = await health_checker.readiness()
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@router.get("/health/replicas")
+async def replica_health():
+    # Read replica health, lag and routing counters for this worker.
+    return replica_router.stats()
+
+@router.get("/health/shards")
+async def shard_health():
+    # Buckets per shard according to this worker's copy of the shard map.
+    return shard_router.stats()
+
+@router.get("/health/cache")
+async def cache_health():
+    # Report in-process cache usage and hit/miss counters for this worker.
+    return {
+        "redis": redis_breaker.stats(),
+        "local_cache": {**local_cache.stats(), "invalidation_subscribed": invalidation_listener.subscribed},
+        "key_filter": key_filter.stats(),
+    }
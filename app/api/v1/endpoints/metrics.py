@@ -0,0 +1,22 @@
+# -------------------------------------------------------
+# Metrics Endpoint
+# -------------------------------------------------------
+# This module exposes the application metrics in the Prometheus text format.
+# Each worker serves its own values; scrape every worker (or run a single one
+# per target) and aggregate in Prometheus.
+# -------------------------------------------------------
+
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core import logging, metrics
+from app.core.config import get_settings
+
+router = APIRouter()
+settings = get_settings()
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics(request: Request):
+    if not settings.metrics_enabled:
+        logging.raise_not_found(request)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -6,66 +6,173 @@
 # view URL statistics, and delete (deactivate) shortened URLs.
 # All endpoints integrate with the database CRUD layer for persistence and
 # use dependency injection to obtain database sessions.
+# Redirects also count the client as a visitor of the link (visitors.py), and are
+# sent with the link's status code and Cache-Control (app/core/http_cache.py).
+# Admin info can be revalidated with ETag / Last-Modified.
+# Link creation is rate limited per client address (rate_limit.py).
 # -------------------------------------------------------
 
-from fastapi import APIRouter, Depends, Request
+from datetime import date, datetime, timezone
+from logging import INFO
+from typing import NamedTuple
+
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from redis.asyncio import Redis
 import asyncio
+from contextlib import nullcontext
 
 from app.core import logging
+from app.core.config import get_settings
+from app.core.edge_purge import edge_purger
+from app.core.http_cache import RedirectPolicy, etag, http_date, link_policy, not_modified, validate_policy
+from app.core.metrics import (
+    REDIRECT_BREAKER_OPEN, REDIRECT_ERROR, REDIRECT_HIT, REDIRECT_L1_HIT, REDIRECT_MISS, REDIRECT_NOT_FOUND, REDIRECT_REJECTED, REDIRECT_TIMEOUT,
+)
 from app import schemas
 from app.core.url_utils import get_admin_info
 from app.database import crud, get_db, get_redis
+from app.database.caching import (
+    decode_entry, encode_entry, get_with_ttl, redis_breaker, refresh_if_due, safe_redis_delete, safe_redis_set, safe_redis_set_many,
+    seconds_until, redis_wait,
+)
+from app.database.clicks import click_buffer
+from app.database.key_filter import key_filter
+from app.database.local_cache import local_cache, publish_invalidation
+from app.database.rate_limit import create_rate_limit
+from app.database.single_flight import url_loads
+from app.database.visitors import visitor_counter
 
 import validators
 
 # Create a router instance to register all URL-related endpoints.
 router = APIRouter()
+settings = get_settings()
+
+class ClickLimited(NamedTuple):
+    # Loader result for links with a click limit: every redirect must be counted in the DB.
+    policy: RedirectPolicy
+
+def validate_url(url: schemas.URLBase) -> str | None:
+    # Error message for an invalid link request, or None.
+    # The URL must include http:// or https:// protocol.
+    if not validators.url(url.target_url):
+        return "Your provided URL is not valid. **Must include http:// or https://**"
+    if url.expires_at is not None and (seconds_until(url.expires_at) or 0) <= 0:
+        return "expires_at must be in the future."
+    if url.max_clicks is not None and url.max_clicks < 1:
+        return "max_clicks must be at least 1."
+    return validate_policy(url.redirect_code, url.max_age, url.s_maxage)
+
+async def check_create_rate(request: Request, redis_client: Redis, cost: int = 1):
+    # Take `cost` tokens from the client's link creation bucket, or raise a 429.
+    identity = request.client.host if request.client else "unknown"
+    if (retry_after := await create_rate_limit.acquire(redis_client, identity, cost)) is not None:
+        logging.raise_too_many_requests(f"Too many links created by {identity}; retry later.", retry_after)
+
+def redirect_response(entry: str) -> RedirectResponse:
+    # Redirect for a cache entry (see caching.encode_entry), with the link's status code and Cache-Control.
+    target_url, expires_in, policy = decode_entry(entry)
+    policy = policy.capped(expires_in)
+    return RedirectResponse(target_url, status_code=policy.status_code, headers={"cache-control": policy.cache_control})
+
+async def lookup_target(url_key: str, redis_client: Redis, open_session) -> str | None:
+    # Redis with a short timeout, then the DB; on any cache error/timeouts, fall back to DB.
+    # Counts the click when the link is found, and returns its cache entry (target URL,
+    # expiry and redirect policy, see caching.decode_entry) or None.
+    # `open_session` returns an async context manager yielding a DB session, so callers
+    # that have none yet (the redirect fast path) only open one on a cache miss.
+    # While the Redis circuit breaker is open, go straight to the DB instead of waiting for a timeout.
+    if not redis_breaker.allow():
+        REDIRECT_BREAKER_OPEN.inc()
+    else:
+        try:
+            # small timeout so Redis latency doesn't slow down requests
+            cached, remaining = await redis_wait(get_with_ttl(redis_client, url_key), timeout=0.25)
+            cached_url, expires_in, _ = decode_entry(cached)
+            # Redis TTLs are capped at the link's expiry; the check covers the last second.
+            if cached_url and (expires_in is None or expires_in > 0):
+                REDIRECT_HIT.inc()
+                # Hot entries are extended before they expire, so they never miss.
+                await refresh_if_due(redis_client, url_key, remaining, expires_in)
+                local_cache.set(url_key, cached, ttl=expires_in)
+                await click_buffer.record(url_key)
+                logging.event("cache_hit", INFO, "Cache hit for key=%s; redirecting", url_key, key=url_key)
+                return cached
+        except asyncio.TimeoutError:
+            REDIRECT_TIMEOUT.inc()
+            logging.logger.warning("Redis GET timed out for key=%s; falling back to DB", url_key)
+        except Exception:
+            REDIRECT_ERROR.inc()
+            logging.logger.error("Failed to retrieve URL from Redis (key=%s); falling back to DB", url_key, exc_info=True)
+
+    # DB fallback. Concurrent misses for the same key share one query and cache fill.
+    async def load_target():
+        async with open_session() as db_session:
+            db_url = await crud.get_db_url_by_key(db_session, url_key)
+        if db_url is None:
+            return None
+        logging.event("cache_miss", INFO, "Cache miss for key=%s; fetched from DB", url_key, key=url_key)
+        policy = link_policy(db_url)
+        if db_url.max_clicks is not None:
+            # Never cached: a cache hit could not enforce the limit.
+            return ClickLimited(policy)
+        local_cache.set(url_key, encode_entry(db_url.target_url, db_url.expires_at, policy), ttl=seconds_until(db_url.expires_at))
+        await safe_redis_set(redis_client, db_url.key, db_url.target_url, clicks=db_url.clicks, expires_at=db_url.expires_at, policy=policy)
+        return encode_entry(db_url.target_url, db_url.expires_at, policy)
+
+    async def peek():
+        return await redis_client.get(url_key)
+
+    entry = await url_loads.load(url_key, load_target, peek=peek)
+    if isinstance(entry, ClickLimited):
+        # Each request counts its own click, so it cannot share the leader's result.
+        async with open_session() as db_session:
+            target_url = await crud.consume_click(db_session, url_key)
+        entry = target_url and encode_entry(target_url, None, entry.policy)
+    elif entry:
+        await click_buffer.record(url_key)
+    if entry:
+        REDIRECT_MISS.inc()
+    return entry
 
 @router.get("/{url_key}")
-async def forward_to_target_url(url_key: str, request: Request, db_session: Session = Depends(get_db), redis_client: Redis = Depends(get_redis)):
-    # Try cache first with a short timeout; on any cache error/timeouts, fall back to DB.
-    try:
-        # small timeout so Redis latency doesn't slow down requests
-        cached_url = await asyncio.wait_for(redis_client.get(url_key), timeout=0.25)
-        if cached_url:
-            # confirm the DB record still exists & is active before redirecting
-            db_url = crud.add_click_by_key(db_session, url_key)
-            if db_url:
-                logging.logger.info("Cache hit for key=%s; redirecting", url_key)
-                return RedirectResponse(cached_url)
-            else:
-                # stale cache: attempt best-effort removal, but don't fail if delete errors
-                try:
-                    await asyncio.wait_for(redis_client.delete(url_key), timeout=0.2)
-                except Exception:
-                    logging.logger.warning("Failed to delete stale redis key=%s", url_key, exc_info=True)
-                # fall through to return 404 below
-    except asyncio.TimeoutError:
-        logging.logger.warning("Redis GET timed out for key=%s; falling back to DB", url_key)
-    except Exception:
-        logging.logger.error("Failed to retrieve URL from Redis (key=%s); falling back to DB", url_key, exc_info=True)
-
-    # DB fallback
-    if db_url := crud.add_click_by_key(db_session, url_key):
-        logging.logger.info("Cache miss for key=%s; fetched from DB", url_key)
-        await _safe_redis_set(redis_client, db_url)      
-        return RedirectResponse(db_url.target_url)
+async def forward_to_target_url(url_key: str, request: Request, db_session: AsyncSession = Depends(get_db), redis_client: Redis = Depends(get_redis)):
+    # Check the in-process cache, then Redis and the DB (lookup_target).
+    # Deactivated links are evicted from both cache tiers by delete_url, so a cache hit can redirect
+    # straight away. Clicks are buffered and flushed to Postgres in batches.
+    # With FAST_REDIRECT_ENABLED, plain lookups are answered by FastRedirectMiddleware
+    # before they get here; keep the two paths in step.
+    if entry := local_cache.get(url_key):
+        REDIRECT_L1_HIT.inc()
+        await click_buffer.record(url_key)
+        visitor_counter.record(url_key, request.scope)
+        return redirect_response(entry)
+
+    # Reject keys that were never issued (or recently confirmed missing) before any round trip.
+    if not key_filter.might_exist(url_key):
+        REDIRECT_REJECTED.inc()
+        logging.raise_not_found(request)
+
+    if entry := await lookup_target(url_key, redis_client, lambda: nullcontext(db_session)):
+        visitor_counter.record(url_key, request.scope)
+        return redirect_response(entry)
 
     # Not found
+    REDIRECT_NOT_FOUND.inc()
+    key_filter.remember_missing(url_key)
     logging.raise_not_found(request)
 
 @router.post("/url", response_model=schemas.URLInfo)
-async def create_url(url: schemas.URLBase, db_session: Session = Depends(get_db), redis_client: Redis = Depends(get_redis)):
-    # Validate the provided target URL format using the validators library.
-    # The URL must include http:// or https:// protocol.
-    if not validators.url(url.target_url):
-        logging.raise_bad_request(message="Your provided URL is not valid. **Must include http:// or https://**")
+async def create_url(url: schemas.URLBase, request: Request, db_session: AsyncSession = Depends(get_db), redis_client: Redis = Depends(get_redis)):
+    # Validate the provided target URL format using the validators library, and the optional limits.
+    if error := validate_url(url):
+        logging.raise_bad_request(message=error)
+    await check_create_rate(request, redis_client)
 
     # Create a new URL record in the database with auto-generated keys.
-    db_url = crud.create_db_url(db_session, url)
+    db_url = await crud.create_db_url(db_session, url)
     
     # Set the shortened URL key for the response (public short link).
     db_url.url = db_url.key
@@ -73,7 +180,9 @@ async def create_url(url: schemas.URLBase, db_session: Session = Depends(get_db)
     # Set the admin secret key for the response (used for delete/update operations).
     db_url.admin_url = db_url.secret_key
 
-    await _safe_redis_set(redis_client, db_url)
+    # Click-limited links are never cached (see lookup_target).
+    if db_url.max_clicks is None:
+        await safe_redis_set(redis_client, db_url.key, db_url.target_url, expires_at=db_url.expires_at, policy=link_policy(db_url))
     # Construct and return a Pydantic response while the DB session is still
     # open to avoid lazy-loading or additional DB access during serialization.
     # For Pydantic v2 use `model_validate` (schemas.Config sets from_attributes=True).
@@ -83,31 +192,114 @@ async def create_url(url: schemas.URLBase, db_session: Session = Depends(get_db)
         # Fallback for older Pydantic versions (from_orm)
         return schemas.URLInfo.from_orm(db_url)
 
+@router.post("/urls/batch", response_model=schemas.URLBatchResponse)
+async def create_urls_batch(
+    batch: schemas.URLBatchRequest, request: Request, db_session: AsyncSession = Depends(get_db), redis_client: Redis = Depends(get_redis),
+):
+    # Shorten many URLs in one request. Invalid URLs are reported per item and do not
+    # fail the rest of the batch.
+    if not batch.urls:
+        logging.raise_bad_request(message="The batch must contain at least one URL.")
+    if len(batch.urls) > settings.batch_max_size:
+        logging.raise_bad_request(message=f"A batch can contain at most {settings.batch_max_size} URLs.")
+    if create_rate_limit.enabled and len(batch.urls) > create_rate_limit.burst:
+        # It would never fit in the client's rate limit bucket.
+        logging.raise_bad_request(message=f"A batch can contain at most {create_rate_limit.burst} URLs (CREATE_RATE_BURST).")
+    # Every URL counts against the rate limit, valid or not.
+    await check_create_rate(request, redis_client, len(batch.urls))
+
+    items = [schemas.URLBatchItem(index=index) for index in range(len(batch.urls))]
+    valid = []
+    for item, url in zip(items, batch.urls):
+        if error := validate_url(url):
+            item.error = error
+        else:
+            valid.append(item)
+
+    # Keys are allocated in bulk and all rows are written with multi-row inserts.
+    created = await crud.create_db_urls(db_session, [batch.urls[item.index] for item in valid])
+    for item, db_url in zip(valid, created):
+        if db_url is None:
+            item.error = "Could not allocate a short key for this URL."
+            continue
+        db_url.url = db_url.key
+        db_url.admin_url = db_url.secret_key
+        item.url = schemas.URLInfo.model_validate(db_url)
+
+    # Fill the cache for every new link with one pipelined call (click-limited links are never cached).
+    cacheable = [db_url for db_url in created if db_url and db_url.max_clicks is None]
+    await safe_redis_set_many(
+        redis_client,
+        {db_url.key: db_url.target_url for db_url in cacheable},
+        expires={db_url.key: db_url.expires_at for db_url in cacheable if db_url.expires_at is not None},
+        policies={db_url.key: link_policy(db_url) for db_url in cacheable},
+    )
+
+    failed = sum(item.error is not None for item in items)
+    return schemas.URLBatchResponse(created=len(items) - failed, failed=failed, items=items)
+
 @router.get("/admin/{secret_key}", name="administration info", response_model=schemas.URLInfo)
-async def get_url_info(secret_key: str, request: Request, db_session: Session = Depends(get_db)):
+async def get_url_info(
+    secret_key: str, request: Request, visitors_since: date | None = None, visitors_until: date | None = None,
+    db_session: AsyncSession = Depends(get_db),
+):
     # Retrieve the URL record using the provided secret key for authentication.
-    if db_url := crud.get_db_url_by_secret_key(db_session, secret_key):
+    # Deactivated, expired and archived links are reported too (is_active is false).
+    # unique_visitors covers the UTC days visitors_since..visitors_until, by default the
+    # whole UNIQUE_VISITORS_RETENTION_DAYS period.
+    # The response carries an ETag and Last-Modified; a matching If-None-Match (or, without
+    # one, an If-Modified-Since no older than Last-Modified) gets a 304 without a body.
+    db_url = await crud.get_db_url_by_secret_key(db_session, secret_key, include_inactive=True)
+    if db_url is None:
+        db_url = await crud.get_archived_db_url_by_secret_key(db_session, secret_key)
+    if db_url:
         # URL found: return formatted admin information including statistics.
-        return get_admin_info(db_url)
+        # Clicks still waiting in the buffer are reported separately from the stored count.
+        db_url.pending_clicks = await click_buffer.pending(db_url.key)
+        db_url.unique_visitors = await visitor_counter.count(db_url.key, visitors_since, visitors_until)
+        body = schemas.URLInfo.model_validate(get_admin_info(db_url)).model_dump_json().encode()
+        current_etag = etag(body)
+        last_modified = admin_info_last_modified(db_url)
+        # Clients may keep the response but must revalidate it before every use.
+        headers = {
+            "etag": current_etag, "last-modified": http_date(last_modified or datetime.now(timezone.utc)), "cache-control": "private, no-cache",
+        }
+        if not_modified(request.headers, current_etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
     else:
-        # URL not found or inactive: raise a 404 error with detailed logging.
+        # URL not found: raise a 404 error with detailed logging.
         logging.raise_not_found(request)
 
 
+def admin_info_last_modified(db_url) -> datetime | None:
+    # Latest change to the link's admin info, None while it is changing. Counters only
+    # move with clicks: while some are pending the info is changing; flushed ones set
+    # last_clicked_at. Visitors are written before the clicks that come with them are flushed.
+    # unique_visitors also changes without clicks at each UTC midnight: the default window
+    # moves by a day, and the daily sketches past the retention period expire.
+    if db_url.pending_clicks:
+        return None
+    moments = [db_url.created_at, db_url.deactivated_at, db_url.last_clicked_at, getattr(db_url, "archived_at", None)]
+    if visitor_counter.enabled:
+        moments.append(datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0))
+    moments = [moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc) for moment in moments if moment is not None]
+    return max(moments, default=datetime.now(timezone.utc))
+
+
 @router.delete("/admin/{secret_key}", name="delete url")
-async def delete_url(secret_key: str, request: Request, db_session: Session = Depends(get_db)):
+async def delete_url(secret_key: str, request: Request, db_session: AsyncSession = Depends(get_db), redis_client: Redis = Depends(get_redis)):
     # Retrieve and deactivate the URL record using the provided secret key for authentication.
-    if db_url := crud.deactivate_db_url_by_secret_key(db_session, secret_key):
+    if db_url := await crud.deactivate_db_url_by_secret_key(db_session, secret_key):
+        # Evict the cached target from every worker and from Redis so cache hits
+        # stop redirecting to the deactivated link.
+        await publish_invalidation(redis_client, db_url.key)
+        if not await safe_redis_delete(redis_client, db_url.key):
+            logging.logger.error("Deactivated key=%s may still be served from Redis until its TTL expires", db_url.key)
+        # And from the CDN, in the background (EDGE_PURGE_URL).
+        edge_purger.purge(db_url.key)
         # URL successfully deactivated (soft delete): return confirmation message.
         return {"detail": f"URL with secret key {secret_key} has been deactivated."}
     else:
         # URL not found or already inactive: raise a 404 error with detailed logging.
         logging.raise_not_found(request)
-
-async def _safe_redis_set(redis_client: Redis, db_url):
-    try:
-        await asyncio.wait_for(redis_client.set(db_url.key, db_url.target_url, ex=(3600 * 24)), timeout=0.75)
-    except asyncio.TimeoutError as e:
-        logging.logger.warning("Timed out setting Redis key=%s", db_url.key)
-    except Exception:
-        logging.logger.exception("Error setting Redis key=%s", db_url.key)  
\ No newline at end of file
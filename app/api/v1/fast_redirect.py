@@ -0,0 +1,117 @@
+# -------------------------------------------------------
+# Redirect Fast Path
+# -------------------------------------------------------
+# This module answers `GET /{key}` in a raw ASGI middleware, in front of
+# FastAPI's routing, dependency injection and response classes, since redirects
+# are by far the most frequent request.
+#   - Only GET requests whose path is a single segment of key characters are
+#     handled; everything else (other methods, /health, /docs, ...) is passed to
+#     the application unchanged.
+#   - The lookup is the one forward_to_target_url uses: the in-process cache,
+#     the key filter, Redis, and on a miss the database. A DB session is only
+#     opened on a miss.
+#   - Redirects have the link's status code and Cache-Control (app/core/http_cache.py),
+#     like the route's. The headers are built once per target URL and policy and reused.
+#   - Unknown keys get the same 404 as the route.
+#   - Like the route, a redirect counts the client as a visitor of the link.
+# Requests keep the "/{url_key}" route label in the request metrics.
+# FAST_REDIRECT_ENABLED turns the fast path off, leaving redirects to the route.
+# -------------------------------------------------------
+
+import re
+from functools import lru_cache
+from urllib.parse import quote
+
+import redis.asyncio as redis
+from fastapi import HTTPException, Request
+from fastapi.exception_handlers import http_exception_handler
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.http_cache import RedirectPolicy
+from app.core.metrics import REDIRECT_L1_HIT, REDIRECT_NOT_FOUND, REDIRECT_REJECTED
+from app.database.caching import decode_entry, redis_client
+from app.database.clicks import click_buffer
+from app.database.database import AsyncSessionLocal
+from app.database.key_filter import key_filter
+from app.database.local_cache import local_cache
+from app.database.visitors import visitor_counter
+from .endpoints.urls import lookup_target, router as urls_router
+
+settings = get_settings()
+
+# Paths that can be a short key (keygen.ALPHABET); the app's own pages are lowercase.
+KEY_PATH = re.compile(r"/([A-Z0-9]+)")
+# The route this replaces; requests are labelled with it in the request metrics.
+ROUTE = next(route for route in urls_router.routes if route.path == "/{url_key}")
+# Characters RedirectResponse leaves unquoted in the Location header.
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+
+
+@lru_cache(maxsize=settings.local_cache_max_entries)
+def redirect_headers(target_url: str) -> tuple:
+    # Same headers as RedirectResponse(target_url), built once per target.
+    return ((b"content-length", b"0"), (b"location", quote(target_url, safe=LOCATION_SAFE).encode("latin-1")))
+
+
+@lru_cache(maxsize=1024)
+def policy_headers(policy: RedirectPolicy) -> tuple:
+    return ((b"cache-control", policy.cache_control.encode("latin-1")),)
+
+
+class FastRedirect:
+    def __init__(self, redis_client: redis.Redis, session_factory, enabled: bool = True):
+        self.redis = redis_client
+        self.session_factory = session_factory
+        self.enabled = enabled
+
+    async def resolve(self, url_key: str) -> str | None:
+        # Cache entry of the key (see caching.decode_entry), or None if it does not exist. Counts the click.
+        if entry := local_cache.get(url_key):
+            REDIRECT_L1_HIT.inc()
+            await click_buffer.record(url_key)
+            return entry
+        if not key_filter.might_exist(url_key):
+            REDIRECT_REJECTED.inc()
+            return None
+        if entry := await lookup_target(url_key, self.redis, self.session_factory):
+            return entry
+        REDIRECT_NOT_FOUND.inc()
+        key_filter.remember_missing(url_key)
+        return None
+
+    async def handle(self, url_key: str, scope, receive, send):
+        scope["route"] = ROUTE
+
+        if entry := await self.resolve(url_key):
+            visitor_counter.record(url_key, scope)
+            target_url, expires_in, policy = decode_entry(entry)
+            policy = policy.capped(expires_in)
+            headers = [*redirect_headers(target_url), *policy_headers(policy)]
+            await send({"type": "http.response.start", "status": policy.status_code, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        # Same 404 as the route: raise_not_found logs it, FastAPI's default handler renders it.
+        request = Request(scope, receive)
+        try:
+            logging.raise_not_found(request)
+        except HTTPException as exc:
+            response = await http_exception_handler(request, exc)
+        await response(scope, receive, send)
+
+
+class FastRedirectMiddleware:
+    def __init__(self, app, handler: FastRedirect | None = None):
+        self.app = app
+        self.handler = handler or fast_redirect
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET" and self.handler.enabled:
+            if match := KEY_PATH.fullmatch(scope["path"]):
+                await self.handler.handle(match.group(1), scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+fast_redirect = FastRedirect(redis_client, AsyncSessionLocal, enabled=settings.fast_redirect_enabled)
@@ -0,0 +1,56 @@
+# -------------------------------------------------------
+# Bloom Filter
+# -------------------------------------------------------
+# This module provides a compact probabilistic set used to answer
+# "has this short key ever been issued?" without a database query.
+# A negative answer is always correct; a positive answer is wrong with a
+# probability close to the configured error rate while the filter holds at
+# most `capacity` items.
+# Bit positions are derived from a single blake2b digest using double hashing.
+# -------------------------------------------------------
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Optimal number of bits and hash functions for the requested capacity and error rate.
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.bits_set = 0
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not self._bits[byte] & mask:
+                self._bits[byte] |= mask
+                self.bits_set += 1
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def estimated_false_positive_rate(self) -> float:
+        # Probability that all k positions of an absent item are set, given the current fill ratio.
+        return (self.bits_set / self.num_bits) ** self.num_hashes
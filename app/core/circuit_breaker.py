@@ -0,0 +1,84 @@
+# -------------------------------------------------------
+# Circuit Breaker
+# -------------------------------------------------------
+# This module provides a small circuit breaker used to stop calling a dependency
+# (Redis) while it is failing, instead of waiting out a timeout on every request.
+#
+#   closed    -> calls are allowed; failure_threshold consecutive failures open it.
+#   open      -> calls are refused immediately. Recovery is not tried by requests:
+#                a background probe reports its results, and the first successful
+#                probe after reset_timeout moves the breaker to half-open.
+#   half_open -> calls are allowed again; success_threshold consecutive successes
+#                close it, any failure opens it again.
+#
+# allow() only reads the state, so it is cheap enough to call on every request.
+# The breaker is used from a single event loop and needs no locking.
+# -------------------------------------------------------
+
+import time
+from collections import Counter
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, success_threshold: int = 2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.success_threshold = success_threshold
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        # "closed->open" etc. -> number of times that transition happened.
+        self.transitions: Counter = Counter()
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            self.rejected += 1
+            return False
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.consecutive_successes += 1
+            if self.consecutive_successes >= self.success_threshold:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        self.consecutive_successes = 0
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self._transition(OPEN)
+
+    def record_probe(self, healthy: bool):
+        # Result of a background health check. Only a probe can end the open state.
+        if not healthy:
+            self.record_failure()
+        elif self.state == OPEN:
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                self.record_success()
+        else:
+            self.record_success()
+
+    def _transition(self, state: str):
+        self.transitions[f"{self.state}->{state}"] += 1
+        self.state = state
+        self.consecutive_successes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else 0.0,
+            "rejected_calls": self.rejected,
+            "transitions": dict(self.transitions),
+        }
@@ -11,9 +11,24 @@ import os
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, computed_field
 from functools import lru_cache
+from sqlalchemy.engine import make_url
 
 ENV_FILE = os.getenv('ENV_FILE', '.env.local')
 
+# Async drivers used in place of the synchronous ones for the AsyncEngine.
+# Any URL that already names an async driver is passed through unchanged.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    # Rewrite a synchronous SQLAlchemy URL so it can be used with create_async_engine.
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
 class Settings(BaseSettings):
     # Configuration for loading settings from .env file.
     model_config = SettingsConfigDict(
@@ -41,6 +56,198 @@ class Settings(BaseSettings):
     redis_host: str = Field(..., env="REDIS_HOST")
     # Redis server port
     redis_port: int = Field(..., env="REDIS_PORT")
+    # Where redirect clicks are buffered before being flushed to urls.clicks: "memory" or "redis".
+    click_buffer_backend: str = "memory"
+    # Seconds between periodic click flushes.
+    click_flush_interval: float = 5.0
+    # Number of buffered clicks that triggers an early flush.
+    click_flush_threshold: int = 1000
+    # "at_least_once" retries failed flushes (may double count after a crash),
+    # "bounded_loss" drops a failed batch (never double counts).
+    click_delivery: str = "at_least_once"
+    # In-process (L1) cache in front of Redis: entry limit, approximate memory limit in bytes,
+    # and entry TTL in seconds (upper bound on staleness if an invalidation message is missed).
+    local_cache_max_entries: int = 10_000
+    local_cache_max_bytes: int = 16 * 1024 * 1024
+    local_cache_ttl: float = 30.0
+    # Bloom filter of issued keys: minimum capacity and target false-positive rate.
+    key_filter_capacity: int = 1_000_000
+    key_filter_error_rate: float = 0.001
+    # Negative cache for keys that passed the filter but do not exist: TTL in seconds and size.
+    negative_cache_ttl: float = 60.0
+    negative_cache_max_entries: int = 100_000
+    # Short key generation: "sequence" (permuted Postgres sequence) or "random" (lookup per attempt).
+    keygen_strategy: str = "sequence"
+    # Secret for the key permutation. Keep it stable; defaults to a value derived from DATABASE_PW.
+    keygen_secret: str = ""
+    # Shortest key length; keys widen by one character once KEYGEN_MAX_FILL of the space is used.
+    keygen_min_length: int = 5
+    keygen_max_fill: float = 0.9
+    # Sequence values reserved per round trip by each worker.
+    keygen_block_size: int = 100
+    # Columns used to find links by key and secret key: "string" (key, secret_key) or
+    # "compact" (key_id, secret_token). Switch to "compact" once every row has been encoded
+    # (see `python manage.py compact-keys`).
+    key_storage: str = "string"
+    # Maximum number of URLs accepted by POST /urls/batch.
+    batch_max_size: int = 1000
+    # Return the existing active link when the same (normalized) target is shortened again.
+    # Note that the response includes that link's admin secret, so only enable this
+    # when everyone allowed to create links may also manage each other's links.
+    dedup_target_urls: bool = False
+
+    # Redis TTL (seconds) of links that have no clicks yet, e.g. right after creation.
+    cache_new_ttl: int = 3600
+    # Redis TTL (seconds) of links that have been clicked.
+    cache_ttl: int = 3600 * 24
+    # Redis TTL (seconds) of links with at least cache_hot_clicks clicks.
+    cache_hot_ttl: int = 3600 * 24 * 7
+    # Click count from which a link is cached with cache_hot_ttl.
+    cache_hot_clicks: int = 1000
+    # Every TTL is randomized by up to this fraction in either direction.
+    cache_ttl_jitter: float = 0.1
+    # Early refresh scale in seconds: a Redis hit extends the entry with probability
+    # exp(-remaining_ttl / scale). 0 disables early refresh.
+    cache_refresh_scale: float = 60.0
+
+    # Preload the most-clicked links into Redis and the L1 cache at startup.
+    warmup_enabled: bool = True
+    # Number of links (by clicks, descending) loaded by a warm-up run.
+    warmup_limit: int = 10_000
+    # Seconds after which a warm-up run stops, keeping what it has loaded.
+    warmup_time_budget: float = 30.0
+    # Pipelined Redis writes in flight at once during warm-up.
+    warmup_concurrency: int = 4
+    # Rows fetched per server-side cursor round trip (and per Redis pipeline).
+    warmup_chunk_size: int = 1000
+
+    # Connection pool of each async engine (primary, replicas, shards): connections kept open,
+    # extra connections opened under load, and seconds a checkout waits for a free connection
+    # before failing (the request then gets a 503 with Retry-After).
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 5.0
+
+    # Admission control: requests of each class (redirects, link creation, admin and edge
+    # calls) handled at once by a worker; 0 removes the limit of a class. Keep the creation
+    # and admin limits together below DB_POOL_SIZE + DB_MAX_OVERFLOW, so that they cannot
+    # take every connection: both are shed while the pool is exhausted.
+    admission_redirect_concurrency: int = 256
+    admission_create_concurrency: int = 8
+    admission_admin_concurrency: int = 4
+    # Requests of a class waiting for a slot, and seconds one may wait, before more are shed with 503.
+    admission_max_queue: int = 128
+    admission_max_queue_time: float = 0.5
+    # Retry-After (seconds) of shed requests.
+    admission_retry_after: int = 1
+    # Link creation per client address: tokens per second and bucket size (a batch costs one
+    # token per URL). 0 disables the limit. Enforced in Redis, so it holds across workers.
+    create_rate_limit: float = 10.0
+    create_rate_burst: int = 1000
+    # Comma-separated addresses (or networks) of reverse proxies whose X-Forwarded-For is
+    # trusted for the client address, which the rate limit and visitors are keyed on. Empty:
+    # the address of the peer is used, so behind a proxy every client shares one bucket.
+    trusted_proxies: str = ""
+
+    # Comma-separated SQLAlchemy URLs of read replicas for read-only lookups. Empty: primary only.
+    read_replica_urls: str = ""
+    # Replicas lagging more than this many seconds get no reads until they catch up.
+    replica_max_lag: float = 5.0
+    # Seconds between replica health and lag checks.
+    replica_check_interval: float = 5.0
+    # Seconds during which keys written by this worker (or deactivated anywhere) are read from the primary.
+    replica_sticky_seconds: float = 10.0
+    # Lookups that find nothing on a replica lagging more than this many seconds are confirmed
+    # on the primary. Lookups by secret key always are; redirects otherwise rely on the sticky window.
+    replica_confirm_lag: float = 1.0
+
+    # Comma-separated SQLAlchemy URLs of shards 1, 2, ...; DATABASE_URL is shard 0. Empty: one database.
+    # Keep the order stable: the shard map refers to shards by position.
+    shard_database_urls: str = ""
+    # Seconds between reloads of the shard map. `manage.py rebalance` waits for two of these
+    # before moving rows, so every worker knows about the move by then.
+    shard_map_refresh_interval: float = 10.0
+
+    # Consecutive Redis failures (errors or timeouts) that open the circuit breaker.
+    redis_breaker_failure_threshold: int = 5
+    # Minimum seconds the breaker stays open before a successful probe may close it again.
+    redis_breaker_reset_timeout: float = 5.0
+    # Seconds between background Redis health probes (PING).
+    redis_probe_interval: float = 1.0
+
+    # Longest a request waits for another request (or worker) loading the same key
+    # before querying the database itself.
+    single_flight_wait_timeout: float = 1.0
+    # Also coalesce cache misses across workers with a short Redis lock per key.
+    single_flight_redis_lock: bool = False
+    # Seconds after which an unreleased cross-worker loading lock expires.
+    single_flight_lock_ttl: float = 2.0
+
+    # Expose Prometheus metrics on /metrics and time every request.
+    metrics_enabled: bool = True
+
+    # Seconds between background health checks (databases, Redis, pools) behind /livez and /readyz.
+    health_check_interval: float = 5.0
+    # Event loop lag (seconds) above which the worker reports itself not ready.
+    health_max_loop_lag: float = 0.5
+
+    # Level of the application log, and its format: "json" (one object per line) or "text".
+    log_level: str = "INFO"
+    log_format: str = "json"
+    # Fraction of the records of an event that are logged, as "event=rate,..."; events not
+    # listed, and warnings and errors, are always logged.
+    log_sample_rates: str = "cache_hit=0.01,cache_miss=0.1"
+    # Most records per second (per worker) of an event, as "event=rate,..."; the excess is
+    # counted in the next record that gets through.
+    log_rate_limits: str = "not_found=10,bad_request=10,unauthorized=10,rate_limited=10,load_shed=10"
+    # Records buffered for the log writer thread; more are dropped rather than block requests.
+    log_queue_size: int = 10_000
+
+    # Seconds between runs of the expired link sweeper (0 disables it), links deactivated
+    # per batch, and batches per run.
+    expiry_sweep_interval: float = 60.0
+    expiry_sweep_batch_size: int = 500
+    expiry_sweep_max_batches: int = 20
+
+    # Archiving of rows out of urls into urls_archive: seconds between passes (0 disables;
+    # each pass runs on a single worker, the one that takes the Redis lease),
+    # rows examined per batch and pause between batches (seconds), and how long a link
+    # must have been inactive, or (if set) unused, to be archived (seconds; 0 = never).
+    archive_interval: float = 3600.0
+    archive_batch_size: int = 1000
+    archive_batch_pause: float = 0.1
+    archive_inactive_after: float = 30 * 86400.0
+    archive_idle_after: float = 0.0
+
+    # Answer GET /{key} in a raw ASGI middleware instead of the FastAPI route.
+    fast_redirect_enabled: bool = True
+
+    # Redirect status code (301, 302, 307 or 308) and Cache-Control max-age (browsers) and
+    # s-maxage (shared caches, e.g. a CDN) in seconds, for links that do not set their own.
+    # With both ages at 0 redirects are sent with no-store and every click reaches us.
+    redirect_status_code: int = 307
+    redirect_max_age: int = 0
+    redirect_s_maxage: int = 0
+    # Bearer token for POST /edge/clicks, which adds the clicks a CDN answered from its
+    # cache (from its logs) to the links' counters. Empty disables the endpoint.
+    edge_clicks_token: str = ""
+    # Purge a link's short URL from the CDN when it is deactivated or archived. The URL may
+    # contain {url} (the short URL) and {key}, and is then called once per link; otherwise
+    # it gets one request per batch with a JSON body {"files": [short URLs]}. Empty disables it.
+    edge_purge_url: str = ""
+    edge_purge_method: str = "POST"
+    # Sent as "Authorization: Bearer <token>" with purge requests, if set.
+    edge_purge_token: str = ""
+
+    # Approximate unique visitors per link, in daily HyperLogLog sketches in Redis.
+    unique_visitors_enabled: bool = True
+    # Days a daily sketch is kept; also the longest range the admin info reports on.
+    unique_visitors_retention_days: int = 90
+    # Seconds between writes of the visitors collected by a worker to Redis.
+    unique_visitors_flush_interval: float = 1.0
+    # Secret mixed into visitor fingerprints so they cannot be traced back to a client.
+    # Keep it stable; defaults to a value derived from DATABASE_PW.
+    visitor_hash_secret: str = ""
     
     
     @computed_field(return_type=str)
@@ -50,6 +257,19 @@ class Settings(BaseSettings):
         else:
             raise ValueError("DATABASE_URL is required")
 
+    @computed_field(return_type=list)
+    def read_replica_url_list(self) -> list[str]:
+        return [url.strip() for url in self.read_replica_urls.split(",") if url.strip()]
+
+    @computed_field(return_type=list)
+    def shard_database_url_list(self) -> list[str]:
+        return [url.strip() for url in self.shard_database_urls.split(",") if url.strip()]
+
+    @computed_field(return_type=str)
+    def async_database_url(self) -> str:
+        # Same database as sqlalchemy_database_url, but through an async driver (asyncpg).
+        return to_async_url(self.sqlalchemy_database_url)
+
 @lru_cache
 def get_settings() -> Settings:
     # Retrieve and cache the application settings.
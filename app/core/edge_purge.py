@@ -0,0 +1,128 @@
+# -------------------------------------------------------
+# CDN Purging
+# -------------------------------------------------------
+# This module removes short URLs from a CDN's cache when their link stops
+# redirecting, so a redirect cached with s-maxage (app/core/http_cache.py) does not
+# outlive the link by up to s-maxage seconds.
+#   - EDGE_PURGE_URL names the CDN's purge API. With {url} (the short URL) or {key}
+#     in it, it is called once per link (e.g. "PURGE {url}"); otherwise it gets one
+#     request per batch of up to BATCH_SIZE links, with a JSON body
+#     {"files": [short URLs]}. EDGE_PURGE_TOKEN is sent as a bearer token.
+#   - Purging is best effort and never delays the request or sweep that deactivated
+#     the link: keys are queued in process and sent by a background task, retried
+#     ATTEMPTS times with exponential backoff, then logged as failed.
+# Browser caches (max-age) cannot be purged; keep max-age short for links that
+# may be deactivated.
+# -------------------------------------------------------
+
+import asyncio
+
+import requests
+from starlette.datastructures import URL
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Counter
+
+settings = get_settings()
+
+EDGE_PURGES = Counter("edge_purges_total", "Short URLs sent to the CDN purge API, by outcome.", ("outcome",))
+EDGE_PURGED = EDGE_PURGES.labels("purged")
+EDGE_PURGE_FAILED = EDGE_PURGES.labels("failed")
+
+# Keys waiting to be purged; later ones are dropped (and logged) until the queue drains.
+MAX_PENDING = 10_000
+# Short URLs per request to a batch purge API.
+BATCH_SIZE = 30
+# Attempts per purge request, and the delay before the first retry (doubled after each).
+ATTEMPTS = 3
+RETRY_DELAY = 1.0
+# Seconds before a purge request is given up.
+REQUEST_TIMEOUT = 5.0
+
+
+class EdgePurger:
+    def __init__(self, url_template: str, method: str, token: str, base_url: str):
+        self.url_template = url_template
+        self.method = method.upper()
+        self.token = token
+        self.base_url = URL(base_url)
+        self.per_link = "{url}" in url_template or "{key}" in url_template
+        self._queue: asyncio.Queue[str] = asyncio.Queue(MAX_PENDING)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url_template)
+
+    def short_url(self, url_key: str) -> str:
+        return str(self.base_url.replace(path=url_key))
+
+    def purge(self, *url_keys: str):
+        # Queue the links' short URLs for purging. No I/O.
+        if not self.enabled:
+            return
+        for url_key in url_keys:
+            try:
+                self._queue.put_nowait(url_key)
+            except asyncio.QueueFull:
+                EDGE_PURGE_FAILED.inc()
+                logging.logger.error("Edge purge queue is full; key=%s may be served by the CDN until its s-maxage ends", url_key)
+
+    def requests_for(self, url_keys: list[str]) -> list[tuple[list[str], dict]]:
+        # (keys, keyword arguments of requests.request) of the requests that purge the keys.
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        if self.per_link:
+            return [
+                ([url_key], {"url": self.url_template.replace("{url}", self.short_url(url_key)).replace("{key}", url_key), "headers": headers})
+                for url_key in url_keys
+            ]
+        return [(url_keys, {"url": self.url_template, "headers": headers, "json": {"files": [self.short_url(url_key) for url_key in url_keys]}})]
+
+    async def send(self, request: dict) -> bool:
+        for attempt in range(ATTEMPTS):
+            try:
+                response = await asyncio.to_thread(requests.request, self.method, timeout=REQUEST_TIMEOUT, **request)
+                if response.ok:
+                    return True
+                logging.logger.warning("Edge purge request to %s returned %d", request["url"], response.status_code)
+            except requests.RequestException:
+                logging.logger.warning("Edge purge request to %s failed", request["url"], exc_info=True)
+            if attempt + 1 < ATTEMPTS:
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+        return False
+
+    async def _run(self):
+        while True:
+            url_keys = [await self._queue.get()]
+            while len(url_keys) < BATCH_SIZE and not self._queue.empty():
+                url_keys.append(self._queue.get_nowait())
+            for keys, request in self.requests_for(url_keys):
+                try:
+                    sent = await self.send(request)
+                except Exception:
+                    logging.logger.exception("Unexpected error purging keys from the CDN")
+                    sent = False
+                if sent:
+                    EDGE_PURGED.inc(len(keys))
+                else:
+                    EDGE_PURGE_FAILED.inc(len(keys))
+                    logging.logger.error("Could not purge %s from the CDN; cached redirects last until their s-maxage ends", ", ".join(keys))
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self._queue.empty():
+            logging.logger.warning("%d keys were not purged from the CDN before shutdown", self._queue.qsize())
+
+
+edge_purger = EdgePurger(settings.edge_purge_url, settings.edge_purge_method, settings.edge_purge_token, settings.base_url)
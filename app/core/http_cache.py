@@ -0,0 +1,119 @@
+# -------------------------------------------------------
+# HTTP Caching
+# -------------------------------------------------------
+# This module decides how browsers and CDNs may cache our responses.
+#   - Redirects: every link has a RedirectPolicy, a status code (301/308 permanent,
+#     302/307 temporary) and Cache-Control max-age (browsers) and s-maxage (shared
+#     caches such as a CDN). Links may set their own; unset fields come from
+#     REDIRECT_STATUS_CODE, REDIRECT_MAX_AGE and REDIRECT_S_MAXAGE. The header is
+#     always explicit: without one, browsers cache 301 and 308 responses for as long
+#     as they like, and a deactivated link would keep redirecting.
+#   - A redirect served by a cache never reaches us, so it is not counted. Browser
+#     hits (max-age) are lost for good; CDN hits (s-maxage) can be reported back
+#     from the CDN's logs through POST /edge/clicks. Click-limited links must count
+#     every click, so they are never cacheable and never permanent, and expiring
+#     links are never cached past their expiry.
+#   - Admin info: a weak ETag (hash of the body) and Last-Modified (the latest
+#     lifecycle timestamp of the link, or the last UTC midnight when the unique
+#     visitors window moved) let clients revalidate with If-None-Match or
+#     If-Modified-Since and get a 304 without a body.
+# -------------------------------------------------------
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import NamedTuple
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+REDIRECT_STATUS_CODES = (301, 302, 307, 308)
+# Status code used instead of a permanent one where the redirect may change.
+TEMPORARY_EQUIVALENT = {301: 302, 308: 307}
+# Longest max-age or s-maxage a link may ask for (one year).
+MAX_CACHE_AGE = 365 * 86400
+
+
+class RedirectPolicy(NamedTuple):
+    status_code: int
+    max_age: int
+    s_maxage: int
+
+    def capped(self, expires_in: float | None) -> "RedirectPolicy":
+        # The policy for a link expiring in expires_in seconds: no copy outlives the link.
+        if expires_in is None:
+            return self
+        limit = max(int(expires_in), 0)
+        if self.max_age <= limit and self.s_maxage <= limit:
+            return self
+        return self._replace(max_age=min(self.max_age, limit), s_maxage=min(self.s_maxage, limit))
+
+    @property
+    def cache_control(self) -> str:
+        if not self.max_age and not self.s_maxage:
+            return "no-store"
+        return f"public, max-age={self.max_age}, s-maxage={self.s_maxage}"
+
+
+DEFAULT_POLICY = RedirectPolicy(settings.redirect_status_code, settings.redirect_max_age, settings.redirect_s_maxage)
+
+
+def redirect_policy(redirect_code: int | None, max_age: int | None, s_maxage: int | None, max_clicks: int | None = None) -> RedirectPolicy:
+    # Effective policy of a link from its own (nullable) settings.
+    status_code = redirect_code or DEFAULT_POLICY.status_code
+    if max_clicks is not None:
+        # Every redirect must reach us to be counted, and the link will stop redirecting.
+        return RedirectPolicy(TEMPORARY_EQUIVALENT.get(status_code, status_code), 0, 0)
+    return RedirectPolicy(
+        status_code,
+        DEFAULT_POLICY.max_age if max_age is None else max_age,
+        DEFAULT_POLICY.s_maxage if s_maxage is None else s_maxage,
+    )
+
+
+def link_policy(db_url) -> RedirectPolicy:
+    return redirect_policy(db_url.redirect_code, db_url.max_age, db_url.s_maxage, db_url.max_clicks)
+
+
+def validate_policy(redirect_code: int | None, max_age: int | None, s_maxage: int | None) -> str | None:
+    # Error message for invalid per-link settings, or None.
+    if redirect_code is not None and redirect_code not in REDIRECT_STATUS_CODES:
+        return "redirect_code must be one of 301, 302, 307 or 308."
+    for name, value in (("max_age", max_age), ("s_maxage", s_maxage)):
+        if value is not None and not 0 <= value <= MAX_CACHE_AGE:
+            return f"{name} must be between 0 and {MAX_CACHE_AGE} seconds."
+    return None
+
+
+def etag(body: bytes) -> str:
+    # Weak: equal bodies, not byte-for-byte equal responses (e.g. compression).
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def http_date(moment: datetime) -> str:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def not_modified(headers, current_etag: str, last_modified: datetime | None) -> bool:
+    # Whether a conditional GET with these request headers can be answered with 304.
+    # If-None-Match takes precedence; If-Modified-Since is only used without it, and
+    # never while the resource is changing (last_modified None).
+    if (if_none_match := headers.get("if-none-match")) is not None:
+        # Weak comparison: W/ prefixes are ignored.
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in candidates or current_etag.removeprefix("W/") in candidates
+    if (if_modified_since := headers.get("if-modified-since")) is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        # HTTP dates have whole seconds.
+        return last_modified.replace(microsecond=0) <= since
+    return False
@@ -0,0 +1,72 @@
+# -------------------------------------------------------
+# Compact Key Encoding
+# -------------------------------------------------------
+# This module converts short keys and secret keys to the compact values stored
+# next to them in urls.key_id and urls.secret_token (KEY_STORAGE=compact).
+#   - key_id: a short key of 1 to MAX_KEY_LENGTH characters from keygen.ALPHABET
+#     read as a bijective base-36 number (all shorter keys are counted first), so
+#     "0", "00" and "000" stay distinct and every key fits a BIGINT.
+#   - secret_token: a secret key is "<key>_<8 random characters>"; the key part
+#     is already stored as key_id, so only the 8 random characters are kept, as a
+#     6-byte big-endian integer.
+# An 8-byte key_id and a 6-byte token replace two variable-length strings in the
+# lookup indexes. Keys or secret keys that do not follow these formats (e.g.
+# imported from elsewhere) have no compact form; those rows are found through the
+# string columns.
+# -------------------------------------------------------
+
+import re
+
+# Longest key with a key_id; 36**1 + ... + 36**12 is still below 2**63.
+MAX_KEY_LENGTH = 12
+# Random characters after "<key>_" in a secret key (see crud.create_db_url).
+SECRET_SUFFIX_LENGTH = 8
+SECRET_TOKEN_BYTES = 6
+
+KEY_PATTERN = re.compile(rf"[A-Z0-9]{{1,{MAX_KEY_LENGTH}}}")
+SECRET_PATTERN = re.compile(rf"([A-Z0-9]{{1,{MAX_KEY_LENGTH}}})_([A-Z0-9]{{{SECRET_SUFFIX_LENGTH}}})")
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# _OFFSETS[n]: number of keys shorter than n characters, i.e. the key_id of "0" * n.
+_OFFSETS = [0, 0]
+for _length in range(1, MAX_KEY_LENGTH + 1):
+    _OFFSETS.append(_OFFSETS[-1] + 36 ** _length)
+
+
+def key_to_id(key: str) -> int | None:
+    # key_id of a short key, or None if the key has no compact form.
+    if not KEY_PATTERN.fullmatch(key):
+        return None
+    return _OFFSETS[len(key)] + int(key, 36)
+
+
+def id_to_key(key_id: int) -> str:
+    # Inverse of key_to_id.
+    length = 1
+    while length < MAX_KEY_LENGTH and key_id >= _OFFSETS[length + 1]:
+        length += 1
+    value = key_id - _OFFSETS[length]
+    if not 0 <= value < 36 ** length:
+        raise ValueError(f"{key_id} is not a valid key_id")
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 36)
+        chars.append(DIGITS[digit])
+    return "".join(reversed(chars))
+
+
+def split_secret_key(secret_key: str) -> tuple[int, bytes] | None:
+    # (key_id, secret_token) of a secret key, or None if it has no compact form.
+    if not (match := SECRET_PATTERN.fullmatch(secret_key)):
+        return None
+    key, suffix = match.groups()
+    return key_to_id(key), int(suffix, 36).to_bytes(SECRET_TOKEN_BYTES, "big")
+
+
+def compact_columns(key: str, secret_key: str) -> dict:
+    # key_id and secret_token for a new row; each is None where there is no compact form.
+    # The token is only stored for secret keys built from the row's own key, so that
+    # (key_id, secret_token) always identifies the secret key completely.
+    key_id = key_to_id(key)
+    parts = split_secret_key(secret_key)
+    return {"key_id": key_id, "secret_token": parts[1] if parts is not None and parts[0] == key_id else None}
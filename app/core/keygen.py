@@ -2,30 +2,178 @@
 # Key Generation Utilities
 # -------------------------------------------------------
 # This module provides functions for generating secure random keys used in URL shortening.
-# It includes both general-purpose key generation and logic to ensure uniqueness
-# by checking against existing keys in the database.
 # Keys consist of uppercase letters and digits for URL-safe representation.
+#
+# Two strategies are available for short keys (KEYGEN_STRATEGY):
+#   - "sequence" (default): keys come from a Postgres sequence (url_key_seq) passed
+#     through a keyed Feistel permutation of the base-36 key space. Every counter value
+#     maps to a distinct key, so keys are unique without a lookup, and without the
+#     secret the next key cannot be predicted from previous ones. Counter values are
+#     reserved in blocks per worker, so most creates need no extra query at all.
+#     Once the current length is KEYGEN_MAX_FILL full, keys widen by one character.
+#   - "random": the original behaviour; pick a random key and query the database
+#     until an unused one is found.
 # -------------------------------------------------------
 
+import asyncio
+import hashlib
+import hmac
 import secrets
 import string
 
 from app.database import crud
-from sqlalchemy.orm import Session
+from app.core import logging
+from app.core.metrics import KEYGEN_RETRIES
+from app.core.config import get_settings
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+settings = get_settings()
+
+ALPHABET = string.ascii_uppercase + string.digits
+BASE = len(ALPHABET)
 
 def create_key(length: int = 5) -> str:
     # Generate a random cryptographic key of specified length.
     # Uses uppercase letters (A-Z) and digits (0-9) for URL-safe representation.
     # The secrets module provides cryptographically strong random generation.
-    chars = string.ascii_uppercase + string.digits
-    return "".join(secrets.choice(chars) for _ in range(length))
+    return "".join(secrets.choice(ALPHABET) for _ in range(length))
+
+def encode_key(value: int, length: int) -> str:
+    # Write an integer as a fixed-width key using ALPHABET as base-36 digits.
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, BASE)
+        chars.append(ALPHABET[digit])
+    if value:
+        raise ValueError("value does not fit in the requested key length")
+    return "".join(reversed(chars))
+
+
+class KeyPermutation:
+    # Keyed bijection over [0, 36**length), built from a balanced Feistel network
+    # on the smallest even number of bits that covers the domain, plus cycle walking
+    # to stay inside the domain.
+    ROUNDS = 4
+
+    def __init__(self, secret: bytes, length: int):
+        self.length = length
+        self.domain = BASE ** length
+        bits = (self.domain - 1).bit_length()
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self._round_keys = [
+            hmac.new(secret, f"{length}:{i}".encode(), hashlib.sha256).digest()[:16]
+            for i in range(self.ROUNDS)
+        ]
+
+    def _round(self, i: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "little"), digest_size=8, key=self._round_keys[i]).digest()
+        return int.from_bytes(digest, "little") & self.half_mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for i in range(self.ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, value: int) -> int:
+        if not 0 <= value < self.domain:
+            raise ValueError("value outside of the permutation domain")
+        # Cycle walking: a permutation of the larger bit domain restricted to [0, domain)
+        # is still a permutation, because every cycle re-enters the domain.
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
 
-def create_unique_key(db: Session) -> str:
+class KeyAllocator:
+    def __init__(self, secret: bytes, min_length: int, block_size: int, max_fill: float):
+        self.secret = secret
+        self.min_length = min_length
+        self.block_size = block_size
+        self.max_fill = max_fill
+        self._permutations: dict[int, KeyPermutation] = {}
+        self._block: list[int] = []
+        self._lock = asyncio.Lock()
+
+    def length_for(self, counter: int) -> int:
+        # Smallest length (>= min_length) whose space is less than max_fill used at this counter.
+        # Each length receives a contiguous counter range below its domain size, so keys
+        # stay unique when the length widens.
+        length = self.min_length
+        while counter >= int(BASE ** length * self.max_fill):
+            length += 1
+        return length
+
+    def key_for(self, counter: int) -> str:
+        length = self.length_for(counter)
+        if length not in self._permutations:
+            self._permutations[length] = KeyPermutation(self.secret, length)
+        return encode_key(self._permutations[length].permute(counter), length)
+
+    async def _reserve(self, db: AsyncSession, count: int) -> list[int]:
+        # One round trip reserves `count` sequence values. Sequence values start at 1.
+        result = await db.execute(
+            text("SELECT nextval('url_key_seq') FROM generate_series(1, :count)"),
+            {"count": count},
+        )
+        return sorted(value - 1 for value in result.scalars())
+
+    async def allocate(self, db: AsyncSession, count: int = 1) -> list[str]:
+        # Hand out `count` unique keys, refilling this worker's block from the sequence as needed.
+        async with self._lock:
+            while len(self._block) < count:
+                self._block.extend(await self._reserve(db, max(self.block_size, count - len(self._block))))
+            counters, self._block = self._block[:count], self._block[count:]
+        return [self.key_for(counter) for counter in counters]
+
+    async def next_key(self, db: AsyncSession) -> str:
+        return (await self.allocate(db, 1))[0]
+
+
+def _keygen_secret() -> bytes:
+    if settings.keygen_secret:
+        return settings.keygen_secret.encode()
+    # Fall back to a secret derived from the database password so keys are not
+    # predictable out of the box. Set KEYGEN_SECRET explicitly and never change it.
+    if settings.keygen_strategy == "sequence":
+        logging.logger.warning("KEYGEN_SECRET is not set; deriving the key permutation secret from DATABASE_PW")
+    return hashlib.sha256(f"keygen:{settings.database_pw}".encode()).digest()
+
+key_allocator = KeyAllocator(
+    secret=_keygen_secret(),
+    min_length=settings.keygen_min_length,
+    block_size=settings.keygen_block_size,
+    max_fill=settings.keygen_max_fill,
+)
+
+async def create_unique_key(db: AsyncSession) -> str:
+    if settings.keygen_strategy == "sequence":
+        return await key_allocator.next_key(db)
     # Generate a random key and ensure it does not already exist in the database.
     # Collision probability is extremely low, but this function guarantees uniqueness
     # by querying the database and regenerating if a collision is found.
-    key = create_key()
+    key = create_key(settings.keygen_min_length)
     # Keep generating new keys until a unique one is found.
-    while crud.get_db_url_by_key(db, key):
-        key = create_key()
-    return key    
\ No newline at end of file
+    # Existence checks may be served by a replica; the insert of a key it has not seen yet
+    # skips the row, and create_db_url retries with another key. Keys of inactive and
+    # archived links count as taken.
+    while await crud.get_existing_keys(db, [key]):
+        KEYGEN_RETRIES.inc()
+        key = create_key(settings.keygen_min_length)
+    return key
+
+async def create_unique_keys(db: AsyncSession, count: int) -> list[str]:
+    # Bulk variant of create_unique_key used by batch creation.
+    if settings.keygen_strategy == "sequence":
+        return await key_allocator.allocate(db, count)
+    # Random strategy: one existence query per round instead of one per key.
+    keys: set[str] = set()
+    while len(keys) < count:
+        candidates = {create_key(settings.keygen_min_length) for _ in range(count - len(keys))} - keys
+        taken = await crud.get_existing_keys(db, candidates)
+        KEYGEN_RETRIES.inc(len(taken))
+        keys |= candidates - taken
+    return list(keys)
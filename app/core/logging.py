@@ -4,35 +4,209 @@
 # This module provides centralized error handling and logging functions.
 # All HTTP exceptions raised by the API are logged here, ensuring consistent
 # error responses and audit trails for debugging and monitoring.
+# Logging never writes to a stream on the event loop thread:
+#   - `logger` puts records on a bounded in-memory queue (QueueHandler); a
+#     QueueListener thread formats and writes them. Messages are %-style and
+#     only formatted on that thread. When the queue is full, records are dropped
+#     and counted instead of blocking a request.
+#   - Records are JSON lines by default (LOG_FORMAT=json), with the event name,
+#     its sampling rate and any extra fields as keys.
+#   - event() logs frequent events at a sampled rate (LOG_SAMPLE_RATES, e.g. 1%
+#     of cache hits; the sample_rate key lets readers scale counts back up) and
+#     at most LOG_RATE_LIMITS lines per second (e.g. 404 floods); the next line
+#     that gets through reports how many were suppressed. Unlisted events are
+#     always logged, and warnings and errors are never sampled.
 # -------------------------------------------------------
 
 from fastapi import HTTPException, Request
+import json
 import logging
+import logging.handlers
+import math
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.core.config import get_settings
+from app.core.metrics import Gauge
+
+settings = get_settings()
 
 # Get a logger instance for this module.
 logger = logging.getLogger(__name__)
 
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler that never blocks and leaves formatting to the listener thread.
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The default prepare() formats the message here; the listener runs in this
+        # process, so the record (and its arguments) can be handed over as it is.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if (event_name := getattr(record, "event", None)) is not None:
+            entry["event"] = event_name
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimit:
+    # Token bucket: `rate` lines per second, bursts of up to `rate` lines.
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> int | None:
+        # None if the line must be suppressed, else how many were suppressed before it.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return None
+            self.tokens -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+
+class EventLog:
+    def __init__(self, sample_rates: dict[str, float], rate_limits: dict[str, float]):
+        self.sample_rates = sample_rates
+        self.rate_limits = {name: RateLimit(rate) for name, rate in rate_limits.items()}
+
+    def log(self, name: str, level: int, msg: str, *args, **fields):
+        if not logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(name, 1.0) if level < logging.WARNING else 1.0
+        if rate < 1.0:
+            if random.random() >= rate:
+                return
+            fields["sample_rate"] = rate
+        if (limit := self.rate_limits.get(name)) is not None:
+            if (suppressed := limit.allow()) is None:
+                return
+            if suppressed:
+                fields["suppressed"] = suppressed
+        logger.log(level, msg, *args, extra={"event": name, "fields": fields})
+
+
+def _parse_rates(value: str) -> dict[str, float]:
+    # "cache_hit=0.01,not_found=10" -> {"cache_hit": 0.01, "not_found": 10.0}
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+event_log = EventLog(_parse_rates(settings.log_sample_rates), _parse_rates(settings.log_rate_limits))
+queue_handler = DroppingQueueHandler(queue.Queue(settings.log_queue_size))
+_listener: logging.handlers.QueueListener | None = None
+_stream_handler: logging.Handler | None = None
+
+Gauge("log_queue_depth", "Log records waiting for the writer thread.", lambda: queue_handler.queue.qsize())
+Gauge("log_records_dropped", "Log records dropped because the log queue was full.", lambda: queue_handler.dropped)
+
+
+def event(name: str, level: int, msg: str, *args, **fields):
+    # Log msg (with %-style args) as the event `name`, subject to its sampling rate and rate limit.
+    event_log.log(name, level, msg, *args, **fields)
+
+
+def configure_logging():
+    # Send this module's logger through the queue and start the writer thread. Idempotent.
+    global _listener, _stream_handler
+    if _listener is not None:
+        return
+    _stream_handler = stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.setLevel(settings.log_level.upper())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    # Write out the queued records and stop the writer thread.
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    if queue_handler.dropped:
+        # The writer thread is gone; report the drops straight to the stream handler.
+        _stream_handler.handle(logger.makeRecord(
+            logger.name, logging.WARNING, __file__, 0,
+            "%d log records were dropped because the log queue was full", (queue_handler.dropped,), None,
+        ))
+
+
 def raise_bad_request(message):
     # Log and raise a 400 Bad Request HTTP exception.
     # Used when the client sends invalid input data.
-    logger.info(f"Bad request: {message}")
+    event("bad_request", logging.INFO, "Bad request: %s", message)
     raise HTTPException(status_code=400, detail=message)
 
 def raise_not_found(request: Request):
     # Log and raise a 404 Not Found HTTP exception.
     # Used when a requested resource (URL key or secret key) does not exist.
-    logger.info(f"Page not found: {request.url}")
+    # Scans for unknown keys can produce floods of these; they are rate limited.
+    event("not_found", logging.INFO, "Page not found: %s", request.url.path)
     message = f"Page not found: {request.url}"
     raise HTTPException(status_code=404, detail=message)
 
+def raise_unauthorized(message):
+    # Log and raise a 401 Unauthorized HTTP exception.
+    # Used when an endpoint that needs a token is called without the right one.
+    event("unauthorized", logging.WARNING, "Unauthorized: %s", message)
+    raise HTTPException(status_code=401, detail=message, headers={"WWW-Authenticate": "Bearer"})
+
+def raise_too_many_requests(message, retry_after: float):
+    # Log and raise a 429 Too Many Requests HTTP exception.
+    # Used when a client exceeds a rate limit; Retry-After says when to try again.
+    event("rate_limited", logging.INFO, "Rate limited: %s", message)
+    raise HTTPException(status_code=429, detail=message, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
 def file_not_found(filepath):
     # Log and raise a FileNotFoundError.
     # Used when required configuration or resource files are missing.
-    logger.error(f"Configuration file not found: {filepath}")
+    logger.error("Configuration file not found: %s", filepath)
     raise FileNotFoundError(f"Configuration file not found: {filepath}")
 
 def raise_cache_error(message):
     # Log and raise a 500 Internal Server Error for caching issues.
     # Used when there are problems interacting with the caching layer (e.g., Redis).
-    logger.error(f"Caching error: {message}")
-    raise HTTPException(status_code=500, detail=message)
\ No newline at end of file
+    logger.error("Caching error: %s", message)
+    raise HTTPException(status_code=500, detail=message)
@@ -0,0 +1,212 @@
+# -------------------------------------------------------
+# Metrics
+# -------------------------------------------------------
+# This module provides minimal Prometheus-style metrics (counters, gauges,
+# histograms) and renders them in the text exposition format for /metrics.
+#
+# The hot path is kept cheap enough to leave on in production:
+#   - Each worker runs a single event loop thread (SQLAlchemy's async greenlets
+#     included), so updates are plain integer/float additions with no locks.
+#   - Labelled series ("children") are created once, usually at import time as
+#     module constants, and reused; recording a value allocates no label objects.
+#   - Histograms use fixed buckets; observe() is a bisect plus two additions.
+#   - MetricsMiddleware is plain ASGI and labels requests by route template, so
+#     /{url_key} is a single series however many keys are requested.
+# Values are per worker process; Prometheus sums them across scrape targets.
+# -------------------------------------------------------
+
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, tuned for sub-millisecond cache hits up to slow DB calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry: list = []
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf bucket; cumulated at render time.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        # Return the series for these label values, creating it on first use.
+        # Call this once and keep the result for anything on a hot path.
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: int = 1):
+        self.labels().inc(amount)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Gauge(_Metric):
+    # Gauge whose value is read from a callback at scrape time, so nothing is
+    # updated on the request path.
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        try:
+            lines.append(f"{self.name} {self.callback()}")
+        except Exception:
+            # A failing collector must not break the whole scrape.
+            pass
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------- application metrics ----------------------------
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route template and method.", ("route", "method"),
+)
+
+REDIRECT_CACHE = Counter(
+    "redirect_cache_total",
+    "Redirect lookups by outcome. Redis timeouts and errors are counted in addition to the database fallback outcome.",
+    ("outcome",),
+)
+REDIRECT_L1_HIT = REDIRECT_CACHE.labels("l1_hit")
+REDIRECT_HIT = REDIRECT_CACHE.labels("hit")
+REDIRECT_MISS = REDIRECT_CACHE.labels("miss")
+REDIRECT_TIMEOUT = REDIRECT_CACHE.labels("timeout")
+REDIRECT_ERROR = REDIRECT_CACHE.labels("error")
+REDIRECT_REJECTED = REDIRECT_CACHE.labels("rejected")
+REDIRECT_NOT_FOUND = REDIRECT_CACHE.labels("not_found")
+REDIRECT_BREAKER_OPEN = REDIRECT_CACHE.labels("breaker_open")
+
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds", "Redis command latency by command (pipelines as PIPELINE).", ("command",),
+)
+
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "Database statement execution time.")
+DB_POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.")
+
+KEYGEN_RETRIES = Counter("keygen_retries_total", "Short keys that had to be regenerated because they were taken.")
+
+
+class MetricsMiddleware:
+    # Pure ASGI middleware timing every HTTP request into REQUEST_LATENCY. The route
+    # is only known after routing, so the series is picked once the response is done.
+    def __init__(self, app):
+        self.app = app
+        # route template -> method -> histogram child
+        self._children: dict = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Unmatched paths (404s from the router) share one series.
+            path = getattr(scope.get("route"), "path", "unmatched")
+            self._child(path, scope["method"]).observe(time.perf_counter() - started)
+
+    def _child(self, path: str, method: str):
+        by_method = self._children.get(path)
+        if by_method is None:
+            by_method = self._children[path] = {}
+        child = by_method.get(method)
+        if child is None:
+            child = by_method[method] = REQUEST_LATENCY.labels(path, method)
+        return child
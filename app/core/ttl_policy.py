@@ -0,0 +1,70 @@
+# -------------------------------------------------------
+# Cache TTL Policy
+# -------------------------------------------------------
+# This module decides how long a link stays in Redis. Every cache write goes
+# through TTLPolicy.ttl() so that expiry follows popularity instead of a single
+# fixed lifetime:
+#   - links without clicks yet (e.g. just created) get CACHE_NEW_TTL, so links
+#     nobody follows leave Redis quickly;
+#   - clicked links get CACHE_TTL, and links with at least CACHE_HOT_CLICKS
+#     clicks get CACHE_HOT_TTL;
+#   - every TTL is spread by +/- CACHE_TTL_JITTER, so links cached together
+#     (a batch, an import, a warm-up) do not all expire in the same second;
+#   - a link with an expiry time is never cached beyond it.
+#
+# Hot entries are also refreshed before they expire (probabilistic early
+# expiration, "XFetch"): on each Redis hit the entry's lifetime is extended with
+# probability exp(-remaining / CACHE_REFRESH_SCALE). Rarely read entries almost
+# never get extended and expire normally; an entry read many times per second
+# gets extended well before it expires, so its readers never see a miss.
+# -------------------------------------------------------
+
+import math
+import random
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+class TTLPolicy:
+    def __init__(self, new_ttl: int, ttl: int, hot_ttl: int, hot_clicks: int, jitter: float, refresh_scale: float):
+        self.new_ttl = new_ttl
+        self.base_ttl = ttl
+        self.hot_ttl = hot_ttl
+        self.hot_clicks = hot_clicks
+        self.jitter = jitter
+        self.refresh_scale = refresh_scale
+
+    def ttl(self, clicks: int = 0, expires_in: float | None = None) -> int:
+        # TTL in seconds for a link with the given number of clicks, capped at the seconds
+        # left until the link expires. Rounded down, so the entry never outlives the link.
+        if clicks >= self.hot_clicks:
+            base = self.hot_ttl
+        elif clicks > 0:
+            base = self.base_ttl
+        else:
+            base = self.new_ttl
+        ttl = max(1, round(base * random.uniform(1 - self.jitter, 1 + self.jitter)))
+        return ttl if expires_in is None else max(0, min(ttl, math.floor(expires_in)))
+
+    def refresh_ttl(self) -> int:
+        # Only frequently read entries get refreshed early, so they are treated as hot.
+        return self.ttl(self.hot_clicks)
+
+    def should_refresh(self, remaining: float) -> bool:
+        # Decide on a cache hit whether to extend an entry with `remaining` seconds to live.
+        # Entries without an expiry (remaining < 0) are left alone.
+        if self.refresh_scale <= 0 or remaining < 0:
+            return False
+        return random.random() < math.exp(-remaining / self.refresh_scale)
+
+
+ttl_policy = TTLPolicy(
+    new_ttl=settings.cache_new_ttl,
+    ttl=settings.cache_ttl,
+    hot_ttl=settings.cache_hot_ttl,
+    hot_clicks=settings.cache_hot_clicks,
+    jitter=settings.cache_ttl_jitter,
+    refresh_scale=settings.cache_refresh_scale,
+)
@@ -3,9 +3,12 @@
 # -------------------------------------------------------
 # This module provides utility functions for constructing and formatting URLs
 # used in API responses. It generates both public shortened URLs and admin URLs
-# for management operations.
+# for management operations, and normalizes/hashes target URLs for deduplication.
 # -------------------------------------------------------
 
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
 from starlette.datastructures import URL
 
 from app.core.config import get_settings
@@ -27,4 +30,28 @@ def get_admin_info(db_url: models.URL) -> schemas.URLInfo:
     # Example: https://127.0.0.1:8000/admin/ABCDEF_GHIJKLMN
     db_url.admin_url = str(base_url.replace(path=f"admin/{db_url.secret_key}"))
     
-    return db_url
\ No newline at end of file
+    return db_url
+
+# Default ports dropped during normalization.
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Size in bytes of the target URL hash stored in urls.target_hash.
+TARGET_HASH_SIZE = 16
+
+def normalize_target_url(target_url: str) -> str:
+    # Canonical form used to detect repeated targets: lower-case scheme and host,
+    # no default port, and "/" for an empty path. Path, query and fragment are kept
+    # as-is since they can change where the link leads.
+    parts = urlsplit(target_url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        host = f"{userinfo}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, parts.fragment))
+
+def target_url_hash(target_url: str) -> bytes:
+    # Fixed-width hash of the normalized target, indexed instead of the full URL string.
+    return hashlib.blake2b(normalize_target_url(target_url).encode(), digest_size=TARGET_HASH_SIZE).digest()
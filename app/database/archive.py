@@ -0,0 +1,147 @@
+# -------------------------------------------------------
+# Link Archiver
+# -------------------------------------------------------
+# This module moves rows that can no longer redirect out of urls into
+# urls_archive, so that the indexes used by every lookup (key, secret_key,
+# target_hash) only cover links that matter for redirects.
+#   - Archived: links inactive for ARCHIVE_INACTIVE_AFTER seconds, and, if
+#     ARCHIVE_IDLE_AFTER is set, active links not clicked (or created) within
+#     that many seconds. Idle links stop redirecting once archived.
+#   - The archiver walks urls by primary key, ARCHIVE_BATCH_SIZE rows at a
+#     time, moving matching rows in one short transaction per batch and pausing
+#     ARCHIVE_BATCH_PAUSE seconds in between, so the load on the primary stays
+#     flat. A full pass starts every ARCHIVE_INTERVAL seconds.
+#   - One worker per interval: a pass starts only on the worker that takes the
+#     Redis lease (SET NX with a TTL of ARCHIVE_INTERVAL, renewed between batches
+#     of a long pass), so N workers do not walk the table N times. Without Redis
+#     no pass runs. Rows are still claimed with FOR UPDATE SKIP LOCKED, so a pass
+#     overlapping a `manage.py` run or an expired lease never moves a row twice.
+#   - Clicks still buffered for a link when it is archived are added to its
+#     urls_archive row by the click flush (clicks.py).
+# Redirects never read the archive; admin lookups fall back to it, and key
+# allocation treats archived keys as taken. Links archived while active are
+# evicted from the caches, and from the CDN with EDGE_PURGE_URL.
+# -------------------------------------------------------
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import redis.asyncio as redis
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.edge_purge import edge_purger
+from app.core.metrics import Counter
+from . import crud
+from .caching import redis_breaker, redis_client, safe_redis_delete, redis_wait
+from .database import shard_router
+from .local_cache import publish_invalidation
+
+settings = get_settings()
+
+LINKS_ARCHIVED = Counter("links_archived_total", "Rows moved from urls to urls_archive.")
+
+# Redis key held by the worker running the current archive pass.
+ARCHIVE_LEASE = "archiver:lease"
+
+
+class Archiver:
+    def __init__(
+        self, redis_client: redis.Redis, interval: float, batch_size: int, batch_pause: float,
+        inactive_after: float, idle_after: float,
+    ):
+        self.redis = redis_client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.inactive_after = inactive_after
+        # 0 keeps active links in urls however long they go unused.
+        self.idle_after = idle_after
+        self.archived = 0
+        self._task: asyncio.Task | None = None
+
+    async def _take_lease(self) -> str | None:
+        # Token of the lease if this worker gets to run the next pass, else None. The lease
+        # is not released after the pass: it expires after one interval, so at most one
+        # pass starts per interval across all workers.
+        if not redis_breaker.allow():
+            return None
+        token = uuid.uuid4().hex
+        try:
+            taken = await redis_wait(self.redis.set(ARCHIVE_LEASE, token, nx=True, ex=max(1, int(self.interval))), timeout=1.0)
+        except Exception:
+            logging.logger.warning("Could not take the archiver lease in Redis; skipping this pass", exc_info=True)
+            return None
+        return token if taken else None
+
+    async def _renew_lease(self, token: str):
+        # Keep the lease while a long pass is running, unless it expired and was taken over.
+        try:
+            if await redis_wait(self.redis.get(ARCHIVE_LEASE), timeout=1.0) == token:
+                await redis_wait(self.redis.expire(ARCHIVE_LEASE, max(1, int(self.interval))), timeout=1.0)
+        except Exception:
+            pass  # Worst case another worker starts a pass; SKIP LOCKED keeps that safe.
+
+    async def archive_pass(self, db=None, lease: str | None = None) -> int:
+        # Walk the whole table once and return the number of rows archived.
+        # `db` is a session to use instead of opening one per batch (tests); `lease` is
+        # the token of the archiver lease, renewed between batches.
+        now = datetime.now(timezone.utc)
+        inactive_before = now - timedelta(seconds=self.inactive_after)
+        idle_before = now - timedelta(seconds=self.idle_after) if self.idle_after > 0 else None
+        total = 0
+        # Shards are walked one after the other, each by its own primary keys.
+        for shard in shard_router.shards:
+            after_id = 0
+            while after_id is not None:
+                async with shard_router.session(db, shard) as session:
+                    after_id, moved, active_keys = await crud.archive_db_urls(session, after_id, self.batch_size, inactive_before, idle_before)
+                # Links archived while active may still be cached.
+                for key in active_keys:
+                    await publish_invalidation(self.redis, key)
+                    await safe_redis_delete(self.redis, key)
+                edge_purger.purge(*active_keys)
+                total += moved
+                if lease is not None:
+                    await self._renew_lease(lease)
+                if after_id is not None and self.batch_pause > 0:
+                    await asyncio.sleep(self.batch_pause)
+        if total:
+            LINKS_ARCHIVED.inc(total)
+            self.archived += total
+            logging.logger.info("Archived %d links", total)
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if (lease := await self._take_lease()) is None:
+                continue
+            try:
+                await self.archive_pass(lease=lease)
+            except Exception:
+                logging.logger.exception("Archive pass failed; retrying in %ss", self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+archiver = Archiver(
+    redis_client,
+    interval=settings.archive_interval,
+    batch_size=settings.archive_batch_size,
+    batch_pause=settings.archive_batch_pause,
+    inactive_after=settings.archive_inactive_after,
+    idle_after=settings.archive_idle_after,
+)
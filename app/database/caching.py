@@ -1,28 +1,276 @@
+# -------------------------------------------------------
+# Redis Client and Circuit Breaker
+# -------------------------------------------------------
+# This module owns the Redis connection pool and the client shared by the
+# request handlers and the per-worker background components.
+# Redis health is tracked by a circuit breaker (app.core.circuit_breaker) fed by
+# two sources:
+#   - every command and pipeline: connection errors count as failures, and so do
+#     timeouts of calls made through redis_wait() (a cancelled command alone does not:
+#     it may be a client that went away or a worker shutting down);
+#   - RedisHealthProbe: a background PING every REDIS_PROBE_INTERVAL seconds,
+#     which is also the only way out of the open state.
+# While the breaker is open, commands raise CircuitOpenError straight away and
+# callers fall back to the database without waiting out their timeouts.
+# Cached links are written and refreshed with TTLs from app.core.ttl_policy.
+# Links with an expiry time are cached as "<expiry unix time>|<target>" (see
+# encode_entry), so that readers can cap their own copies at the expiry and never
+# extend the Redis entry past it. Links whose redirect policy (app/core/http_cache.py)
+# differs from the configured one are cached as
+# "0|<expiry or empty>,<status>,<max-age>,<s-maxage>|<target>": a reader that does not
+# know the policy form sees an entry that expired in 1970 and goes to the database.
+# Plain targets always start with a URL scheme, so the forms cannot be confused.
+# The in-process cache keeps the same values.
+# -------------------------------------------------------
+
 import redis.asyncio as redis
 import asyncio
+import time
+from datetime import datetime, timezone
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 from app.core import logging
+from app.core.circuit_breaker import CircuitBreaker, HALF_OPEN, OPEN
 from app.core.config import get_settings
+from app.core.http_cache import DEFAULT_POLICY, RedirectPolicy
+from app.core.metrics import REDIS_LATENCY, Gauge
+from app.core.ttl_policy import ttl_policy
 
 settings = get_settings()
 
+# Errors that mean Redis could not be reached, as opposed to e.g. a wrong type error.
+UNAVAILABLE_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+
+# Timeout of a single health probe PING.
+PROBE_TIMEOUT = 0.5
+
 pool = redis.ConnectionPool(
     host=settings.redis_host,
     port=settings.redis_port,
     decode_responses=True,
 )
 
-async def get_redis() -> redis.Redis:
-    client: redis.Redis = redis.Redis(connection_pool=pool)
+# Per-command latency series, keyed by command name so that recording a call does
+# not build a label tuple on every request.
+_command_latency: dict = {}
+_pipeline_latency = REDIS_LATENCY.labels("PIPELINE")
+
+redis_breaker = CircuitBreaker(
+    "redis",
+    failure_threshold=settings.redis_breaker_failure_threshold,
+    reset_timeout=settings.redis_breaker_reset_timeout,
+)
+
+Gauge(
+    "redis_breaker_state", "Redis circuit breaker state: 0 closed, 1 half-open, 2 open.",
+    lambda: {OPEN: 2, HALF_OPEN: 1}.get(redis_breaker.state, 0),
+)
+
+class CircuitOpenError(RedisConnectionError):
+    # Raised instead of sending a command while the breaker is open.
+    pass
+
+def _observe_command(command: str, elapsed: float):
+    child = _command_latency.get(command)
+    if child is None:
+        child = _command_latency[command] = REDIS_LATENCY.labels(command)
+    child.observe(elapsed)
+
+class InstrumentedPipeline(Pipeline):
+    # A pipeline is one round trip, so it is timed as a whole.
+    async def execute(self, raise_on_error: bool = True):
+        if not redis_breaker.allow():
+            raise CircuitOpenError("Redis circuit breaker is open")
+        started = time.perf_counter()
+        try:
+            result = await super().execute(raise_on_error)
+        except UNAVAILABLE_ERRORS:
+            redis_breaker.record_failure()
+            raise
+        finally:
+            _pipeline_latency.observe(time.perf_counter() - started)
+        redis_breaker.record_success()
+        return result
+
+class InstrumentedRedis(redis.Redis):
+    # Redis client that records the latency of every command in REDIS_LATENCY and
+    # reports its outcome to redis_breaker.
+    async def execute_command(self, *args, **options):
+        if not redis_breaker.allow():
+            raise CircuitOpenError("Redis circuit breaker is open")
+        started = time.perf_counter()
+        try:
+            result = await super().execute_command(*args, **options)
+        except UNAVAILABLE_ERRORS:
+            redis_breaker.record_failure()
+            raise
+        finally:
+            _observe_command(args[0], time.perf_counter() - started)
+        redis_breaker.record_success()
+        return result
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+# Client shared by the whole worker; connections come from the pool per command.
+redis_client = InstrumentedRedis(connection_pool=pool)
+
+async def redis_wait(awaitable, timeout: float):
+    # asyncio.wait_for for Redis calls: running out of time counts as a breaker failure.
     try:
-        await client.ping()
-    except Exception as e:
-        logging.logger.warning("Redis ping failed during connection; continuing without cache. Error: %s", e, exc_info=True)
-    return client
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        redis_breaker.record_failure()
+        raise
+
+
+class RedisHealthProbe:
+    def __init__(self, breaker: CircuitBreaker, interval: float):
+        self.breaker = breaker
+        self.interval = interval
+        # Plain client: the probe must reach Redis while the breaker is open.
+        self.client = redis.Redis(connection_pool=pool)
+        self._task: asyncio.Task | None = None
+
+    async def check(self) -> bool:
+        try:
+            await asyncio.wait_for(self.client.ping(), timeout=PROBE_TIMEOUT)
+            healthy = True
+        except Exception:
+            healthy = False
+        previous = self.breaker.state
+        self.breaker.record_probe(healthy)
+        if self.breaker.state != previous:
+            logging.logger.warning("Redis circuit breaker %s -> %s", previous, self.breaker.state)
+        return healthy
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
 
-async def safe_redis_set(client: redis.Redis, key: str, value: str, ex: int):
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+redis_probe = RedisHealthProbe(redis_breaker, settings.redis_probe_interval)
+
+async def get_redis() -> redis.Redis:
+    # Redis health is tracked by redis_probe and redis_breaker, not checked per request.
+    return redis_client
+
+def seconds_until(expires_at: datetime | None) -> float | None:
+    # Seconds left before a link expires, None for links without an expiry.
+    # Naive datetimes (SQLite) are UTC.
+    if expires_at is None:
+        return None
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.timestamp() - time.time()
+
+def encode_entry(target_url: str, expires_at: datetime | None, policy: RedirectPolicy | None = None) -> str:
+    # Cache value of a link; the expiry is rounded down so copies never outlive the link.
+    expires = "" if expires_at is None else str(int(time.time() + seconds_until(expires_at)))
+    if policy is not None and policy != DEFAULT_POLICY:
+        return f"0|{expires},{policy.status_code},{policy.max_age},{policy.s_maxage}|{target_url}"
+    if expires_at is None:
+        return target_url
+    return f"{expires}|{target_url}"
+
+def decode_entry(value: str | None) -> tuple[str | None, float | None, RedirectPolicy]:
+    # (target URL, seconds until the link expires or None, redirect policy) of a cache value.
+    if not value or not value[0].isdigit():
+        return value, None, DEFAULT_POLICY
+    expires, _, target_url = value.partition("|")
+    if expires != "0":
+        return target_url, int(expires) - time.time(), DEFAULT_POLICY
+    fields, _, target_url = target_url.partition("|")
+    expires, status_code, max_age, s_maxage = fields.split(",")
+    return target_url, int(expires) - time.time() if expires else None, RedirectPolicy(int(status_code), int(max_age), int(s_maxage))
+
+async def safe_redis_set(
+    client: redis.Redis, key: str, value: str, clicks: int = 0, expires_at: datetime | None = None, policy: RedirectPolicy | None = None,
+):
+    # Cache a link with the TTL the policy gives it for its click count, capped at its expiry.
+    ttl = ttl_policy.ttl(clicks, seconds_until(expires_at))
+    if not ttl or not redis_breaker.allow():
+        return
     try:
-        await asyncio.wait_for(client.set(key, value, ex=ex), timeout=0.75)
+        await redis_wait(client.set(key, encode_entry(value, expires_at, policy), ex=ttl), timeout=0.75)
     except asyncio.TimeoutError as e:
         logging.logger.warning("Timed out setting Redis key=%s", key)
     except Exception:
-        logging.logger.exception("Error setting Redis key=%s", key)    
\ No newline at end of file
+        logging.logger.exception("Error setting Redis key=%s", key)
+
+async def safe_redis_delete(client: redis.Redis, key: str) -> bool:
+    # Best-effort removal of a cached key. Returns False if Redis could not be reached.
+    if not redis_breaker.allow():
+        return False
+    try:
+        await redis_wait(client.delete(key), timeout=0.2)
+        return True
+    except asyncio.TimeoutError:
+        logging.logger.warning("Timed out deleting Redis key=%s", key)
+    except Exception:
+        logging.logger.exception("Error deleting Redis key=%s", key)
+    return False
+
+async def safe_redis_set_many(
+    client: redis.Redis, items: dict[str, str], clicks: dict[str, int] | None = None, expires: dict[str, datetime] | None = None,
+    policies: dict[str, RedirectPolicy] | None = None,
+) -> bool:
+    # Write many keys in a single pipelined round trip (no MULTI/EXEC transaction).
+    # Each key gets its own (jittered) TTL; keys missing from `clicks` count as unclicked,
+    # keys missing from `expires` never expire, keys missing from `policies` use the default.
+    # Returns False if the keys could not be written.
+    if not items:
+        return True
+    if not redis_breaker.allow():
+        return False
+    clicks = clicks or {}
+    expires = expires or {}
+    policies = policies or {}
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key, value in items.items():
+            expires_at = expires.get(key)
+            if ttl := ttl_policy.ttl(clicks.get(key, 0), seconds_until(expires_at)):
+                pipe.set(key, encode_entry(value, expires_at, policies.get(key)), ex=ttl)
+        await redis_wait(pipe.execute(), timeout=2.0)
+        return True
+    except asyncio.TimeoutError:
+        logging.logger.warning("Timed out setting %d Redis keys", len(items))
+    except Exception:
+        logging.logger.exception("Error setting %d Redis keys", len(items))
+    return False
+
+async def get_with_ttl(client: redis.Redis, key: str) -> tuple[str | None, float]:
+    # GET a cached link together with its remaining lifetime in seconds (one round trip).
+    # The lifetime is only needed for early refresh; -1 when that is disabled.
+    if ttl_policy.refresh_scale <= 0:
+        return await client.get(key), -1
+    pipe = client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    value, remaining_ms = await pipe.execute()
+    return value, remaining_ms / 1000 if remaining_ms >= 0 else -1
+
+async def refresh_if_due(client: redis.Redis, key: str, remaining: float, expires_in: float | None = None):
+    # Probabilistic early refresh of an entry that was just read from Redis.
+    # Entries of links with an expiry are never extended.
+    if expires_in is not None or not ttl_policy.should_refresh(remaining):
+        return
+    try:
+        await redis_wait(client.expire(key, ttl_policy.refresh_ttl()), timeout=0.25)
+    except Exception:
+        logging.logger.warning("Failed to refresh TTL of Redis key=%s", key)
@@ -0,0 +1,306 @@
+# -------------------------------------------------------
+# Buffered Click Counting
+# -------------------------------------------------------
+# This module aggregates redirect clicks outside of Postgres and periodically
+# flushes them to urls.clicks, so cache hits do not cost a database write and
+# hot links do not contend on a single row lock.
+#
+# Two backends are available (CLICK_BUFFER_BACKEND):
+#   - "memory": increments are counted in this worker's process.
+#   - "redis":  increments go to a shared Redis hash (HINCRBY per key), so counts
+#               survive a worker restart and any worker can flush them.
+# Flushes run on a timer (CLICK_FLUSH_INTERVAL) or once CLICK_FLUSH_THRESHOLD
+# clicks are pending, and always on shutdown. Each flush is written as one
+# multi-row UPDATE per chunk of keys (and per shard, see shards.py). Clicks of
+# links archived in the meantime are added to their urls_archive row.
+#
+# Delivery guarantees (CLICK_DELIVERY):
+#   - "at_least_once": clicks are only discarded after the database commit
+#     succeeds. A batch is committed per shard, and the keys of each committed shard
+#     are discarded straight away; only the rest of a failed batch is retried. A
+#     crash between a commit and its cleanup can count those keys twice.
+#   - "bounded_loss": a batch is discarded before it is written. A failed write
+#     or crash loses at most one batch, but clicks are never counted twice.
+# -------------------------------------------------------
+
+import asyncio
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import redis.asyncio as redis
+from sqlalchemy import case, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.core import key_codec, logging, metrics
+from app.core.config import get_settings
+from .caching import CircuitOpenError, redis_client, redis_wait
+from .database import shard_router
+
+settings = get_settings()
+
+# Redis keys used by the "redis" backend.
+PENDING_HASH = "clicks:pending"
+FLUSHING_HASH = "clicks:flushing"
+FLUSH_LOCK = "clicks:flush-lock"
+
+# Maximum number of keys written by a single UPDATE statement.
+FLUSH_CHUNK_SIZE = 500
+
+CLICKS_DROPPED = metrics.Counter("clicks_dropped_total", "Flushed clicks of keys found neither in urls nor in urls_archive.")
+
+
+class ClickBuffer:
+    def __init__(self, backend: str, flush_interval: float, flush_threshold: int, delivery: str, redis_client: redis.Redis | None = None):
+        if backend not in ("memory", "redis"):
+            raise ValueError(f"Unknown click buffer backend: {backend}")
+        if delivery not in ("at_least_once", "bounded_loss"):
+            raise ValueError(f"Unknown click delivery mode: {delivery}")
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.delivery = delivery
+        self.redis = redis_client
+        # Clicks counted in this process and not yet handed to the database (memory backend),
+        # or not yet handed to Redis because the HINCRBY failed (redis backend).
+        self._counts: Counter = Counter()
+        # Batch currently being written by flush(); still reported as pending.
+        self._in_flight: Counter = Counter()
+        # Clicks recorded since the last flush, used for the size threshold.
+        self._since_flush = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._threshold_task: asyncio.Task | None = None
+
+    async def record(self, key: str, count: int = 1):
+        # Count a click for the given short key. Never touches Postgres.
+        if self.backend == "redis":
+            try:
+                await redis_wait(self.redis.hincrby(PENDING_HASH, key, count), timeout=0.25)
+            except CircuitOpenError:
+                # Redis is known to be down; count locally without logging every click.
+                self._counts[key] += count
+            except Exception:
+                # Keep the click locally; it is pushed to the database on the next flush.
+                logging.logger.warning("Failed to buffer click in Redis for key=%s; keeping it in process", key)
+                self._counts[key] += count
+        else:
+            self._counts[key] += count
+
+        self._since_flush += count
+        if self._since_flush >= self.flush_threshold and not self._flush_lock.locked():
+            self._threshold_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def pending(self, key: str) -> int:
+        # Number of clicks for the key that have been recorded but not yet written to urls.clicks.
+        total = self._counts.get(key, 0) + self._in_flight.get(key, 0)
+        if self.backend == "redis":
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hget(PENDING_HASH, key)
+                pipe.hget(FLUSHING_HASH, key)
+                for value in await redis_wait(pipe.execute(), timeout=0.25):
+                    total += int(value or 0)
+            except Exception:
+                logging.logger.warning("Failed to read pending clicks from Redis for key=%s", key)
+        return total
+
+    async def flush(self, db: AsyncSession | None = None) -> int:
+        # Write all pending clicks to the database. Returns the number of clicks written.
+        async with self._flush_lock:
+            self._since_flush = 0
+            written = await self._flush_local(db)
+            if self.backend == "redis":
+                written += await self._flush_redis(db)
+            return written
+
+    async def _flush_local(self, db: AsyncSession | None) -> int:
+        if not self._counts:
+            return 0
+        batch, self._counts = self._counts, Counter()
+        self._in_flight = batch
+        # Keys whose clicks a shard has committed.
+        done = set()
+
+        async def applied(keys):
+            done.update(keys)
+
+        try:
+            await self._apply(db, batch, applied)
+        except Exception:
+            left = Counter({key: count for key, count in batch.items() if key not in done})
+            if self.delivery == "at_least_once":
+                # Put back what was not committed, so the next flush retries only that.
+                self._counts.update(left)
+                logging.logger.exception("Click flush failed; %d clicks kept for retry", sum(left.values()))
+            else:
+                logging.logger.exception("Click flush failed; dropped %d clicks", sum(left.values()))
+            return sum(batch.values()) - sum(left.values())
+        finally:
+            self._in_flight = Counter()
+        return sum(batch.values())
+
+    async def _flush_redis(self, db: AsyncSession | None) -> int:
+        # Only one worker may move the shared hash at a time.
+        token = uuid.uuid4().hex
+        try:
+            if not await self.redis.set(FLUSH_LOCK, token, nx=True, ex=max(30, int(self.flush_interval * 4))):
+                return 0
+        except Exception:
+            logging.logger.warning("Could not acquire click flush lock in Redis", exc_info=True)
+            return 0
+
+        try:
+            # A leftover flushing hash means an earlier flush did not finish; write it first.
+            if not await self.redis.exists(FLUSHING_HASH):
+                try:
+                    await self.redis.rename(PENDING_HASH, FLUSHING_HASH)
+                except redis.ResponseError:
+                    # Nothing pending.
+                    return 0
+
+            if self.delivery == "bounded_loss":
+                pipe = self.redis.pipeline(transaction=True)
+                pipe.hgetall(FLUSHING_HASH)
+                pipe.delete(FLUSHING_HASH)
+                raw, _ = await pipe.execute()
+            else:
+                raw = await self.redis.hgetall(FLUSHING_HASH)
+
+            batch = Counter({key: int(value) for key, value in raw.items()})
+            done = set()
+
+            async def applied(keys):
+                # Committed keys leave the flushing hash at once, so a retry does not add them again.
+                done.update(keys)
+                if self.delivery == "at_least_once" and keys:
+                    await self.redis.hdel(FLUSHING_HASH, *keys)
+
+            try:
+                await self._apply(db, batch, applied)
+            except Exception:
+                logging.logger.exception("Click flush from Redis failed (%d clicks, delivery=%s)", sum(batch.values()), self.delivery)
+                return sum(count for key, count in batch.items() if key in done)
+
+            if self.delivery == "at_least_once":
+                await self.redis.delete(FLUSHING_HASH)
+            return sum(batch.values())
+        finally:
+            try:
+                if await self.redis.get(FLUSH_LOCK) == token:
+                    await self.redis.delete(FLUSH_LOCK)
+            except Exception:
+                logging.logger.warning("Failed to release click flush lock", exc_info=True)
+
+    async def _apply(self, db: AsyncSession | None, batch: Counter, applied=None):
+        # Apply the batch as multi-row updates on the shard of each key:
+        #   UPDATE urls SET clicks = clicks + CASE key WHEN 'A' THEN 3 WHEN 'B' THEN 1 ... END
+        #   WHERE key IN ('A', 'B', ...)
+        # Keys of a bucket that is being moved are counted on its source shard, and on the
+        # destination only if the source no longer had the row. Keys whose row has been
+        # archived since the click are counted in urls_archive; clicks of keys found in
+        # neither are dropped, logged and counted.
+        # applied(keys) is awaited after each commit with the keys it settled.
+        if not batch:
+            return
+        pending = {key: shard_router.shards_for_key(key) for key in batch}
+        unmatched: dict = {}
+        while pending:
+            by_shard: dict = {}
+            for key, shards in pending.items():
+                by_shard.setdefault(shards[0], {})[key] = batch[key]
+            missed = {}
+            for shard, clicks in by_shard.items():
+                async with shard_router.session(db, shard) as session:
+                    updated = await self._update(session, clicks)
+                if applied is not None:
+                    await applied(updated)
+                for key in clicks.keys() - updated:
+                    if len(pending[key]) > 1:
+                        missed[key] = pending[key][1:]
+                    else:
+                        unmatched.setdefault(shard, {})[key] = batch[key]
+            pending = missed
+        for shard, clicks in unmatched.items():
+            async with shard_router.session(db, shard) as session:
+                archived = await self._update_archived(session, clicks)
+            if applied is not None:
+                # Clicks of keys without a row are dropped below; they are settled too.
+                await applied(set(clicks))
+            dropped = {key: count for key, count in clicks.items() if key not in archived}
+            if dropped:
+                CLICKS_DROPPED.inc(sum(dropped.values()))
+                logging.logger.warning(
+                    "Dropped %d clicks of %d keys that have no row: %s", sum(dropped.values()), len(dropped), ", ".join(sorted(dropped)[:20]),
+                )
+
+    async def _update(self, db: AsyncSession, clicks: dict) -> set[str]:
+        # Add the clicks on one shard and commit. Returns the keys that had a row.
+        updated = set()
+        items = list(clicks.items())
+        now = datetime.now(timezone.utc)
+        for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+            chunk = dict(items[start:start + FLUSH_CHUNK_SIZE])
+            column = models.URL.key
+            if settings.key_storage == "compact":
+                # Match on key_id unless a key in the chunk has no compact form.
+                key_ids = [key_codec.key_to_id(key) for key in chunk]
+                if None not in key_ids:
+                    column, chunk = models.URL.key_id, dict(zip(key_ids, chunk.values()))
+            stmt = (
+                update(models.URL)
+                .where(column.in_(chunk.keys()))
+                .values(clicks=models.URL.clicks + case(chunk, value=column, else_=0), last_clicked_at=now)
+                .returning(models.URL.key)
+            )
+            updated.update((await db.execute(stmt)).scalars())
+        await db.commit()
+        return updated
+
+    async def _update_archived(self, db: AsyncSession, clicks: dict) -> set[str]:
+        # Late clicks of links archived after they were recorded. last_clicked_at is left
+        # alone: the row is archived either way.
+        column = models.ArchivedURL.key
+        stmt = (
+            update(models.ArchivedURL)
+            .where(column.in_(clicks.keys()))
+            .values(clicks=models.ArchivedURL.clicks + case(clicks, value=column, else_=0))
+            .returning(column)
+        )
+        updated = set((await db.execute(stmt)).scalars())
+        await db.commit()
+        return updated
+
+    async def _run(self):
+        # Timer loop started by the application lifespan.
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.logger.exception("Unexpected error in click flush loop")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # Stop the timer and write everything that is still pending.
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+click_buffer = ClickBuffer(
+    backend=settings.click_buffer_backend,
+    flush_interval=settings.click_flush_interval,
+    flush_threshold=settings.click_flush_threshold,
+    delivery=settings.click_delivery,
+    redis_client=redis_client,
+)
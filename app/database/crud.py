@@ -4,88 +4,494 @@
 # This module provides all Create, Read, Update, Delete (CRUD) operations
 # for URL objects in the database. It encapsulates database queries and
 # persistence logic, serving as the data access layer for the application.
-# All functions accept a SQLAlchemy Session object for database interaction
-# and return ORM model instances or None.
+# All functions are coroutines that accept a SQLAlchemy AsyncSession for database
+# interaction and return ORM model instances or None.
+# Read-only lookups go to a read replica when one is configured (see replicas.py);
+# writes, and reads that precede a write, always use the primary.
+# Archived links (urls_archive, see archive.py) are only read by admin lookups and
+# by key allocation.
+# With KEY_STORAGE=compact, links are found by key_id / secret_token (see
+# key_codec.py) instead of the key / secret_key strings; every row written here
+# stores both forms.
+# With SHARD_DATABASE_URLS, each statement runs on the shard of the key it is about
+# (see shards.py): the caller's session is used for shard 0, other shards get their
+# own. Only shard 0 has read replicas.
 # -------------------------------------------------------
 
-from sqlalchemy.orm import Session
-from sqlalchemy import update
+from datetime import datetime, timezone
 
-from app.core import keygen
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy import and_, delete, func, insert, literal, not_, or_, select, union, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.core import key_codec, keygen, logging
+from app.core.config import get_settings
+from app.core.metrics import KEYGEN_RETRIES
+from app.core.url_utils import normalize_target_url, target_url_hash
 from app import schemas, models
+from .database import replica_router, shard_router
+from .key_filter import key_filter
+from .shards import Shard, bucket_of
+
+settings = get_settings()
+
+# Attempts made when an allocated key is already taken. Sequence keys can only collide
+# with keys created by the older random strategy, so a retry is rare and cheap.
+KEY_COLLISION_RETRIES = 5
+
+# Rows written per multi-row INSERT; keeps the statement below the bind parameter limit.
+BULK_INSERT_CHUNK_SIZE = 5000
+
+def _utc(expires_at: datetime | None) -> datetime | None:
+    # Expiry times are stored in UTC; naive input is taken to be UTC already.
+    if expires_at is None:
+        return None
+    if expires_at.tzinfo is None:
+        return expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.astimezone(timezone.utc)
 
-def create_db_url(db: Session, url: schemas.URLBase) -> models.URL:
-    # Generate a unique short key for the URL. This key is used in the shortened URL path.
-    key = keygen.create_unique_key(db)
-    # Create a secret key for administrative operations (delete/deactivate).
-    # Combines the key with 8 additional random characters for security.
-    secret_key = f"{key}_{keygen.create_key(8)}"
-
-    # Create a new URL model instance with the provided target URL and generated keys.
-    db_url = models.URL(
-        target_url=url.target_url,
-        key=key,
-        secret_key=secret_key
+def _live():
+    # Links that redirect: active, not expired and below their click limit. Part of the
+    # lookup query itself, so enforcing expiry costs no extra round trip.
+    return and_(
+        models.URL.is_active,
+        or_(models.URL.expires_at.is_(None), models.URL.expires_at > datetime.now(timezone.utc)),
+        or_(models.URL.max_clicks.is_(None), models.URL.clicks < models.URL.max_clicks),
     )
-    # Add the new URL object to the session and persist it to the database.
-    db.add(db_url)
-    db.commit()
-    # Refresh the object from the database to populate any auto-generated fields (e.g., id, timestamps).
-    db.refresh(db_url)
+
+def _key_is(table, url_key: str):
+    # Condition for the row with this short key.
+    if settings.key_storage == "compact":
+        if (key_id := key_codec.key_to_id(url_key)) is not None:
+            return table.key_id == key_id
+        # key_id is NULL exactly for keys without a compact form.
+        return and_(table.key_id.is_(None), table.key == url_key)
+    return table.key == url_key
+
+def _secret_key_is(table, secret_key: str):
+    # Condition for the row with this secret key. Compact secret keys are found through
+    # the key_id index; the token is compared on that single row.
+    if settings.key_storage == "compact":
+        legacy = and_(table.secret_token.is_(None), table.secret_key == secret_key)
+        if (parts := key_codec.split_secret_key(secret_key)) is not None:
+            key_id, token = parts
+            return or_(and_(table.key_id == key_id, table.secret_token == token), legacy)
+        return legacy
+    return table.secret_key == secret_key
+
+def _expired():
+    # Active links that have stopped redirecting; matches the partial indexes on urls.
+    return [
+        and_(models.URL.is_active, models.URL.expires_at.isnot(None), models.URL.expires_at <= datetime.now(timezone.utc)),
+        and_(models.URL.is_active, models.URL.max_clicks.isnot(None), models.URL.clicks >= models.URL.max_clicks),
+    ]
+
+async def create_db_url(db: AsyncSession, url: schemas.URLBase) -> models.URL:
+    # In dedup mode, a repeated target returns the link that already exists for it.
+    # Links with an expiry, a click limit or their own redirect policy are always created on their own.
+    shared = settings.dedup_target_urls and not _limited(url)
+    if shared:
+        existing = await get_active_db_urls_by_target(db, [url.target_url])
+        if db_url := existing.get(normalize_target_url(url.target_url)):
+            return db_url
+
+    for attempt in range(KEY_COLLISION_RETRIES):
+        # Generate a unique short key for the URL. This key is used in the shortened URL path.
+        key = await keygen.create_unique_key(db)
+        # Create a secret key for administrative operations (delete/deactivate).
+        # Combines the key with 8 additional random characters for security.
+        # Starting with the key, it also leads admin lookups to the link's shard.
+        secret_key = f"{key}_{keygen.create_key(8)}"
+
+        # The row of the new link, with the provided target URL and generated keys.
+        row = {
+            "target_url": url.target_url,
+            "target_hash": target_url_hash(url.target_url),
+            "key": key,
+            "secret_key": secret_key,
+            **key_codec.compact_columns(key, secret_key),
+            "shard_bucket": bucket_of(key),
+            "is_active": True,
+            "clicks": 0,
+            "expires_at": _utc(url.expires_at),
+            "max_clicks": url.max_clicks,
+            "redirect_code": url.redirect_code,
+            "max_age": url.max_age,
+            "s_maxage": url.s_maxage,
+            "shared": shared or None,
+        }
+        # Write it on the key's shard. The row is skipped, not an error, if its key is taken
+        # or another request has just created the shared link of the same target.
+        async with shard_router.session(db, shard_router.shard_for_new_key(key)) as session:
+            stmt = _insert_ignoring_conflicts(session).values(row).returning(models.URL)
+            db_url = (await session.scalars(stmt)).first()
+            await session.commit()
+        if db_url is not None:
+            break
+        if shared:
+            # The check above and the insert are not atomic; the unique index on shared
+            # targets is. Whoever lost the race returns the winner's link.
+            existing = await get_active_db_urls_by_target(db, [url.target_url])
+            if db_url := existing.get(normalize_target_url(url.target_url)):
+                return db_url
+            # Not a lost race: the key was taken (or, very rarely, another target's shared
+            # link has the same hash). The next attempt creates an unshared link.
+            shared = False
+        KEYGEN_RETRIES.inc()
+        logging.logger.warning("Generated key=%s already exists; allocating another (attempt %d)", key, attempt + 1)
+    else:
+        raise RuntimeError("Could not allocate an unused short key")
+    # Read this link back from the primary for a while, until replicas have caught up.
+    replica_router.remember_write(db_url.key, db_url.secret_key)
+    # Let every worker's key filter know the key now exists.
+    await key_filter.add_issued(db_url.key)
     return db_url
 
-def get_db_url_by_key(db: Session, url_key: str) -> models.URL:
+async def create_db_urls(db: AsyncSession, urls: list[schemas.URLBase]) -> list[models.URL | None]:
+    # Create many URL records at once. Keys are allocated in bulk and rows are written
+    # with multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING statements; rows whose
+    # generated key turned out to be taken are retried with fresh keys, as unshared links.
+    # Returns one entry per input URL, None where no row could be created.
+    results: list[models.URL | None] = [None] * len(urls)
+    remaining = list(range(len(urls)))
+    # In dedup mode, targets that already have an active link reuse it, and repeated
+    # targets inside the batch share the row created for their first occurrence.
+    duplicate_of: dict[int, int] = {}
+    # Inputs whose row becomes the shared link of its target (see create_db_url).
+    shared: set[int] = set()
+    if settings.dedup_target_urls:
+        existing = await get_active_db_urls_by_target(db, [url.target_url for url in urls if not _limited(url)])
+        first_index: dict[str, int] = {}
+        remaining = []
+        for index, url in enumerate(urls):
+            normalized = normalize_target_url(url.target_url)
+            if _limited(url):
+                remaining.append(index)
+            elif normalized in existing:
+                results[index] = existing[normalized]
+            elif normalized in first_index:
+                duplicate_of[index] = first_index[normalized]
+            else:
+                first_index[normalized] = index
+                remaining.append(index)
+        shared = set(first_index.values())
+
+    created_keys = []
+    for attempt in range(KEY_COLLISION_RETRIES):
+        if not remaining:
+            break
+        keys = await keygen.create_unique_keys(db, len(remaining))
+        secret_keys = [f"{key}_{keygen.create_key(8)}" for key in keys]
+        rows = [
+            {
+                "target_url": urls[index].target_url,
+                "target_hash": target_url_hash(urls[index].target_url),
+                "key": key,
+                "secret_key": secret_key,
+                **key_codec.compact_columns(key, secret_key),
+                "shard_bucket": bucket_of(key),
+                "is_active": True,
+                "clicks": 0,
+                "expires_at": _utc(urls[index].expires_at),
+                "max_clicks": urls[index].max_clicks,
+                "redirect_code": urls[index].redirect_code,
+                "max_age": urls[index].max_age,
+                "s_maxage": urls[index].s_maxage,
+                "shared": True if index in shared else None,
+            }
+            for index, key, secret_key in zip(remaining, keys, secret_keys)
+        ]
+        index_by_key = {row["key"]: index for row, index in zip(rows, remaining)}
+        rows_by_shard: dict[Shard, list[dict]] = {}
+        for row in rows:
+            rows_by_shard.setdefault(shard_router.shard_for_new_key(row["key"]), []).append(row)
+        # One transaction per shard; a row is only reported once its shard has committed it.
+        for shard, shard_rows in rows_by_shard.items():
+            async with shard_router.session(db, shard) as session:
+                inserted = []
+                for start in range(0, len(shard_rows), BULK_INSERT_CHUNK_SIZE):
+                    stmt = _insert_ignoring_conflicts(session).values(shard_rows[start:start + BULK_INSERT_CHUNK_SIZE]).returning(models.URL)
+                    inserted.extend(await session.scalars(stmt))
+                await session.commit()
+            for db_url in inserted:
+                results[index_by_key.pop(db_url.key)] = db_url
+                created_keys.append(db_url.key)
+        remaining = list(index_by_key.values())
+        if lost := [index for index in remaining if index in shared]:
+            # Rows skipped by the unique index on shared targets: another request created
+            # the target's link meanwhile, and these inputs return it.
+            existing = await get_active_db_urls_by_target(db, [urls[index].target_url for index in lost])
+            for index in lost:
+                shared.discard(index)
+                if db_url := existing.get(normalize_target_url(urls[index].target_url)):
+                    results[index] = db_url
+                    remaining.remove(index)
+        if remaining:
+            KEYGEN_RETRIES.inc(len(remaining))
+            logging.logger.warning("%d generated keys already existed; allocating others (attempt %d)", len(remaining), attempt + 1)
+    replica_router.remember_write(*created_keys)
+    replica_router.remember_write(*(db_url.secret_key for db_url in results if db_url is not None))
+    for index, first in duplicate_of.items():
+        results[index] = results[first]
+    await key_filter.add_issued(*created_keys)
+    return results
+
+def _limited(url: schemas.URLBase) -> bool:
+    return any(value is not None for value in (url.expires_at, url.max_clicks, url.redirect_code, url.max_age, url.s_maxage))
+
+def _insert_ignoring_conflicts(db: AsyncSession):
+    # INSERT that skips rows violating a unique index instead of failing the whole statement.
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(models.URL).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(models.URL).on_conflict_do_nothing()
+    return insert(models.URL)
+
+async def get_active_db_urls_by_target(db: AsyncSession, target_urls: list[str]) -> dict[str, models.URL]:
+    # Find active links for the given targets through the target_hash index.
+    # Returns {normalized target: oldest active link}. Candidates are compared on the
+    # normalized URL as well, so a hash collision can never return the wrong link.
+    wanted = {normalize_target_url(target_url) for target_url in target_urls}
+    stmt = (
+        select(models.URL)
+        .where(
+            models.URL.target_hash.in_([target_url_hash(target_url) for target_url in target_urls]),
+            models.URL.is_active,
+            # Only unlimited links with the default redirect policy are shared between requests.
+            models.URL.expires_at.is_(None),
+            models.URL.max_clicks.is_(None),
+            models.URL.redirect_code.is_(None),
+            models.URL.max_age.is_(None),
+            models.URL.s_maxage.is_(None),
+        )
+        .order_by(models.URL.id)
+    )
+    found: dict[str, models.URL] = {}
+    # Any shard may hold a link for the target; shards are asked in order.
+    for shard in shard_router.shards:
+        async with shard_router.session(db, shard) as session:
+            for db_url in (await session.execute(stmt)).scalars():
+                normalized = normalize_target_url(db_url.target_url)
+                if normalized in wanted:
+                    found.setdefault(normalized, db_url)
+    return found
+
+async def _read(db: AsyncSession, stmt, identifier: str | None, confirm_missing: bool):
+    # Run a read-only SELECT on a replica if one is available, otherwise on the primary.
+    # A failing replica is taken out of rotation and the query retried on the primary.
+    # With confirm_missing, or when the replica is behind, an empty replica result is
+    # re-checked on the primary, since the row may simply not have been replicated yet.
+    # Redirects skip this: their 404s would cost two queries and load the primary, and
+    # recently issued keys are read from the primary anyway (replica_router.pick).
+    replica = replica_router.pick(identifier) if identifier is not None else replica_router.pick()
+    if replica is not None:
+        try:
+            result = await db.execute(stmt.execution_options(replica=replica))
+            rows = result.scalars().all()
+            if rows or not (confirm_missing or replica_router.behind(replica)):
+                return rows
+        except DBAPIError as e:
+            replica_router.mark_down(replica, e)
+    return (await db.execute(stmt)).scalars().all()
+
+async def _select(db: AsyncSession, shard: Shard, stmt, identifier: str | None, replica: bool = True, confirm_missing: bool = False):
+    # Run a SELECT on one shard; replicas (see _read) only exist for shard 0.
+    async with shard_router.session(db, shard) as session:
+        if replica and shard is shard_router.default:
+            return await _read(session, stmt, identifier, confirm_missing)
+        return (await session.execute(stmt)).scalars().all()
+
+async def get_existing_keys(db: AsyncSession, keys) -> set[str]:
+    # Return the subset of the given short keys that are already used by any row.
+    # A key a replica has not seen yet makes the insert skip its row, which is retried.
+    # Archived keys count as used, so they are never issued again.
+    # Each key is looked for on the shard(s) of its bucket only.
+    existing = set()
+    for shard, shard_keys in shard_router.group_keys(keys).items():
+        existing |= await _get_existing_keys_on(db, shard, shard_keys)
+    return existing
+
+async def _get_existing_keys_on(db: AsyncSession, shard: Shard, keys: list[str]) -> set[str]:
+    if settings.key_storage == "compact":
+        key_ids = [key_id for key in keys if (key_id := key_codec.key_to_id(key)) is not None]
+        if len(key_ids) == len(keys):
+            stmt = union(
+                select(models.URL.key_id).where(models.URL.key_id.in_(key_ids)),
+                select(models.ArchivedURL.key_id).where(models.ArchivedURL.key_id.in_(key_ids)),
+            )
+            return {key_codec.id_to_key(key_id) for key_id in await _select(db, shard, stmt, None)}
+    stmt = union(
+        select(models.URL.key).where(models.URL.key.in_(keys)),
+        select(models.ArchivedURL.key).where(models.ArchivedURL.key.in_(keys)),
+    )
+    return set(await _select(db, shard, stmt, None))
+
+async def get_db_url_by_key(db: AsyncSession, url_key: str, replica: bool = True, confirm_missing: bool = False) -> models.URL:
     # Query the database for an active URL record matching the provided short key.
     # Returns the first matching URL object, or None if not found.
-    return (
-        db.query(models.URL)
-        .filter(models.URL.key == url_key, models.URL.is_active)  # Filter by key and active status
-        .first()  # Retrieve only the first result
-    )
+    stmt = select(models.URL).where(_key_is(models.URL, url_key), _live())  # Filter by key and active, unexpired status
+    # A key has one shard, or two while its bucket is being moved (source first).
+    for shard in shard_router.shards_for_key(url_key):
+        if rows := await _select(db, shard, stmt, url_key, replica, confirm_missing):
+            return rows[0]  # Retrieve only the first result
+    return None
 
-def get_db_url_by_secret_key(db: Session, secret_key: str) -> models.URL:
+async def get_db_url_by_secret_key(db: AsyncSession, secret_key: str, replica: bool = True, include_inactive: bool = False) -> models.URL:
     # Query the database for an active URL record matching the provided secret key.
     # The secret key is required for sensitive operations like deletion or deactivation.
     # Returns the first matching URL object, or None if not found.
-    return (
-        db.query(models.URL)
-        .filter(models.URL.secret_key == secret_key, models.URL.is_active)  # Filter by secret key and active status
-        .first()  # Retrieve only the first result
-    )
+    # include_inactive also returns deactivated and expired links (admin info).
+    stmt = select(models.URL).where(_secret_key_is(models.URL, secret_key))
+    if not include_inactive:
+        stmt = stmt.where(_live())  # Filter by active, unexpired status
+    # The secret key starts with the link's key, which names the shard.
+    for shard in shard_router.shards_for_secret_key(secret_key):
+        if rows := await _select(db, shard, stmt, secret_key, replica, confirm_missing=True):
+            return rows[0]  # Retrieve only the first result
+    return None
 
-def add_click(db: Session, db_url: schemas.URL) -> models.URL:
+async def get_archived_db_url_by_secret_key(db: AsyncSession, secret_key: str) -> models.ArchivedURL | None:
+    # Look up a link moved to the archive; only admin queries check the archive.
+    stmt = select(models.ArchivedURL).where(_secret_key_is(models.ArchivedURL, secret_key)).order_by(models.ArchivedURL.archived_at.desc())
+    for shard in shard_router.shards_for_secret_key(secret_key):
+        if rows := await _select(db, shard, stmt, secret_key, confirm_missing=True):
+            return rows[0]
+    return None
+
+async def add_click(db: AsyncSession, db_url: schemas.URL) -> models.URL:
     # Increment the click counter for a URL record, tracking how many times it has been accessed.
     db_url.clicks += 1
     # Persist the updated click count to the database.
-    db.commit()
+    await db.commit()
     # Refresh the object to ensure the latest state from the database.
-    db.refresh(db_url)
+    await db.refresh(db_url)
     return db_url
 
-def add_click_by_key(db: Session, url_key: str) -> models.URL:
+async def add_click_by_key(db: AsyncSession, url_key: str) -> models.URL:
     # Increment the click counter for a URL identified by its short key.
     # This function uses a SQL UPDATE statement for efficiency.
     stmt = (
         update(models.URL)
-        .where(models.URL.key == url_key, models.URL.is_active)
+        .where(_key_is(models.URL, url_key), models.URL.is_active)
         .values(clicks=models.URL.clicks + 1)
         .returning(models.URL)
     )
-    result = db.execute(stmt)
-    db.commit()
-    return result.scalars().first()
-
-def deactivate_db_url_by_secret_key(db: Session, secret_key: str) -> models.URL:
-    # Retrieve the URL record using the provided secret key for authentication.
-    db_url = get_db_url_by_secret_key(db, secret_key)
-    # Only proceed if the URL record exists. This is a soft delete operation.
-    if db_url:
-        # Mark the URL as inactive instead of permanently deleting it.
-        # This preserves the record for audit purposes while making it inaccessible.
-        db_url.is_active = False
-        # Persist the change to the database.
-        db.commit()
-        # Refresh the object to reflect the updated active status.
-        db.refresh(db_url)
-    # Return the updated URL object, or None if no matching record was found.
-    return db_url    
\ No newline at end of file
+    # While the key's bucket is being moved, the destination only counts the click if the
+    # source no longer has the row.
+    for shard in shard_router.shards_for_key(url_key):
+        async with shard_router.session(db, shard) as session:
+            db_url = (await session.execute(stmt)).scalars().first()
+            await session.commit()
+        if db_url is not None:
+            return db_url
+    return None
+
+async def consume_click(db: AsyncSession, url_key: str) -> str | None:
+    # Count one redirect of a click-limited link and return its target, or None once the
+    # link has expired or used up its clicks. Checking and counting in one UPDATE keeps
+    # concurrent redirects from going over the limit.
+    stmt = (
+        update(models.URL)
+        .where(_key_is(models.URL, url_key), _live())
+        .values(clicks=models.URL.clicks + 1, last_clicked_at=datetime.now(timezone.utc))
+        .returning(models.URL.target_url)
+    )
+    for shard in shard_router.shards_for_key(url_key):
+        async with shard_router.session(db, shard) as session:
+            target_url = (await session.execute(stmt)).scalar()
+            await session.commit()
+        if target_url is not None:
+            return target_url
+    return None
+
+async def deactivate_expired_db_urls(db: AsyncSession, batch_size: int) -> list[tuple[str, str]]:
+    # Deactivate up to batch_size expired or used-up links per condition and return their
+    # (key, secret key). Rows locked by another worker's sweep are skipped, not waited for.
+    deactivated = []
+    for condition in _expired():
+        batch = select(models.URL.id).where(condition).limit(batch_size).with_for_update(skip_locked=True)
+        stmt = (
+            update(models.URL)
+            .where(models.URL.id.in_(batch.scalar_subquery()))
+            .values(is_active=False, deactivated_at=datetime.now(timezone.utc))
+            .returning(models.URL.key, models.URL.secret_key)
+            .execution_options(synchronize_session=False)
+        )
+        deactivated.extend((key, secret_key) for key, secret_key in await db.execute(stmt))
+    await db.commit()
+    replica_router.remember_write(*(identifier for row in deactivated for identifier in row))
+    return deactivated
+
+async def deactivate_db_url_by_secret_key(db: AsyncSession, secret_key: str) -> models.URL:
+    # Find and deactivate the URL record using the provided secret key for authentication,
+    # in one UPDATE on the link's shard so a concurrent rebalance cannot move it in between.
+    # This is a soft delete: the record is kept for audit purposes but no longer redirects.
+    stmt = (
+        update(models.URL)
+        .where(_secret_key_is(models.URL, secret_key), _live())
+        .values(is_active=False, deactivated_at=datetime.now(timezone.utc))
+        .returning(models.URL)
+        # A copy of the row already loaded into this session is updated too.
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    for shard in shard_router.shards_for_secret_key(secret_key):
+        async with shard_router.session(db, shard) as session:
+            db_url = (await session.execute(stmt)).scalars().first()
+            # Persist the change to the database.
+            await session.commit()
+        if db_url:
+            replica_router.remember_write(db_url.key, db_url.secret_key)
+            return db_url
+    # No matching record was found.
+    return None
+
+
+# Columns copied from urls into urls_archive.
+ARCHIVED_COLUMNS = (
+    "id", "key", "secret_key", "key_id", "secret_token", "shard_bucket", "target_url", "target_hash", "clicks", "expires_at", "max_clicks",
+    "redirect_code", "max_age", "s_maxage", "created_at", "last_clicked_at",
+)
+
+async def archive_db_urls(
+    db: AsyncSession, after_id: int, batch_size: int, inactive_before: datetime, idle_before: datetime | None,
+) -> tuple[int | None, int, list[str]]:
+    # Move archivable rows among the next batch_size rows after after_id (by primary key)
+    # into urls_archive, in one transaction. Walking the primary key keeps each batch
+    # cheap without an index on the lifecycle columns.
+    # Archivable: inactive since before inactive_before (or since before the column
+    # existed), or, with idle_before, active but not clicked (or created) since then.
+    # Returns the last id examined (None at the end of the table), the number of rows
+    # moved, and the keys of moved rows that were still active, which the caller evicts
+    # from the caches.
+    ids = (await db.execute(select(models.URL.id).where(models.URL.id > after_id).order_by(models.URL.id).limit(batch_size))).scalars().all()
+    if not ids:
+        return None, 0, []
+    conditions = [and_(not_(models.URL.is_active), or_(models.URL.deactivated_at.is_(None), models.URL.deactivated_at < inactive_before))]
+    if idle_before is not None:
+        conditions.append(and_(models.URL.is_active, func.coalesce(models.URL.last_clicked_at, models.URL.created_at) < idle_before))
+    # Rows another worker is archiving (or updating) right now are left for a later pass.
+    candidates = select(models.URL.id).where(models.URL.id.between(ids[0], ids[-1]), or_(*conditions)).with_for_update(skip_locked=True)
+    moving = (await db.execute(candidates)).scalars().all()
+    active_keys = []
+    if moving:
+        now = datetime.now(timezone.utc)
+        columns = [getattr(models.URL, name) for name in ARCHIVED_COLUMNS]
+        await db.execute(
+            insert(models.ArchivedURL).from_select(
+                [*ARCHIVED_COLUMNS, "is_active", "deactivated_at", "archived_at"],
+                # Idle rows are deactivated by being archived.
+                select(*columns, literal(False), func.coalesce(models.URL.deactivated_at, now), literal(now, models.URL.deactivated_at.type))
+                .where(models.URL.id.in_(moving)),
+            )
+        )
+        moved = await db.execute(
+            delete(models.URL).where(models.URL.id.in_(moving)).returning(models.URL.key, models.URL.secret_key, models.URL.is_active)
+            .execution_options(synchronize_session=False)
+        )
+        rows = moved.all()
+        active_keys = [row.key for row in rows if row.is_active]
+        replica_router.remember_write(*(identifier for row in rows for identifier in (row.key, row.secret_key)))
+    await db.commit()
+    return ids[-1], len(moving), active_keys
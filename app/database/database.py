@@ -4,13 +4,31 @@
 # This module handles all SQLAlchemy configuration, database engine initialization,
 # and session factory setup. It provides the get_db() dependency injection function
 # used by FastAPI endpoints to obtain database sessions.
+# Two engines are configured against the same database:
+#   - async_engine / AsyncSessionLocal: used by the API so that Postgres round trips
+#     never block the event loop (asyncpg driver).
+#   - engine / SessionLocal: synchronous mode kept for scripts and management tooling.
+# Read-only lookups can be routed to read replicas (READ_REPLICA_URLS) through
+# RoutingSession; see replicas.py.
+# Links can be spread over several databases (SHARD_DATABASE_URLS) with
+# DATABASE_URL as shard 0; see shards.py.
+# The async engine reports statement timings, pool checkout waits and pool usage
+# to app.core.metrics.
 # The Base declarative class is the foundation for all ORM models in the application.
 # -------------------------------------------------------
 
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
-from app.core.config import get_settings
+from app.core.config import get_settings, to_async_url
+from app.core.metrics import DB_POOL_CHECKOUT_WAIT, DB_QUERY_LATENCY, Gauge
+from .local_cache import INVALIDATION_CHANNEL, invalidation_listener
+from .replicas import Replica, ReplicaMonitor, ReplicaRouter, RoutingSession
+from .shards import Shard, ShardMapMonitor, ShardRouter
 
 settings = get_settings()  # Load application settings from environment configuration
 
@@ -23,18 +41,95 @@ engine = create_engine(settings.sqlalchemy_database_url, echo=settings.debug)
 # autocommit=False requires explicit commits for data persistence.
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    # Records how long each checkout waited for a connection (including connecting,
+    # when the pool has to open a new one). Pool events only fire after checkout.
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+# Pool options shared by every async engine. A checkout that waits longer than
+# DB_POOL_TIMEOUT raises sqlalchemy.exc.TimeoutError, which admission control
+# turns into a 503 instead of letting requests pile up behind the pool.
+POOL_OPTIONS = {
+    "poolclass": TimedAsyncQueuePool,
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout,
+}
+
+# Async engine used by the request handlers.
+async_engine = create_async_engine(settings.async_database_url, echo=settings.debug, **POOL_OPTIONS)
+
+# Statement timings. The start time is kept on the execution context, which lives
+# for exactly one statement.
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERY_LATENCY.observe(time.perf_counter() - context._query_started)
+
+# Pool usage, read at scrape time.
+Gauge("db_pool_size", "Connections kept open by the database pool.", async_engine.pool.size)
+Gauge("db_pool_checked_out", "Database connections currently in use.", async_engine.pool.checkedout)
+Gauge("db_pool_overflow", "Connections opened beyond the pool size (negative while below it).", async_engine.pool.overflow)
+
+# Read replicas, each with its own engine and pool. Statement timings are recorded for them too.
+replica_router = ReplicaRouter(
+    [
+        Replica(f"replica-{index}", create_async_engine(to_async_url(url), echo=settings.debug, **POOL_OPTIONS))
+        for index, url in enumerate(settings.read_replica_url_list)
+    ],
+    max_lag=settings.replica_max_lag,
+    sticky_seconds=settings.replica_sticky_seconds,
+    confirm_lag=settings.replica_confirm_lag,
+)
+replica_monitor = ReplicaMonitor(replica_router, settings.replica_check_interval)
+if replica_router.replicas:
+    # A link deactivated on any worker is read from the primary here too until replicas
+    # have caught up, so a stale replica row cannot put it back into the cache.
+    invalidation_listener.add_handler(INVALIDATION_CHANNEL, replica_router.remember_write)
+for replica in replica_router.replicas:
+    event.listen(replica.engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(replica.engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+# Async session factory. expire_on_commit=False keeps attributes loaded after a commit,
+# since lazy loading (implicit IO) is not possible on an AsyncSession.
+# RoutingSession sends statements marked for a replica there; all others use async_engine.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False, sync_session_class=RoutingSession)
+
+# Shards 1..N, each with its own engine and pool; shard 0 is the primary above.
+# They have no read replicas.
+shard_engines = [
+    create_async_engine(to_async_url(url), echo=settings.debug, **POOL_OPTIONS)
+    for url in settings.shard_database_url_list
+]
+for shard_engine in shard_engines:
+    event.listen(shard_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(shard_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+shard_router = ShardRouter(
+    [Shard(0, "shard-0", AsyncSessionLocal)]
+    + [
+        Shard(index, f"shard-{index}", async_sessionmaker(bind=shard_engine, autoflush=False, expire_on_commit=False))
+        for index, shard_engine in enumerate(shard_engines, start=1)
+    ]
+)
+shard_map_monitor = ShardMapMonitor(shard_router, settings.shard_map_refresh_interval)
+
 # Declarative base class for all ORM models in the application.
 # All SQLAlchemy model classes must inherit from this Base class.
 class Base(DeclarativeBase):
     pass
 
-def get_db():
-    # Create a new database session for the request.
-    db = SessionLocal()
-    try:
+async def get_db():
+    # Create a new async database session for the request.
+    async with AsyncSessionLocal() as db:
         # Yield the session to the requesting endpoint for use within the request context.
-        yield db
-    finally:
-        # Ensure the session is closed after the request completes,
+        # The context manager closes the session after the request completes,
         # releasing database connections and cleaning up resources.
-        db.close()
\ No newline at end of file
+        yield db
@@ -0,0 +1,98 @@
+# -------------------------------------------------------
+# Expired Link Sweeper
+# -------------------------------------------------------
+# This module deactivates links that have passed their expires_at or used up
+# their max_clicks, and evicts them from the caches.
+# Redirects already enforce both limits on their own (the lookup query checks
+# them, cached copies never outlive expires_at, click-limited links are not
+# cached), so the sweeper only turns such links into ordinary inactive rows.
+#   - Every EXPIRY_SWEEP_INTERVAL seconds, rows are deactivated in batches of
+#     EXPIRY_SWEEP_BATCH_SIZE, each batch in its own short transaction, through
+#     the partial indexes over active links with a limit.
+#   - Rows are claimed with FOR UPDATE SKIP LOCKED, so every worker can run the
+#     sweeper: concurrent sweeps split the work instead of waiting on each other.
+#   - A run stops after EXPIRY_SWEEP_MAX_BATCHES batches; the rest is left for
+#     the next run, so a backlog never turns into one long burst of writes.
+# Deactivated keys are published on the cache invalidation channel, deleted
+# from Redis and, with EDGE_PURGE_URL, purged from the CDN, like deleted links.
+# -------------------------------------------------------
+
+import asyncio
+
+import redis.asyncio as redis
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.edge_purge import edge_purger
+from app.core.metrics import Counter
+from . import crud
+from .caching import redis_client, safe_redis_delete
+from .database import shard_router
+from .local_cache import publish_invalidation
+
+settings = get_settings()
+
+LINKS_EXPIRED = Counter("links_expired_total", "Links deactivated by the expiry sweeper.")
+
+
+class ExpirySweeper:
+    def __init__(self, redis_client: redis.Redis, interval: float, batch_size: int, max_batches: int):
+        self.redis = redis_client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.deactivated = 0
+        self._task: asyncio.Task | None = None
+
+    async def sweep(self, db=None) -> int:
+        # One run: deactivate and evict expired links batch by batch. Returns how many.
+        # `db` is a session to use instead of opening one per batch (tests).
+        total = 0
+        # Every shard is swept in turn, each with up to max_batches batches.
+        for shard in shard_router.shards:
+            for _ in range(self.max_batches):
+                async with shard_router.session(db, shard) as session:
+                    rows = await crud.deactivate_expired_db_urls(session, self.batch_size)
+                for key, _ in rows:
+                    await publish_invalidation(self.redis, key)
+                    await safe_redis_delete(self.redis, key)
+                # A CDN would otherwise keep redirecting until the link's s-maxage ends.
+                edge_purger.purge(*(key for key, _ in rows))
+                total += len(rows)
+                # Each condition returns up to batch_size rows; fewer means nothing is left.
+                if len(rows) < self.batch_size:
+                    break
+        if total:
+            LINKS_EXPIRED.inc(total)
+            self.deactivated += total
+            logging.logger.info("Expiry sweep deactivated %d links", total)
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logging.logger.exception("Expiry sweep failed; retrying in %ss", self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+expiry_sweeper = ExpirySweeper(
+    redis_client,
+    interval=settings.expiry_sweep_interval,
+    batch_size=settings.expiry_sweep_batch_size,
+    max_batches=settings.expiry_sweep_max_batches,
+)
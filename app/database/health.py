@@ -0,0 +1,179 @@
+# -------------------------------------------------------
+# Health Checks
+# -------------------------------------------------------
+# This module checks the worker's dependencies in the background so that probes
+# (/livez, /readyz, /health) answer from the latest results instead of querying
+# Postgres and Redis on every request.
+#   - Every HEALTH_CHECK_INTERVAL seconds: SELECT 1 on the primary and on every
+#     shard, with its latency and the usage of the engine's pool (size, checked
+#     out, overflow), and a Redis PING with its latency.
+#   - Event loop lag: the checker wakes up every LAG_SAMPLE_INTERVAL seconds and
+#     records how late it is. A worker busy with CPU work or a blocking call shows
+#     it here before anywhere else.
+# Ready: every database answered the last check, the cache warm-up has finished
+# and the loop lag is below HEALTH_MAX_LOOP_LAG. Redis is reported but not
+# required: without it redirects fall back to the database.
+# Alive: the checker is still completing its rounds. Liveness does not depend on
+# Postgres or Redis, so an outage does not get every worker restarted.
+# Results older than a few intervals (or missing, when the checker is not
+# running) are refreshed by the probe that finds them, once for all waiting probes.
+# -------------------------------------------------------
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Gauge
+from .caching import redis_breaker, redis_probe
+from .database import async_engine, shard_engines
+from .warmup import cache_warmer
+
+settings = get_settings()
+
+# Longest a single dependency check may take before it counts as failed.
+CHECK_TIMEOUT = 2.0
+# Seconds between event loop lag samples.
+LAG_SAMPLE_INTERVAL = 0.25
+# Results older than this many intervals are refreshed on demand.
+STALE_AFTER_INTERVALS = 3
+# The worker is reported dead when the checker has not finished a round for this many intervals.
+DEAD_AFTER_INTERVALS = 10
+
+
+def _pool_usage(engine) -> dict:
+    pool = engine.pool
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+
+async def _timed(check) -> dict:
+    # Run check() with CHECK_TIMEOUT; {"ok", "latency_ms"} and the error if it failed.
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout=CHECK_TIMEOUT)
+        result = {"ok": True}
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": f"timed out after {CHECK_TIMEOUT}s"}
+    except Exception as exc:
+        result = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+class HealthChecker:
+    def __init__(self, databases: dict, interval: float, max_loop_lag: float):
+        # name -> async engine; the first one is the primary.
+        self.databases = databases
+        self.interval = interval
+        self.max_loop_lag = max_loop_lag
+        self.report: dict | None = None
+        self.checked_at = 0.0
+        # Largest event loop lag (seconds) seen since the previous check.
+        self.loop_lag = 0.0
+        self._max_lag = 0.0
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def _check_database(self, engine) -> dict:
+        async def select_one():
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        return {**await _timed(select_one), "pool": _pool_usage(engine)}
+
+    async def check(self) -> dict:
+        results = await asyncio.gather(
+            *(self._check_database(engine) for engine in self.databases.values()),
+            _timed(redis_probe.client.ping),
+        )
+        databases = dict(zip(self.databases, results))
+        redis = {**results[-1], "breaker": redis_breaker.state}
+        # Log when a dependency fails or recovers, not on every round it stays down.
+        previous = {**self.report["databases"], "Redis": self.report["redis"]} if self.report else {}
+        for name, result in {**databases, "Redis": redis}.items():
+            was_ok = previous.get(name, {"ok": True})["ok"]
+            if was_ok and not result["ok"]:
+                logging.logger.warning("Health check of %s failed: %s", name, result["error"])
+            elif result["ok"] and not was_ok:
+                logging.logger.info("Health check of %s succeeded again", name)
+        self.report = {
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+            "databases": databases,
+            "redis": redis,
+            "event_loop_lag_ms": round(self.loop_lag * 1000, 2),
+        }
+        self.checked_at = time.monotonic()
+        return self.report
+
+    async def latest(self) -> dict:
+        # The latest results, checked again first if they are missing or stale.
+        if self.report is None or time.monotonic() - self.checked_at > self.interval * STALE_AFTER_INTERVALS:
+            checked_at = self.checked_at
+            async with self._lock:
+                # Another probe may have refreshed them while this one waited.
+                if self.checked_at == checked_at:
+                    await self.check()
+        return self.report
+
+    def alive(self) -> bool:
+        if self._task is None:
+            return True
+        if self._task.done():
+            return False
+        return time.monotonic() - self.checked_at < self.interval * DEAD_AFTER_INTERVALS + CHECK_TIMEOUT
+
+    async def readiness(self) -> tuple[bool, dict]:
+        report = await self.latest()
+        reasons = [f"database {name} unavailable" for name, result in report["databases"].items() if not result["ok"]]
+        if not cache_warmer.finished:
+            reasons.append("cache warm-up running")
+        if self.loop_lag > self.max_loop_lag:
+            reasons.append(f"event loop lag {self.loop_lag * 1000:.0f}ms")
+        body = {
+            "status": "not_ready" if reasons else ("degraded" if not report["redis"]["ok"] else "ready"),
+            "reasons": reasons,
+            **report,
+            "age_seconds": round(time.monotonic() - self.checked_at, 2),
+            "warmup": cache_warmer.stats(),
+        }
+        return not reasons, body
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_check = loop.time()
+        while True:
+            if loop.time() >= next_check:
+                self.loop_lag, self._max_lag = self._max_lag, 0.0
+                try:
+                    await self.check()
+                except Exception:
+                    logging.logger.exception("Unexpected error in health checks")
+                next_check = loop.time() + self.interval
+            started = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self._max_lag = max(self._max_lag, loop.time() - started - LAG_SAMPLE_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+health_checker = HealthChecker(
+    {"primary": async_engine, **{f"shard-{index}": engine for index, engine in enumerate(shard_engines, start=1)}},
+    interval=settings.health_check_interval,
+    max_loop_lag=settings.health_max_loop_lag,
+)
+
+Gauge("event_loop_lag_seconds", "Largest event loop lag seen between the last two health checks.", lambda: health_checker.loop_lag)
@@ -0,0 +1,157 @@
+# -------------------------------------------------------
+# Issued-Key Filter and Negative Cache
+# -------------------------------------------------------
+# This module lets redirects reject short keys that were never issued without
+# touching Redis or Postgres, which keeps random-key scans off the database.
+#   - A Bloom filter holds every active key. It is rebuilt from the urls table
+#     each time the worker (re)subscribes to pub/sub, and updated whenever a key
+#     is issued: locally by crud.create_db_url and on other workers through the
+#     KEY_ISSUED_CHANNEL message.
+#   - Keys that pass the filter but are not in the database (false positives,
+#     deactivated links) are remembered in a short-TTL negative cache.
+# The filter only rejects keys while it is built and the worker is subscribed,
+# since a missed "key issued" message would otherwise turn into a false 404.
+# -------------------------------------------------------
+
+import asyncio
+
+import redis.asyncio as redis
+from sqlalchemy import func, select
+
+from app import models
+from app.core import logging
+from app.core.bloom import BloomFilter
+from app.core.config import get_settings
+from .caching import redis_client, redis_wait
+from .database import replica_router, shard_router
+from .local_cache import LocalCache, invalidation_listener
+
+settings = get_settings()
+
+# Redis pub/sub channel announcing newly issued keys to every worker.
+KEY_ISSUED_CHANNEL = "keys:issued"
+
+# Rows fetched per round trip while rebuilding the filter.
+REBUILD_BATCH_SIZE = 10_000
+
+
+class KeyFilter:
+    def __init__(self, capacity: int, error_rate: float, negative_ttl: float, negative_max_entries: int, redis_client: redis.Redis):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.redis = redis_client
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.ready = False
+        self.negative_cache = LocalCache(max_entries=negative_max_entries, max_bytes=negative_max_entries * 128, ttl=negative_ttl)
+        # Keys issued while a rebuild is streaming the table; merged into the new filter.
+        self._added_during_rebuild: set[str] | None = None
+        self._rebuild_task: asyncio.Task | None = None
+        self.rejected = 0
+        self.negative_hits = 0
+        self.false_positives = 0
+
+    @property
+    def active(self) -> bool:
+        return self.ready and invalidation_listener.subscribed
+
+    def might_exist(self, key: str) -> bool:
+        # False means the key definitely does not exist (or was recently confirmed missing).
+        if self.negative_cache.get(key) is not None:
+            self.negative_hits += 1
+            return False
+        if self.active and key not in self.bloom:
+            self.rejected += 1
+            return False
+        return True
+
+    def remember_missing(self, key: str):
+        # Called after a database miss for a key that passed the filter.
+        if self.active:
+            self.false_positives += 1
+        self.negative_cache.set(key, "1")
+
+    def add(self, key: str):
+        self.bloom.add(key)
+        self.negative_cache.invalidate(key)
+        if self._added_during_rebuild is not None:
+            self._added_during_rebuild.add(key)
+
+    def _on_issued(self, payload: str):
+        # Pub/sub handler; a message carries one or more comma-separated keys.
+        for key in payload.split(","):
+            self.add(key)
+
+    async def add_issued(self, *keys: str):
+        # Add newly created keys here and announce them to the other workers in one message.
+        if not keys:
+            return
+        for key in keys:
+            self.add(key)
+        try:
+            await redis_wait(self.redis.publish(KEY_ISSUED_CHANNEL, ",".join(keys)), timeout=0.25)
+        except Exception:
+            logging.logger.error("Failed to publish %d issued key(s); other workers may reject them until their next rebuild", len(keys))
+
+    async def rebuild(self):
+        # Stream every active key from the urls table of every shard into a fresh filter, then swap it in.
+        self._added_during_rebuild = set()
+        try:
+            total = 0
+            for shard in shard_router.shards:
+                async with shard.session_factory() as db:
+                    total += (await db.execute(select(func.count()).select_from(models.URL).where(models.URL.is_active))).scalar_one()
+            # Leave room for growth so the error rate holds until the next rebuild.
+            bloom = BloomFilter(max(self.capacity, total * 2), self.error_rate)
+            stmt = select(models.URL.key).where(models.URL.is_active).execution_options(yield_per=REBUILD_BATCH_SIZE)
+            for shard in shard_router.shards:
+                async with shard.session_factory() as db:
+                    async for key in await db.stream_scalars(stmt):
+                        bloom.add(key)
+            for key in self._added_during_rebuild:
+                bloom.add(key)
+            self.bloom = bloom
+            self.ready = True
+            logging.logger.info("Rebuilt key filter with %d keys (%d bytes)", bloom.count, bloom.memory_bytes)
+        except Exception:
+            logging.logger.exception("Failed to rebuild key filter; unknown keys will not be rejected")
+        finally:
+            self._added_during_rebuild = None
+
+    def schedule_rebuild(self):
+        # Run on every pub/sub (re)subscription, after which no issued key can be missed.
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.get_running_loop().create_task(self.rebuild())
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "keys": self.bloom.count,
+            "capacity": self.bloom.capacity,
+            "memory_bytes": self.bloom.memory_bytes,
+            "hash_functions": self.bloom.num_hashes,
+            "estimated_false_positive_rate": round(self.bloom.estimated_false_positive_rate, 6),
+            "observed_false_positives": self.false_positives,
+            "negative_cache_entries": self.negative_cache.stats()["entries"],
+            "db_queries_avoided": self.rejected + self.negative_hits,
+            "rejected_by_filter": self.rejected,
+            "rejected_by_negative_cache": self.negative_hits,
+        }
+
+
+def _read_issued_from_primary(payload: str):
+    # Keys issued on any worker are read from the primary here until replicas have them,
+    # since redirects do not re-check a replica's miss on the primary.
+    if replica_router.replicas:
+        replica_router.remember_write(*payload.split(","))
+
+
+key_filter = KeyFilter(
+    capacity=settings.key_filter_capacity,
+    error_rate=settings.key_filter_error_rate,
+    negative_ttl=settings.negative_cache_ttl,
+    negative_max_entries=settings.negative_cache_max_entries,
+    redis_client=redis_client,
+)
+
+invalidation_listener.add_handler(KEY_ISSUED_CHANNEL, key_filter._on_issued, on_subscribe=key_filter.schedule_rebuild)
+invalidation_listener.add_handler(KEY_ISSUED_CHANNEL, _read_issued_from_primary)
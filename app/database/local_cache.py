@@ -0,0 +1,178 @@
+# -------------------------------------------------------
+# In-Process (L1) Cache
+# -------------------------------------------------------
+# This module provides a small LRU/TTL cache from short key to target URL that
+# lives inside each worker process and is checked before Redis on redirects.
+# The cache is bounded both by number of entries and by an estimate of the
+# memory used by keys and values, and keeps hit/miss counters for monitoring.
+#
+# Entries are invalidated across workers through Redis pub/sub: when a link is
+# deactivated, the key is published on INVALIDATION_CHANNEL and every worker's
+# InvalidationListener evicts it. Messages missed while a listener is
+# disconnected are covered by the entry TTL (LOCAL_CACHE_TTL) and by clearing
+# the cache whenever the listener (re)subscribes, so a deleted link stops
+# redirecting on every worker within LOCAL_CACHE_TTL seconds at worst.
+# -------------------------------------------------------
+
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Gauge
+from .caching import redis_client, redis_wait
+
+settings = get_settings()
+
+# Redis pub/sub channel carrying keys that must be evicted from every worker's cache.
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class LocalCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, expires_at, size); ordered from least to most recently used.
+        self._entries: OrderedDict[str, tuple[str, float, int]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set(self, key: str, value: str, ttl: float | None = None):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        # Evict least recently used entries until both limits are respected.
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class InvalidationListener:
+    def __init__(self, cache: LocalCache, redis_client: redis.Redis):
+        self.cache = cache
+        self.redis = redis_client
+        self.subscribed = False
+        # channel -> callbacks receiving the message payload. Other per-worker state
+        # kept in sync over pub/sub registers its channel through add_handler().
+        self._handlers = {INVALIDATION_CHANNEL: [cache.invalidate]}
+        # Callbacks run after every (re)subscription, since messages may have been missed.
+        self._on_subscribe = [cache.clear]
+        self._task: asyncio.Task | None = None
+
+    def add_handler(self, channel: str, handler, on_subscribe=None):
+        self._handlers.setdefault(channel, []).append(handler)
+        if on_subscribe is not None:
+            self._on_subscribe.append(on_subscribe)
+
+    async def _run(self):
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(*self._handlers)
+                    # Messages may have been missed while we were not subscribed.
+                    for callback in self._on_subscribe:
+                        callback()
+                    self.subscribed = True
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            for handler in self._handlers.get(message["channel"], ()):
+                                handler(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.logger.warning("Cache invalidation subscriber disconnected; retrying", exc_info=True)
+            finally:
+                self.subscribed = False
+            await asyncio.sleep(1.0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def publish_invalidation(client: redis.Redis, key: str):
+    # Evict the key locally right away and ask every other worker to do the same.
+    local_cache.invalidate(key)
+    try:
+        await redis_wait(client.publish(INVALIDATION_CHANNEL, key), timeout=0.25)
+    except Exception:
+        logging.logger.error("Failed to publish cache invalidation for key=%s; other workers will drop it within %ss", key, local_cache.ttl)
+
+
+local_cache = LocalCache(
+    max_entries=settings.local_cache_max_entries,
+    max_bytes=settings.local_cache_max_bytes,
+    ttl=settings.local_cache_ttl,
+)
+
+Gauge("local_cache_entries", "Entries held in this worker's L1 cache.", lambda: len(local_cache._entries))
+Gauge("local_cache_bytes", "Estimated memory used by this worker's L1 cache.", lambda: local_cache._bytes)
+
+invalidation_listener = InvalidationListener(local_cache, redis_client)
@@ -0,0 +1,96 @@
+# -------------------------------------------------------
+# Link Creation Rate Limit
+# -------------------------------------------------------
+# This module limits how fast each client may create links, with one token
+# bucket per client address kept in Redis, so the limit holds across workers.
+#   - A bucket holds up to CREATE_RATE_BURST tokens and refills at CREATE_RATE_LIMIT
+#     tokens per second. POST /url costs one token, POST /urls/batch one per URL.
+#   - Refill, check and take run in a single Lua script, atomically, with the
+#     Redis server's clock, so concurrent requests from several workers cannot
+#     overdraw a bucket and worker clocks do not matter. The script is sent once
+#     and then called by its SHA1 (EVALSHA).
+#   - Buckets expire once they would be full again, so idle clients cost nothing.
+#   - Behind a reverse proxy, the client address comes from X-Forwarded-For only when
+#     TRUSTED_PROXIES lists the proxy; otherwise all clients share the proxy's bucket.
+# The limit fails open: while Redis is unavailable (or its breaker is open),
+# links are created without it, like every other Redis-backed feature here.
+# -------------------------------------------------------
+
+import asyncio
+import hashlib
+
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Counter
+from .caching import redis_breaker, redis_wait
+
+settings = get_settings()
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests rejected by a rate limit.", ("limit",))
+
+# KEYS[1]: bucket. ARGV: rate (tokens/s), burst, cost.
+# Returns {1, 0} if the tokens were taken, else {0, seconds until they would be available}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+-- Lua numbers are truncated to integers in replies; send the wait as a string.
+return {allowed, tostring(wait)}
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode()).hexdigest()
+
+
+class TokenBucketLimit:
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._rejected = RATE_LIMITED.labels(name)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def acquire(self, client: redis.Redis, identity: str, cost: int = 1) -> float | None:
+        # None if `identity` may go ahead, else the seconds after which it may retry.
+        if not self.enabled or not redis_breaker.allow():
+            return None
+        args = (1, f"ratelimit:{self.name}:{identity}", self.rate, self.burst, cost)
+        try:
+            try:
+                allowed, wait = await redis_wait(client.evalsha(TOKEN_BUCKET_SHA, *args), timeout=0.25)
+            except NoScriptError:
+                # First call since Redis started: EVAL also caches the script for EVALSHA.
+                allowed, wait = await redis_wait(client.eval(TOKEN_BUCKET_SCRIPT, *args), timeout=0.25)
+        except asyncio.TimeoutError:
+            logging.logger.warning("Timed out checking the %s rate limit", self.name)
+            return None
+        except Exception:
+            logging.logger.exception("Error checking the %s rate limit", self.name)
+            return None
+        if int(allowed):
+            return None
+        self._rejected.inc()
+        return float(wait)
+
+
+create_rate_limit = TokenBucketLimit("create", settings.create_rate_limit, settings.create_rate_burst)
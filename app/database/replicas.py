@@ -0,0 +1,164 @@
+# -------------------------------------------------------
+# Read-Replica Routing
+# -------------------------------------------------------
+# This module sends read-only lookups to read replicas (READ_REPLICA_URLS) so
+# they do not compete with writes on the primary.
+#   - Routing is per statement: crud marks a read-only SELECT with the
+#     `replica` execution option (via ReplicaRouter.pick) and RoutingSession
+#     binds it to that replica. Everything else, including every write and any
+#     read inside a write path, uses the primary.
+#   - ReplicaMonitor checks every replica in the background (connectivity and,
+#     on PostgreSQL, replay lag). Replicas that fail, or lag more than
+#     REPLICA_MAX_LAG seconds, receive no reads until a later check passes.
+#     A query that fails on a replica marks it down and is retried on the primary.
+#   - Read-your-writes: keys and secret keys written by this worker, and keys
+#     announced as issued or deactivated by any worker, are read from the primary
+#     for REPLICA_STICKY_SECONDS, so a link created moments ago on another worker
+#     is not reported missing. Other misses on a replica are final for redirects;
+#     only lookups that ask for it (by secret key) re-check the primary, and
+#     misses on a replica lagging more than REPLICA_CONFIRM_LAG seconds always do.
+# Without replicas configured, pick() returns None and every query uses the primary.
+# -------------------------------------------------------
+
+import asyncio
+import itertools
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+from app.core import logging
+from .local_cache import LocalCache
+
+# Replay lag of a PostgreSQL standby in seconds; 0 when it has replayed all WAL it received.
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+# Timeout of a single replica check.
+CHECK_TIMEOUT = 2.0
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        # Unchecked replicas are trusted until the first check says otherwise.
+        self.healthy = True
+        self.lag = 0.0
+        self.last_error: str | None = None
+        self.queries = 0
+        self.failures = 0
+
+
+class ReplicaRouter:
+    def __init__(self, replicas: list[Replica], max_lag: float, sticky_seconds: float, confirm_lag: float = 1.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.confirm_lag = confirm_lag
+        self._round_robin = itertools.cycle(replicas) if replicas else None
+        # Identifiers (keys, secret keys) recently written and therefore read from the primary.
+        self._recent_writes = LocalCache(max_entries=100_000, max_bytes=100_000 * 128, ttl=sticky_seconds)
+        self.primary_fallbacks = 0
+
+    def remember_write(self, *identifiers: str):
+        for identifier in identifiers:
+            self._recent_writes.set(identifier, "1")
+
+    def pick(self, *identifiers: str) -> Replica | None:
+        # Replica for a read involving these identifiers, or None to read from the primary.
+        if self._round_robin is None:
+            return None
+        if any(self._recent_writes.get(identifier) is not None for identifier in identifiers):
+            return None
+        for _ in range(len(self.replicas)):
+            replica = next(self._round_robin)
+            if replica.healthy:
+                replica.queries += 1
+                return replica
+        return None
+
+    def behind(self, replica: Replica) -> bool:
+        # Whether the replica lagged enough at its last check for a miss there to be doubtful.
+        return replica.lag > self.confirm_lag
+
+    def mark_down(self, replica: Replica, error: Exception):
+        replica.healthy = False
+        replica.failures += 1
+        replica.last_error = str(error)
+        self.primary_fallbacks += 1
+        logging.logger.warning("Read replica %s failed; using the primary until it recovers: %s", replica.name, error)
+
+    async def check(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as connection:
+                if connection.dialect.name == "postgresql":
+                    lag = float(await asyncio.wait_for(connection.scalar(POSTGRES_LAG_QUERY), timeout=CHECK_TIMEOUT) or 0)
+                else:
+                    await asyncio.wait_for(connection.execute(text("SELECT 1")), timeout=CHECK_TIMEOUT)
+                    lag = 0.0
+        except Exception as e:
+            if replica.healthy:
+                self.mark_down(replica, e)
+            return
+        replica.lag = lag
+        healthy = lag <= self.max_lag
+        if healthy != replica.healthy:
+            logging.logger.warning("Read replica %s is %s (lag %.1fs)", replica.name, "back" if healthy else "lagging", lag)
+        replica.healthy = healthy
+        replica.last_error = None if healthy else f"lag {lag:.1f}s exceeds {self.max_lag}s"
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    def stats(self) -> dict:
+        return {
+            "primary_fallbacks": self.primary_fallbacks,
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag_seconds": round(replica.lag, 3),
+                    "queries": replica.queries,
+                    "failures": replica.failures,
+                    "last_error": replica.last_error,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+class ReplicaMonitor:
+    def __init__(self, router: ReplicaRouter, interval: float):
+        self.router = router
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            await self.router.check_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.router.replicas:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class RoutingSession(Session):
+    # Binds statements carrying the `replica` execution option to that replica's
+    # engine; everything else goes to the session's normal bind (the primary).
+    def get_bind(self, mapper=None, clause=None, **kw):
+        options = clause.get_execution_options() if hasattr(clause, "get_execution_options") else {}
+        if (replica := options.get("replica")) is not None:
+            return replica.engine.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
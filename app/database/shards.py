@@ -0,0 +1,175 @@
+# -------------------------------------------------------
+# Key Sharding
+# -------------------------------------------------------
+# This module spreads the urls and urls_archive tables over several databases:
+# DATABASE_URL is shard 0 and every URL in SHARD_DATABASE_URLS adds one more.
+#   - Every short key belongs to one of NUM_BUCKETS buckets, a hash of the key
+#     (bucket_of), stored with the row in shard_bucket. A secret key starts with
+#     the key of its link ("<key>_<8 characters>"), so it leads to the same bucket:
+#     admin lookups go to one shard like redirects do, never to all of them.
+#   - The shard map (the shard_map table on shard 0) assigns buckets to shards;
+#     buckets without a row live on shard 0, so an empty map is the unsharded
+#     layout. Workers reload it every SHARD_MAP_REFRESH_INTERVAL seconds.
+#   - Buckets are moved by `python manage.py rebalance`. While a bucket is being
+#     moved its row names the destination in moving_to: new links of the bucket are
+#     created there, and lookups and click updates try the source first and the
+#     destination second, so a link is found wherever the copy has got to.
+# crud runs each statement in a session of the shard that holds the row
+# (ShardRouter.session). Shard 0 uses the caller's session, with read replicas and
+# the key sequence; the other shards get a session of their own, so rows of two
+# shards never meet in one identity map. Without SHARD_DATABASE_URLS every key
+# maps to shard 0 and nothing changes.
+# -------------------------------------------------------
+
+import asyncio
+import zlib
+from contextlib import nullcontext
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import logging
+from app.core.key_codec import SECRET_SUFFIX_LENGTH
+
+# Number of buckets keys are hashed into; the unit the shard map assigns and moves.
+NUM_BUCKETS = 4096
+
+SHARD_MAP_QUERY = text("SELECT bucket, shard, moving_to FROM shard_map")
+
+
+def bucket_of(url_key: str) -> int:
+    # Stable across processes and versions (unlike hash()); stored as urls.shard_bucket.
+    return zlib.crc32(url_key.encode()) % NUM_BUCKETS
+
+
+def key_of_secret(secret_key: str) -> str | None:
+    # The link key a secret key starts with, or None if it does not have that form.
+    key, separator, suffix = secret_key.rpartition("_")
+    if not key or not separator or len(suffix) != SECRET_SUFFIX_LENGTH:
+        return None
+    return key
+
+
+class Shard:
+    def __init__(self, index: int, name: str, session_factory):
+        self.index = index
+        self.name = name
+        # async_sessionmaker bound to this shard's database.
+        self.session_factory = session_factory
+        self.sessions_opened = 0
+
+
+class ShardRouter:
+    def __init__(self, shards: list[Shard]):
+        self.shards = shards
+        self.default = shards[0]
+        # bucket -> (shard index, index of the shard it is moving to or None), for
+        # buckets that have a row in the shard map.
+        self._placement: dict[int, tuple[int, int | None]] = {}
+        self.map_version = 0
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.shards) > 1
+
+    def placement(self, bucket: int) -> tuple[int, int | None]:
+        return self._placement.get(bucket, (0, None))
+
+    def shards_for_key(self, url_key: str) -> list[Shard]:
+        # Shards that may hold the key, in the order to try them.
+        shard, moving_to = self.placement(bucket_of(url_key))
+        if moving_to is None:
+            return [self.shards[shard]]
+        return [self.shards[shard], self.shards[moving_to]]
+
+    def shard_for_new_key(self, url_key: str) -> Shard:
+        # New links of a bucket that is being moved go straight to its destination.
+        shard, moving_to = self.placement(bucket_of(url_key))
+        return self.shards[shard if moving_to is None else moving_to]
+
+    def shards_for_secret_key(self, secret_key: str) -> list[Shard]:
+        # Secret keys created by this app name their link's key; others (imported from
+        # elsewhere) could be on any shard.
+        if (url_key := key_of_secret(secret_key)) is None:
+            return self.shards
+        return self.shards_for_key(url_key)
+
+    def group_keys(self, url_keys) -> dict[Shard, list[str]]:
+        # Keys per shard that may hold them; a key being moved is listed under both shards.
+        grouped: dict[Shard, list[str]] = {}
+        for url_key in url_keys:
+            for shard in self.shards_for_key(url_key):
+                grouped.setdefault(shard, []).append(url_key)
+        return grouped
+
+    def session(self, db: AsyncSession | None, shard: Shard):
+        # Async context manager yielding a session on the shard: the caller's own session
+        # for shard 0, a new one (closed on exit) otherwise or when db is None.
+        if db is not None and shard is self.default:
+            return nullcontext(db)
+        shard.sessions_opened += 1
+        return shard.session_factory()
+
+    def load(self, rows):
+        # Replace the placement with (bucket, shard, moving_to) rows from the shard map.
+        placement = {}
+        for bucket, shard, moving_to in rows:
+            if not 0 <= shard < len(self.shards) or (moving_to is not None and not 0 <= moving_to < len(self.shards)):
+                # Routing this bucket anywhere would be a guess; keep what this worker had.
+                logging.logger.error("Shard map assigns bucket %d to shard %s (moving to %s), which is not configured", bucket, shard, moving_to)
+                if bucket in self._placement:
+                    placement[bucket] = self._placement[bucket]
+                continue
+            if shard != 0 or moving_to is not None:
+                placement[bucket] = (shard, moving_to)
+        if placement != self._placement:
+            self._placement = placement
+            self.map_version += 1
+            logging.logger.info("Loaded shard map: %d buckets off shard 0, %d moving", len(placement), sum(m is not None for _, m in placement.values()))
+
+    async def reload(self, db: AsyncSession | None = None):
+        async with self.session(db, self.default) as session:
+            self.load((await session.execute(SHARD_MAP_QUERY)).all())
+
+    def stats(self) -> dict:
+        buckets = [0] * len(self.shards)
+        for shard, _ in self._placement.values():
+            buckets[shard] += 1
+        buckets[0] += NUM_BUCKETS - len(self._placement)
+        return {
+            "map_version": self.map_version,
+            "moving_buckets": sum(moving_to is not None for _, moving_to in self._placement.values()),
+            "shards": [
+                {"name": shard.name, "buckets": count, "sessions_opened": shard.sessions_opened}
+                for shard, count in zip(self.shards, buckets)
+            ],
+        }
+
+
+class ShardMapMonitor:
+    def __init__(self, router: ShardRouter, interval: float):
+        self.router = router
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.router.reload()
+            except Exception:
+                # Keep routing with the last map; a rebalance waits long enough for a retry.
+                logging.logger.exception("Could not reload the shard map; keeping the current one")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.router.enabled:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
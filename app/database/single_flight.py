@@ -0,0 +1,117 @@
+# -------------------------------------------------------
+# Single-Flight Loading
+# -------------------------------------------------------
+# This module coalesces concurrent cache misses for the same key, so a popular
+# link whose cache entry expired costs one database query instead of one per
+# waiting request.
+#   - Within a worker, the first request for a key becomes the leader and runs
+#     the loader; requests arriving meanwhile wait for its result.
+#   - Across workers (SINGLE_FLIGHT_REDIS_LOCK), the leader also takes a short
+#     Redis lock. A leader that finds the lock taken polls `peek` (the Redis
+#     cache entry the other worker is about to write) instead of loading.
+# Waiting is bounded by SINGLE_FLIGHT_WAIT_TIMEOUT. If the leader fails, is
+# cancelled or is too slow, or the lock holder never publishes a result, the
+# waiter runs the loader itself, so coalescing can delay a request but never
+# fail it.
+# -------------------------------------------------------
+
+import asyncio
+import secrets
+import time
+
+import redis.asyncio as redis
+
+from app.core import logging
+from app.core.config import get_settings
+from app.core.metrics import Counter
+from .caching import redis_breaker, redis_client, redis_wait
+
+settings = get_settings()
+
+# Prefix of the cross-worker loading locks.
+LOCK_PREFIX = "loading:"
+# Seconds between checks of `peek` while another worker holds the lock.
+LOCK_POLL_INTERVAL = 0.02
+
+SINGLE_FLIGHT = Counter("single_flight_total", "Coalesced cache miss loads by role (leader, follower, fallback, lock_wait).", ("role",))
+_LEADER = SINGLE_FLIGHT.labels("leader")
+_FOLLOWER = SINGLE_FLIGHT.labels("follower")
+_FALLBACK = SINGLE_FLIGHT.labels("fallback")
+_LOCK_WAIT = SINGLE_FLIGHT.labels("lock_wait")
+
+
+class SingleFlight:
+    def __init__(self, wait_timeout: float, redis_client: redis.Redis | None = None, lock_ttl: float = 2.0):
+        self.wait_timeout = wait_timeout
+        # Cross-worker locking is disabled without a client.
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def load(self, key: str, loader, peek=None):
+        # Return loader() for the key, sharing one call between concurrent requests.
+        future = self._inflight.get(key)
+        if future is not None:
+            # asyncio.wait never raises the leader's error; only our own cancellation propagates.
+            await asyncio.wait((future,), timeout=self.wait_timeout)
+            if future.done() and not future.cancelled():
+                _FOLLOWER.inc()
+                return future.result()
+            _FALLBACK.inc()
+            logging.logger.warning("Single-flight leader for key=%s failed or timed out; loading directly", key)
+            return await loader()
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        _LEADER.inc()
+        try:
+            result = await self._load_once(key, loader, peek)
+            future.set_result(result)
+            return result
+        except BaseException:
+            # Followers see a cancelled future and load for themselves.
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_once(self, key: str, loader, peek):
+        if self.redis is None or peek is None or not redis_breaker.allow():
+            return await loader()
+
+        lock = LOCK_PREFIX + key
+        token = secrets.token_hex(8)
+        try:
+            acquired = await redis_wait(self.redis.set(lock, token, nx=True, px=int(self.lock_ttl * 1000)), timeout=0.1)
+        except Exception:
+            acquired = True  # Redis trouble: just load, the lock is only an optimisation.
+            token = None
+        if not acquired:
+            # Another worker is loading this key; use the value it writes if it arrives in time.
+            _LOCK_WAIT.inc()
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                try:
+                    if (value := await redis_wait(peek(), timeout=0.1)) is not None:
+                        return value
+                except Exception:
+                    break
+            return await loader()
+
+        try:
+            return await loader()
+        finally:
+            if token is not None:
+                try:
+                    # Release only our own lock; it may have expired and been taken over.
+                    if await redis_wait(self.redis.get(lock), timeout=0.1) == token:
+                        await redis_wait(self.redis.delete(lock), timeout=0.1)
+                except Exception:
+                    pass  # It expires after lock_ttl anyway.
+
+
+url_loads = SingleFlight(
+    wait_timeout=settings.single_flight_wait_timeout,
+    redis_client=redis_client if settings.single_flight_redis_lock else None,
+    lock_ttl=settings.single_flight_lock_ttl,
+)
@@ -0,0 +1,246 @@
+# -------------------------------------------------------
+# Cache Warm-Up
+# -------------------------------------------------------
+# This module preloads the most-clicked active links into Redis (and into this
+# worker's L1 cache) so that traffic after a deploy or a Redis flush does not
+# all fall through to Postgres.
+#   - Rows are streamed with a server-side cursor in WARMUP_CHUNK_SIZE chunks,
+#     ordered by clicks, so the hottest links are cached first and memory use
+#     does not depend on WARMUP_LIMIT.
+#   - Each chunk is written to Redis with one pipelined call, using the TTL the
+#     cache policy gives the link's click count. Up to WARMUP_CONCURRENCY chunk
+#     writes are in flight while the next chunk is read.
+#   - Shard 0 is read from a replica when one is available. If it fails, it is
+#     taken out of rotation and the shard is read again from the primary.
+#   - The whole run stops after WARMUP_TIME_BUDGET seconds; whatever has been
+#     loaded by then stays cached.
+#   - Only one worker per WARMUP_TIME_BUDGET reads the database: the one that
+#     takes a Redis lease (warmup:lease). It fills Redis and leaves the keys of the
+#     hottest links in a list (warmup:hot); the other workers wait for that list
+#     and fill their L1 cache from Redis. So a rolling deploy of N workers costs
+#     one sorted scan of urls, not N. Without Redis there is nothing to share and
+#     the warm-up is skipped; L1 then fills from traffic.
+# The database sees a single query per run (one per shard). The app runs it in the background
+# at startup (WARMUP_ENABLED) and reports its status through /ready;
+# `python manage.py warm` runs it on demand, without the lease.
+# -------------------------------------------------------
+
+import asyncio
+import time
+import uuid
+
+import redis.asyncio as redis
+from datetime import datetime, timezone
+
+from sqlalchemy import or_, select
+from sqlalchemy.exc import DBAPIError
+
+from app import models
+from app.core import logging
+from app.core.config import get_settings
+from app.core.http_cache import redirect_policy
+from .caching import decode_entry, encode_entry, redis_breaker, redis_client, redis_wait, safe_redis_set_many, seconds_until
+from .database import replica_router, shard_router
+from .local_cache import LocalCache, local_cache
+
+settings = get_settings()
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+DISABLED = "disabled"
+
+# Redis keys shared by the workers' warm-ups.
+WARMUP_LEASE = "warmup:lease"
+HOT_KEYS = "warmup:hot"
+# Seconds the hot list is kept for workers that start later in a deploy.
+HOT_KEYS_TTL = 600
+# Seconds between checks for the hot list while another worker is warming up.
+HOT_KEYS_POLL_INTERVAL = 0.5
+
+
+class CacheWarmer:
+    def __init__(self, redis_client: redis.Redis, cache: LocalCache | None, chunk_size: int):
+        self.redis = redis_client
+        # In-process cache to fill as well; None for the standalone command.
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.state = PENDING
+        self.loaded = 0
+        self.duration = 0.0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state not in (PENDING, RUNNING)
+
+    async def run(self, limit: int, time_budget: float, concurrency: int) -> dict:
+        self.state = RUNNING
+        self.loaded = 0
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._warm(limit, concurrency, time_budget), timeout=time_budget)
+            self.state = DONE
+        except asyncio.TimeoutError:
+            self.state = TIMED_OUT
+            logging.logger.warning("Cache warm-up stopped after its %ss budget", time_budget)
+        except Exception:
+            self.state = FAILED
+            logging.logger.exception("Cache warm-up failed")
+        self.duration = time.perf_counter() - started
+        logging.logger.info("Cache warm-up %s: %d links in %.1fs", self.state, self.loaded, self.duration)
+        return self.stats()
+
+    async def _warm(self, limit: int, concurrency: int, time_budget: float):
+        if self.cache is None:
+            # The standalone command: the operator asked for a database run.
+            await self._load(limit, concurrency)
+            return
+        leader = await self._take_lease(time_budget)
+        if leader is None:
+            logging.logger.warning("Redis is unavailable; skipping the cache warm-up")
+        elif leader:
+            await self._load(limit, concurrency)
+        else:
+            await self._load_from_redis()
+
+    async def _take_lease(self, time_budget: float) -> bool | None:
+        # Whether this worker reads the database for everyone; None if Redis is unavailable.
+        # The lease is not released: it lasts one time budget, so workers starting during a
+        # deploy share one run.
+        if not redis_breaker.allow():
+            return None
+        try:
+            return bool(await redis_wait(self.redis.set(WARMUP_LEASE, uuid.uuid4().hex, nx=True, ex=max(1, int(time_budget))), timeout=1.0))
+        except Exception:
+            logging.logger.warning("Could not take the warm-up lease in Redis", exc_info=True)
+            return None
+
+    async def _load_from_redis(self):
+        # Fill L1 with the hottest links another worker has loaded into Redis.
+        while not (keys := await redis_wait(self.redis.lrange(HOT_KEYS, 0, self.cache.max_entries - 1), timeout=1.0)):
+            await asyncio.sleep(HOT_KEYS_POLL_INTERVAL)
+        for start in range(0, len(keys), self.chunk_size):
+            chunk = keys[start:start + self.chunk_size]
+            for key, value in zip(chunk, await redis_wait(self.redis.mget(chunk), timeout=1.0)):
+                if value is None:
+                    continue
+                _, expires_in, _ = decode_entry(value)
+                if expires_in is not None and expires_in <= 0:
+                    continue
+                self.cache.set(key, value, ttl=expires_in)
+                self.loaded += 1
+
+    async def _publish_hot_keys(self, keys: list[str]):
+        # Keys of the hottest links, hottest first, for the workers filling L1 from Redis.
+        if not keys:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(HOT_KEYS)
+            pipe.rpush(HOT_KEYS, *keys)
+            pipe.expire(HOT_KEYS, HOT_KEYS_TTL)
+            await redis_wait(pipe.execute(), timeout=2.0)
+        except Exception:
+            logging.logger.warning("Could not publish the warmed-up keys; other workers fill L1 from traffic", exc_info=True)
+
+    async def _load(self, limit: int, concurrency: int):
+        slots = asyncio.Semaphore(concurrency)
+        writes: set[asyncio.Task] = set()
+        # Hottest keys, as many as an L1 cache holds.
+        hot: list[str] = []
+        hot_max = self.cache.max_entries if self.cache is not None else local_cache.max_entries
+
+        async def write(chunk: dict[str, str], clicks: dict[str, int], expires: dict[str, datetime], policies: dict):
+            try:
+                # Only links that made it into Redis count as loaded.
+                if await safe_redis_set_many(self.redis, chunk, clicks, expires, policies):
+                    self.loaded += len(chunk)
+            finally:
+                slots.release()
+
+        async def stream(shard, share: int, replica):
+            async with shard.session_factory() as db:
+                stmt = (
+                    select(
+                        models.URL.key, models.URL.target_url, models.URL.clicks, models.URL.expires_at,
+                        models.URL.redirect_code, models.URL.max_age, models.URL.s_maxage,
+                    )
+                    # Click-limited links are never cached.
+                    .where(
+                        models.URL.is_active,
+                        models.URL.max_clicks.is_(None),
+                        or_(models.URL.expires_at.is_(None), models.URL.expires_at > datetime.now(timezone.utc)),
+                    )
+                    .order_by(models.URL.clicks.desc())
+                    .limit(share)
+                    .execution_options(yield_per=self.chunk_size, replica=replica)
+                )
+                result = await db.stream(stmt)
+                async for rows in result.partitions():
+                    chunk = {row.key: row.target_url for row in rows}
+                    expires = {row.key: row.expires_at for row in rows if row.expires_at is not None}
+                    policies = {row.key: redirect_policy(row.redirect_code, row.max_age, row.s_maxage) for row in rows}
+                    hot.extend(list(chunk)[:hot_max - len(hot)])
+                    if self.cache is not None:
+                        # Rows arrive hottest first; L1 keeps the most recent entries, so stop
+                        # once the hottest links fill it.
+                        for key, target_url in chunk.items():
+                            if len(self.cache) >= self.cache.max_entries:
+                                break
+                            self.cache.set(key, encode_entry(target_url, expires.get(key), policies.get(key)), ttl=seconds_until(expires.get(key)))
+                    await slots.acquire()
+                    task = asyncio.get_running_loop().create_task(write(chunk, {row.key: row.clicks for row in rows}, expires, policies))
+                    writes.add(task)
+                    task.add_done_callback(writes.discard)
+
+        try:
+            # Each shard contributes the hottest links of its share of the limit; keys are
+            # hashed over the shards, so the shares hold about equally hot links.
+            share = -(-limit // len(shard_router.shards))
+            for shard in shard_router.shards:
+                # A slightly stale replica is fine for preloading (shard 0 only).
+                replica = replica_router.pick() if shard is shard_router.default else None
+                if replica is None:
+                    await stream(shard, share, None)
+                    continue
+                loaded, hot_count = self.loaded, len(hot)
+                try:
+                    await stream(shard, share, replica)
+                except DBAPIError as e:
+                    # Like crud._read: take the replica out of rotation and read from the primary.
+                    # The links already written are written again, and counted once.
+                    replica_router.mark_down(replica, e)
+                    await asyncio.gather(*writes)
+                    self.loaded = loaded
+                    del hot[hot_count:]
+                    await stream(shard, share, None)
+            await asyncio.gather(*writes)
+            await self._publish_hot_keys(hot)
+        finally:
+            for task in writes:
+                task.cancel()
+
+    def start(self, limit: int, time_budget: float, concurrency: int):
+        # Run in the background so startup is not delayed; readiness reports progress.
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run(limit, time_budget, concurrency))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"state": self.state, "loaded": self.loaded, "duration_seconds": round(self.duration, 2)}
+
+
+cache_warmer = CacheWarmer(redis_client, local_cache, chunk_size=settings.warmup_chunk_size)
+if not settings.warmup_enabled:
+    cache_warmer.state = DISABLED
@@ -1,16 +1,93 @@
+from contextlib import asynccontextmanager
+
 from pydantic import SecretStr
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from fastapi import FastAPI
 from .core.config import get_settings
+from .core.logging import configure_logging, shutdown_logging
+from .core.edge_purge import edge_purger
+from .core.metrics import MetricsMiddleware
 from .api.v1 import router
+from .api.v1.admission import AdmissionControlMiddleware
+from .api.v1.fast_redirect import FastRedirectMiddleware
+from .database.caching import redis_probe
+from .database.clicks import click_buffer
+from .database.archive import archiver
+from .database.database import replica_monitor, shard_map_monitor, shard_router
+from .database.expiry import expiry_sweeper
+from .database.health import health_checker
+from .database.local_cache import invalidation_listener
+from .database.visitors import visitor_counter
+from .database.warmup import cache_warmer
+
+
+# Application logs go through a queue to a writer thread from here on.
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Restarts the log writer if an earlier shutdown stopped it (no-op otherwise).
+    configure_logging()
+    # Track Redis health in the background instead of pinging it on every request.
+    redis_probe.start()
+    # Check read replica health and lag (no-op without READ_REPLICA_URLS).
+    replica_monitor.start()
+    # Load the shard map before serving, then keep it current (no-op without SHARD_DATABASE_URLS).
+    if shard_router.enabled:
+        await shard_router.reload()
+    shard_map_monitor.start()
+    # Start the periodic click flush; flush whatever is still buffered on shutdown.
+    click_buffer.start()
+    # Write the unique visitors collected by this worker to Redis every second or so.
+    visitor_counter.start()
+    # Listen for cross-worker invalidations of the in-process cache.
+    invalidation_listener.start()
+    # Deactivate expired and used-up links in the background.
+    expiry_sweeper.start()
+    # Move long-inactive links out of the hot table in throttled batches.
+    archiver.start()
+    # Purge deactivated links from the CDN in the background (no-op without EDGE_PURGE_URL).
+    edge_purger.start()
+    # Check databases, Redis and event loop lag in the background for /livez and /readyz.
+    health_checker.start()
+    # Preload hot links in the background; /readyz reports when this is finished.
+    if settings.warmup_enabled:
+        cache_warmer.start(settings.warmup_limit, settings.warmup_time_budget, settings.warmup_concurrency)
+    yield
+    await cache_warmer.stop()
+    await health_checker.stop()
+    await expiry_sweeper.stop()
+    await archiver.stop()
+    await edge_purger.stop()
+    await invalidation_listener.stop()
+    await click_buffer.stop()
+    await visitor_counter.stop()
+    await redis_probe.stop()
+    await replica_monitor.stop()
+    await shard_map_monitor.stop()
+    # Last, so the shutdown of every component above is logged.
+    shutdown_logging()
 
 
 app = FastAPI(
     title="URL Shortener API",
     description="An API for shortening URLs and managing them.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 app.include_router(router)
 settings = get_settings()
+# Redirects skip routing and dependency injection (FAST_REDIRECT_ENABLED is checked per request).
+app.add_middleware(FastRedirectMiddleware)
+# Sheds redirects, link creation and admin calls with 503 when this worker is overloaded.
+app.add_middleware(AdmissionControlMiddleware)
+if settings.trusted_proxies:
+    # Client address from X-Forwarded-For, for requests that come through a trusted proxy.
+    app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=settings.trusted_proxies)
+if settings.metrics_enabled:
+    # Outermost middleware, so the measured latency covers the whole request.
+    app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def read_root():
@@ -2,11 +2,11 @@
 # Models Package Initializer
 # -------------------------------------------------------
 # This module serves as the public interface for the models package.
-# It exports the URL ORM model class for use by other modules.
+# It exports the URL, ArchivedURL and ShardAssignment ORM model classes for use by other modules.
 # The __all__ export list explicitly declares which symbols are part of the
 # package's public API.
 # -------------------------------------------------------
 
-from .url import URL
+from .url import URL, ArchivedURL, ShardAssignment
 
-__all__ = ["URL"]
\ No newline at end of file
+__all__ = ["URL", "ArchivedURL", "ShardAssignment"]
\ No newline at end of file
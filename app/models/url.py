@@ -5,11 +5,26 @@
 # The URL class represents a shortened URL record in the database with fields for
 # the target URL, generated short key, secret key for admin operations, and click tracking.
 # Each URL record is immutable after creation except for the is_active flag (soft delete)
-# and the clicks counter (analytics).
+# and the clicks counter (analytics). A link can be created with an expiry time and/or a
+# click limit; once either is reached it stops redirecting and is deactivated by the
+# expiry sweeper (app/database/expiry.py).
+# Rows that have been inactive (or, optionally, unused) for long enough are moved to
+# ArchivedURL by the archiver (app/database/archive.py), which keeps the indexes of
+# urls limited to links that can still redirect. Only admin lookups read the archive.
+# key_id and secret_token hold compact forms of key and secret_key (app/core/key_codec.py);
+# with KEY_STORAGE=compact, lookups use them instead of the string columns.
+# shard_bucket is the key's bucket (app/database/shards.py); ShardAssignment rows, on
+# shard 0, say which database holds the rows of each bucket.
+# redirect_code, max_age and s_maxage let a link override the redirect status code
+# and Cache-Control ages (app/core/http_cache.py).
+# shared marks the link dedup mode returns for its target; a unique partial index keeps
+# one active shared link per target (per database).
 # -------------------------------------------------------
 
+from datetime import datetime, timezone
+
 from app.database.database import Base
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import BigInteger, Column, Integer, SmallInteger, String, Boolean, LargeBinary, DateTime, Index, func
 
 class URL(Base):
     # Table name in the database.
@@ -23,17 +38,113 @@ class URL(Base):
     # Secret key used for authentication in admin operations (view info, delete).
     # Must be unique and indexed for fast lookups.
     secret_key = Column(String, unique=True, index=True)
+    # The short key as an integer (key_codec.key_to_id). Unique, and with KEY_STORAGE=compact
+    # the only index redirects and admin lookups use. NULL for keys without a compact form.
+    key_id = Column(BigInteger, unique=True, index=True, nullable=True)
+    # The random part of the secret key as fixed-width binary (key_codec.split_secret_key).
+    # Not indexed: admin lookups find the row through key_id and compare the token.
+    secret_token = Column(LargeBinary(6), nullable=True)
+    # Bucket of the key (shards.bucket_of); indexed so a rebalance can find the rows of a bucket.
+    # NULL only for rows written before sharding was added, until a rebalance fills it in.
+    shard_bucket = Column(SmallInteger, index=True, nullable=True)
     # The original target URL that this shortened URL redirects to.
-    # Indexed to support analytics queries.
-    target_url = Column(String, index=True)
+    target_url = Column(String)
+    # Fixed-width hash of the normalized target URL (see url_utils.target_url_hash).
+    # Indexed instead of target_url to find repeated targets with a small index.
+    target_hash = Column(LargeBinary(16), index=True)
     # Flag indicating whether this URL is active (True) or deactivated (False).
     # Defaults to True. Set to False when the URL is deleted (soft delete pattern).
     is_active = Column(Boolean, default=True)
     # Counter tracking the number of times this shortened URL has been accessed.
     # Incremented each time a redirect occurs, used for analytics.
     clicks = Column(Integer, default=0)
+    # Time after which the link stops redirecting (UTC); NULL for links that never expire.
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Number of redirects after which the link stops redirecting; NULL for no limit.
+    # Clicks on these links are counted synchronously and the links are never cached.
+    max_clicks = Column(Integer, nullable=True)
+    # How the link redirects (app/core/http_cache.py): status code (301, 302, 307 or 308)
+    # and Cache-Control max-age and s-maxage in seconds. NULL uses the configured default.
+    redirect_code = Column(SmallInteger, nullable=True)
+    max_age = Column(Integer, nullable=True)
+    s_maxage = Column(Integer, nullable=True)
+    # Lifecycle timestamps (UTC) used to decide when a row is archived.
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
+    # Set when the link is deactivated (deleted, expired or used up).
+    deactivated_at = Column(DateTime(timezone=True), nullable=True)
+    # Set when buffered clicks are flushed, so it lags real clicks by up to one flush.
+    last_clicked_at = Column(DateTime(timezone=True), nullable=True)
+    # True for links created in dedup mode to be returned for every request with their target.
+    # NULL otherwise: links created without dedup may repeat a target.
+    shared = Column(Boolean, nullable=True)
+
+    __table_args__ = (
+        # At most one active shared link per target, so concurrent requests for a new
+        # target cannot both create one (crud.create_db_url re-selects the winner).
+        Index(
+            "uq_urls_shared_target", "target_hash", unique=True,
+            postgresql_where=is_active & shared, sqlite_where=is_active & shared,
+        ),
+        # Partial indexes over the few active links with a limit, for the expiry sweeper.
+        Index(
+            "ix_urls_expires_at_active", "expires_at",
+            postgresql_where=is_active & expires_at.isnot(None), sqlite_where=is_active & expires_at.isnot(None),
+        ),
+        Index(
+            "ix_urls_max_clicks_active", "id",
+            postgresql_where=is_active & max_clicks.isnot(None), sqlite_where=is_active & max_clicks.isnot(None),
+        ),
+    )
 
     def __repr__(self):
         # Return a string representation of the URL object for debugging and logging.
         return f"<URL(id={self.id}, key={self.key}, target_url={self.target_url}, is_active={self.is_active}, clicks={self.clicks})>"
-    
\ No newline at end of file
+    
+
+class ArchivedURL(Base):
+    # Rows moved out of urls, with the same columns plus the time they were archived.
+    # Archived links never redirect; they are kept for admin lookups and statistics,
+    # and so that their keys are never issued again.
+    __tablename__ = "urls_archive"
+
+    # Same id as the row had in urls.
+    id = Column(Integer, primary_key=True)
+    # Not unique: keys and secret keys are unique when issued, and the archive must
+    # accept every row moved into it.
+    key = Column(String, index=True)
+    secret_key = Column(String, index=True)
+    key_id = Column(BigInteger, index=True, nullable=True)
+    secret_token = Column(LargeBinary(6), nullable=True)
+    shard_bucket = Column(SmallInteger, index=True, nullable=True)
+    target_url = Column(String)
+    target_hash = Column(LargeBinary(16))
+    is_active = Column(Boolean, default=False)
+    clicks = Column(Integer, default=0)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    max_clicks = Column(Integer, nullable=True)
+    redirect_code = Column(SmallInteger, nullable=True)
+    max_age = Column(Integer, nullable=True)
+    s_maxage = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    deactivated_at = Column(DateTime(timezone=True), nullable=True)
+    last_clicked_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<ArchivedURL(id={self.id}, key={self.key}, target_url={self.target_url}, archived_at={self.archived_at})>"
+
+
+class ShardAssignment(Base):
+    # The shard map: which shard holds the rows of a bucket. Read from shard 0 only;
+    # buckets without a row are on shard 0. Written by `manage.py rebalance`.
+    __tablename__ = "shard_map"
+
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    # Index of the shard (0 = DATABASE_URL, i = the i-th SHARD_DATABASE_URLS entry).
+    shard = Column(Integer, nullable=False)
+    # Set while the bucket's rows are being copied to that shard.
+    moving_to = Column(Integer, nullable=True)
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<ShardAssignment(bucket={self.bucket}, shard={self.shard}, moving_to={self.moving_to})>"
@@ -8,6 +8,6 @@
 # package's public API.
 # -------------------------------------------------------
 
-from .url import URLBase, URLInfo, URL
+from .url import URLBase, URLInfo, URL, URLBatchRequest, URLBatchItem, URLBatchResponse, EdgeClicksReport, EdgeClicksResult
 
-__all__ = ["URLBase", "URLInfo", "URL"]
\ No newline at end of file
+__all__ = ["URLBase", "URLInfo", "URL", "URLBatchRequest", "URLBatchItem", "URLBatchResponse", "EdgeClicksReport", "EdgeClicksResult"]
\ No newline at end of file
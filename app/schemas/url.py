@@ -6,13 +6,24 @@
 # between the API and clients, including validation rules and JSON serialization.
 # -------------------------------------------------------
 
+from datetime import datetime
+
 from pydantic import BaseModel
 
 class URLBase(BaseModel):
     # Base schema for URL creation requests.
     # Contains only the target URL that the user wants to shorten.
     # Used as the input model for POST /url endpoint.
+    # Optionally, the link stops redirecting at expires_at (UTC unless an offset is
+    # given) or after max_clicks redirects, whichever comes first.
+    # redirect_code (301, 302, 307, 308), max_age and s_maxage (Cache-Control seconds for
+    # browsers and CDNs) override the configured redirect policy for this link.
     target_url: str
+    expires_at: datetime | None = None
+    max_clicks: int | None = None
+    redirect_code: int | None = None
+    max_age: int | None = None
+    s_maxage: int | None = None
 
 class URL(URLBase):
     # Extended URL schema including computed fields from the database.
@@ -32,4 +43,31 @@ class URLInfo(URL):
     # Inherits is_active and clicks from URL, and target_url from URLBase.
     # Includes the actual shortened and admin URLs to be returned to the client.
     url: str  # The public shortened URL (e.g., https://127.0.0.1:8000/ABCDEF).
-    admin_url: str  # The admin URL for managing this shortened URL (e.g., https://127.0.0.1:8000/admin/ABCDEF_GHIJKLMN).
\ No newline at end of file
+    admin_url: str  # The admin URL for managing this shortened URL (e.g., https://127.0.0.1:8000/admin/ABCDEF_GHIJKLMN).
+    pending_clicks: int = 0  # Clicks recorded but not yet flushed to the clicks counter.
+    unique_visitors: int | None = None  # Approximate distinct visitors (HyperLogLog); None if unknown.
+
+class URLBatchRequest(BaseModel):
+    # Input model for POST /urls/batch: the URLs to shorten, in order.
+    urls: list[URLBase]
+
+class URLBatchItem(BaseModel):
+    # Result for one input URL. Exactly one of `url` and `error` is set.
+    index: int  # Position of the URL in the request.
+    url: URLInfo | None = None
+    error: str | None = None
+
+class URLBatchResponse(BaseModel):
+    # Response for POST /urls/batch; items are in request order.
+    created: int
+    failed: int
+    items: list[URLBatchItem]
+
+class EdgeClicksReport(BaseModel):
+    # Input model for POST /edge/clicks: redirects a CDN answered from its cache, per short key.
+    clicks: dict[str, int]
+
+class EdgeClicksResult(BaseModel):
+    # Clicks added to the counters, and keys ignored (never issued, or a count below 1).
+    recorded: int
+    ignored_keys: int
@@ -0,0 +1,194 @@
+# -------------------------------------------------------
+# In-Process Redis Substitute
+# -------------------------------------------------------
+# A small asyncio stand-in for redis.asyncio.Redis used by the offline benchmark
+# suite, so the app can be measured without a Redis server. It implements only
+# the commands the application issues (strings with expiry, hashes, HyperLogLogs,
+# pub/sub, pipelines and the rate limit script) with decode_responses=True semantics.
+#
+# Every command (and every pipeline, as one round trip) can be delayed by a fixed
+# simulated network latency, and commands are counted so that the suite can
+# report Redis round trips per request.
+# -------------------------------------------------------
+
+import asyncio
+import time
+from collections import defaultdict
+
+
+class InMemoryPipeline:
+    def __init__(self, client: "InMemoryRedis"):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.commands = []
+
+    async def execute(self, raise_on_error: bool = True):
+        commands, self.commands = self.commands, []
+        await self.client._round_trip()
+        return [getattr(self.client, f"_{name}")(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class InMemoryPubSub:
+    def __init__(self, client: "InMemoryRedis"):
+        self.client = client
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.channels: set[str] = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        for channel in self.channels:
+            self.client._subscribers[channel].discard(self)
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self.client._subscribers[channel].add(self)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+
+class InMemoryRedis:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.commands = 0
+        # key -> (value, deadline or None)
+        self._data: dict[str, tuple[object, float | None]] = {}
+        self._subscribers: dict[str, set[InMemoryPubSub]] = defaultdict(set)
+
+    async def _round_trip(self):
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def __getattr__(self, name):
+        # Every async command is a round trip in front of the synchronous implementation.
+        implementation = self.__class__.__dict__.get(f"_{name}")
+        if implementation is None:
+            raise AttributeError(name)
+
+        async def command(*args, **kwargs):
+            await self._round_trip()
+            return implementation(self, *args, **kwargs)
+        return command
+
+    def pipeline(self, transaction: bool = True) -> InMemoryPipeline:
+        return InMemoryPipeline(self)
+
+    def pubsub(self) -> InMemoryPubSub:
+        return InMemoryPubSub(self)
+
+    def _lookup(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, deadline = entry
+        if deadline is not None and deadline <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    # ---------------------------- commands ----------------------------
+
+    def _ping(self):
+        return True
+
+    def _get(self, key: str):
+        return self._lookup(key)
+
+    def _set(self, key: str, value, ex: int | None = None, px: int | None = None, nx: bool = False):
+        if nx and self._lookup(key) is not None:
+            return None
+        deadline = None
+        if ex is not None:
+            deadline = time.monotonic() + ex
+        elif px is not None:
+            deadline = time.monotonic() + px / 1000
+        self._data[key] = (str(value), deadline)
+        return True
+
+    def _delete(self, *keys: str):
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def _pttl(self, key: str):
+        if self._lookup(key) is None:
+            return -2
+        deadline = self._data[key][1]
+        return -1 if deadline is None else int((deadline - time.monotonic()) * 1000)
+
+    def _expire(self, key: str, seconds: int):
+        if (value := self._lookup(key)) is None:
+            return False
+        self._data[key] = (value, time.monotonic() + seconds)
+        return True
+
+    def _exists(self, *keys: str):
+        return sum(self._lookup(key) is not None for key in keys)
+
+    def _expireat(self, key: str, when: int):
+        return self._expire(key, when - time.time())
+
+    # HyperLogLog commands, counted exactly with sets.
+    def _pfadd(self, key: str, *values: str):
+        sketch = self._lookup(key)
+        if sketch is None:
+            sketch = set()
+            self._data[key] = (sketch, None)
+        added = not set(values) <= sketch
+        sketch.update(values)
+        return int(added)
+
+    def _pfcount(self, *keys: str):
+        return len(set().union(*(self._lookup(key) or set() for key in keys)))
+
+    def _rename(self, source: str, destination: str):
+        if self._lookup(source) is None:
+            raise RuntimeError("ERR no such key")
+        self._data[destination] = self._data.pop(source)
+        return True
+
+    def _hincrby(self, name: str, field: str, amount: int = 1):
+        table = self._lookup(name)
+        if table is None:
+            table = {}
+            self._data[name] = (table, None)
+        table[field] = str(int(table.get(field, 0)) + amount)
+        return int(table[field])
+
+    def _hget(self, name: str, field: str):
+        return (self._lookup(name) or {}).get(field)
+
+    def _hgetall(self, name: str):
+        return dict(self._lookup(name) or {})
+
+    def _publish(self, channel: str, message: str):
+        subscribers = self._subscribers.get(channel, ())
+        for subscriber in subscribers:
+            subscriber.queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(subscribers)
+
+    def _evalsha(self, sha: str, numkeys: int, key: str, rate, burst, cost):
+        # The only script the application runs: the token bucket of app/database/rate_limit.py.
+        rate, burst, cost = float(rate), float(burst), float(cost)
+        now = time.monotonic()
+        tokens, updated = self._lookup(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._data[key] = ((tokens, now), now + (burst - tokens) / rate + 1)
+        return [int(allowed), "0" if allowed else str((cost - tokens) / rate)]
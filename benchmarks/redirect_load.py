@@ -0,0 +1,101 @@
+# -------------------------------------------------------
+# Redirect Load Benchmark
+# -------------------------------------------------------
+# Drives concurrent GET /{key} traffic against a running instance of the API and
+# reports redirect throughput and latency percentiles (p50/p99).
+# The script first creates a set of short links through POST /url, then fires
+# the requested number of redirects at a fixed concurrency level.
+#
+# Compare two builds by running the script against each one with the same
+# arguments and different labels, e.g.
+#   python benchmarks/redirect_load.py --base-url http://localhost:8000 --label sync-session
+#   python benchmarks/redirect_load.py --base-url http://localhost:8000 --label async-session
+# Each run appends one JSON line to --output so results can be diffed later.
+# -------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import httpx
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    # Nearest-rank percentile over an already sorted list of samples.
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+    return samples[rank]
+
+async def create_links(client: httpx.AsyncClient, count: int) -> list[str]:
+    # Create the short links that the redirect phase will hit.
+    keys = []
+    for i in range(count):
+        response = await client.post("/url", json={"target_url": f"https://example.com/bench/{i}"})
+        response.raise_for_status()
+        keys.append(response.json()["url"])
+    return keys
+
+async def run_redirects(client: httpx.AsyncClient, keys: list[str], requests: int, concurrency: int) -> tuple[list[float], int]:
+    # Fire `requests` redirects with at most `concurrency` in flight at a time.
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            key = random.choice(keys)
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"/{key}", follow_redirects=False)
+                if response.status_code != 307:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+async def main(args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        keys = await create_links(client, args.links)
+        # Warm-up pass so connection setup does not skew the measurement.
+        await run_redirects(client, keys, min(args.requests, args.concurrency * 10), args.concurrency)
+
+        started = time.perf_counter()
+        latencies, errors = await run_redirects(client, keys, args.requests, args.concurrency)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "label": args.label,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure redirect throughput and latency under concurrent load.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--label", default="current", help="name recorded with the result (e.g. the git revision)")
+    parser.add_argument("--links", type=int, default=200, help="number of short links to create")
+    parser.add_argument("--requests", type=int, default=20000, help="number of redirects to measure")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--output", default="bench_output.txt", help="file that results are appended to")
+    asyncio.run(main(parser.parse_args()))
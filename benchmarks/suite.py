@@ -0,0 +1,318 @@
+# -------------------------------------------------------
+# Offline Benchmark Suite
+# -------------------------------------------------------
+# Runs the API in process (httpx ASGITransport, no sockets) against local
+# stand-ins and measures realistic workloads, so performance regressions can be
+# caught without any running services:
+#   - database: a throwaway SQLite file by default, or any DATABASE_URL (e.g. a
+#     local Postgres) via --database-url. Migrations are applied before the run.
+#   - Redis: benchmarks/inmemory_redis.py, with an optional simulated round trip
+#     latency (--redis-latency-ms).
+#
+# Workloads, each measured separately:
+#   - redirect:  GET /{key} with Zipf-distributed key popularity over --links links
+#   - redirect_route: the same requests with the redirect fast path disabled, so
+#                the FastAPI route can be compared against it
+#   - create:    bursts of POST /url
+#   - not_found: GET /{key} for keys that were never issued (scans)
+# For each workload the suite reports throughput, p50/p95/p99 latency, errors and
+# database queries / Redis commands per request. Buffered clicks are flushed
+# between workloads and not counted.
+#
+#   python benchmarks/suite.py --output bench_results.json
+#   python benchmarks/suite.py --baseline benchmarks/baseline.json --fail-on-regression
+#   python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+#
+# Results are written as JSON. With --baseline, every metric is compared against
+# the stored run and changes beyond --tolerance are flagged as regressions.
+# Latency numbers depend on the machine; compare runs made on the same host.
+# -------------------------------------------------------
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared against the baseline, and whether a higher value is better.
+COMPARED_METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "db_queries_per_request": False,
+    "redis_commands_per_request": False,
+}
+
+
+def configure_environment(args: argparse.Namespace):
+    # Settings are read at import time, so the environment must be ready before `app` is imported.
+    os.environ["DATABASE_URL"] = args.database_url
+    for name, value in {
+        "DATABASE_USER": "bench",
+        "DATABASE_PW": "bench",
+        "DATABASE_NAME": "bench",
+        "BASE_URL": "http://bench",
+        "ENV_NAME": "bench",
+        "REDIS_HOST": "localhost",
+        "REDIS_PORT": "6379",
+        "CLICK_BUFFER_BACKEND": "memory",
+        # Clicks are flushed explicitly between workloads.
+        "CLICK_FLUSH_INTERVAL": "3600",
+        "CLICK_FLUSH_THRESHOLD": "1000000000",
+        # Measure queueing under the concurrency limits rather than shedding (503s count as errors).
+        "ADMISSION_MAX_QUEUE_TIME": "60",
+    }.items():
+        os.environ.setdefault(name, value)
+    if args.database_url.startswith("sqlite"):
+        # url_key_seq only exists on PostgreSQL.
+        os.environ.setdefault("KEYGEN_STRATEGY", "random")
+
+
+def migrate(database_url: str):
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import create_engine
+
+    engine = create_engine(database_url)
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    config.set_main_option("sqlalchemy.url", database_url)
+    with engine.connect() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+        connection.commit()
+    engine.dispose()
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    # Nearest-rank percentile over an already sorted list of samples.
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+    return samples[rank]
+
+
+class ZipfSampler:
+    # Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s.
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+async def run_workload(client, make_request, requests: int, concurrency: int, expected_status: int, counters) -> dict:
+    # Issue `requests` requests with at most `concurrency` in flight.
+    queries, fake_redis = counters
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != expected_status:
+                errors += 1
+
+    queries_before, commands_before = queries.count, fake_redis.commands
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "db_queries_per_request": round((queries.count - queries_before) / requests, 3),
+        "redis_commands_per_request": round((fake_redis.commands - commands_before) / requests, 3),
+    }
+
+
+async def seed_links(client, count: int, batch_size: int) -> list[str]:
+    keys = []
+    for start in range(0, count, batch_size):
+        urls = [{"target_url": f"https://example.com/seed/{i}"} for i in range(start, min(count, start + batch_size))]
+        response = await client.post("/urls/batch", json={"urls": urls})
+        response.raise_for_status()
+        keys.extend(item["url"]["url"] for item in response.json()["items"])
+    return keys
+
+
+async def run_suite(args: argparse.Namespace) -> dict:
+    import httpx
+    from inmemory_redis import InMemoryRedis
+
+    from app.main import app
+    from app.api.v1.fast_redirect import fast_redirect
+    from app.core.config import get_settings
+    from app.database import get_redis
+    from app.database.caching import redis_probe
+    from app.database.clicks import click_buffer
+    from app.database.database import async_engine
+    from app.database.archive import archiver
+    from app.database.expiry import expiry_sweeper
+    from app.database.key_filter import key_filter
+    from app.database.local_cache import invalidation_listener, local_cache
+    from app.database.visitors import visitor_counter
+    from app.database.warmup import cache_warmer
+
+    settings = get_settings()
+    fake_redis = InMemoryRedis(latency=args.redis_latency_ms / 1000)
+    # Point the request dependency and the per-worker singletons at the substitute.
+    app.dependency_overrides[get_redis] = lambda: fake_redis
+    for component in (click_buffer, key_filter, invalidation_listener, cache_warmer, fast_redirect, expiry_sweeper, archiver, visitor_counter):
+        component.redis = fake_redis
+    redis_probe.client = fake_redis
+    counters = (QueryCounter(async_engine), fake_redis)
+    rng = random.Random(args.seed)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url=settings.base_url) as client:
+        keys = await seed_links(client, args.links, settings.batch_max_size)
+        # Wait for the key filter, which is rebuilt once the listener has subscribed.
+        while not key_filter.active:
+            await asyncio.sleep(0.01)
+
+        zipf = ZipfSampler(len(keys), args.zipf_s, rng)
+        redirect_keys = [keys[zipf.sample()] for _ in range(args.redirects)]
+        for workload, fast_path in (("redirect", True), ("redirect_route", False)):
+            fast_redirect.enabled = fast_path
+            # Start from cold caches so the hot/cold mix of the Zipf distribution shows up.
+            local_cache.clear()
+            fake_redis._data.clear()
+            results[workload] = await run_workload(
+                client, lambda c, i: c.get(f"/{redirect_keys[i]}"),
+                args.redirects, args.concurrency, 307, counters,
+            )
+            await click_buffer.flush()
+        fast_redirect.enabled = settings.fast_redirect_enabled
+
+        results["create"] = await run_workload(
+            client, lambda c, i: c.post("/url", json={"target_url": f"https://example.com/burst/{i}"}),
+            args.creates, args.concurrency, 200, counters,
+        )
+
+        # Keys one character longer than any issued key can never exist.
+        scan_keys = [f"{i:0{settings.keygen_min_length + 2}d}" for i in range(args.scans)]
+        results["not_found"] = await run_workload(
+            client, lambda c, i: c.get(f"/{scan_keys[i]}"),
+            args.scans, args.concurrency, 404, counters,
+        )
+    app.dependency_overrides.pop(get_redis, None)
+    await async_engine.dispose()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    # Print a per-metric comparison and return the regressions beyond the tolerance.
+    regressions = []
+    for workload, metrics in results["workloads"].items():
+        base = baseline.get("workloads", {}).get(workload)
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print(f"  {workload:<10} {metric:<28} {old:>12} -> {new:<12} {change:+.1%} {flag}")
+            if flag:
+                regressions.append(f"{workload}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite against in-process stand-ins.")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--links", type=int, default=2000, help="number of links seeded before the workloads")
+    parser.add_argument("--redirects", type=int, default=20000)
+    parser.add_argument("--creates", type=int, default=2000)
+    parser.add_argument("--scans", type=int, default=5000, help="requests for never-issued keys")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of link popularity")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0, help="simulated Redis round trip time")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json", help="where the JSON results are written")
+    parser.add_argument("--baseline", help="stored results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change treated as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on regressions")
+    parser.add_argument("--save-baseline", help="also write the results here, to compare later runs against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.database_url:
+            args.database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        configure_environment(args)
+        migrate(args.database_url)
+        workloads = asyncio.run(run_suite(args))
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "database": args.database_url.split(":", 1)[0],
+        "parameters": {
+            name: getattr(args, name)
+            for name in ("links", "redirects", "creates", "scans", "concurrency", "zipf_s", "redis_latency_ms", "seed")
+        },
+        "workloads": workloads,
+    }
+    print(json.dumps(results, indent=2))
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+            fh.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print(f"Compared with {args.baseline} (revision {baseline.get('revision')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
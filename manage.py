@@ -0,0 +1,562 @@
+# -------------------------------------------------------
+# Management CLI
+# -------------------------------------------------------
+# Command line tools for operating on the urls table outside of the API.
+#
+#   python manage.py export urls.csv            # or urls.jsonl, or "-" for stdout
+#   python manage.py import urls.jsonl --warm-redis
+#   python manage.py warm --limit 50000 --time-budget 120
+#   python manage.py compact-keys --replace-string-indexes
+#   python manage.py shards
+#   python manage.py rebalance --buckets 2048-4095 --to 1
+#
+# Export and import stream rows through PostgreSQL COPY over the synchronous
+# engine, so memory use stays constant regardless of table size:
+#   - export: COPY ... TO STDOUT writes straight into the output file. JSONL rows
+#     are rendered by Postgres (row_to_json) and copied out unquoted.
+#   - import: rows are read in chunks, COPYed into a temporary staging table and
+#     moved into urls with one INSERT ... ON CONFLICT DO NOTHING per chunk, which
+#     checks every key against the unique indexes in bulk. Rows whose key or
+#     secret key already exists are skipped and counted.
+#     Imported keys are announced on the keys:issued channel so that running
+#     workers add them to their key filters. --warm-redis caches them the way the
+#     app does: TTLs capped at the link's expiry, click-limited links not cached.
+# warm runs the same cache warm-up as the app does at startup (app.database.warmup):
+# the most-clicked active links are streamed and written to Redis.
+# compact-keys encodes key_id / secret_token for rows that lack them (written by a
+# version older than the compact keys migration) and, with --replace-string-indexes,
+# swaps the full unique indexes on key and secret_key for partial ones covering only
+# rows without a compact form. Run that last step once KEY_STORAGE=compact is live on
+# every worker: string lookups then no longer have a full index to use.
+# shards prints the shard map and row counts per shard. rebalance moves buckets of
+# keys between shards (app/database/shards.py) while the app keeps serving them:
+#   1. the buckets are marked as moving in the shard map, and the command waits
+#      two SHARD_MAP_REFRESH_INTERVALs so every worker routes new links of those
+#      buckets to the destination and looks up the others on both shards;
+#   2. per bucket, rows are copied in batches: the source rows are locked, written
+#      to the destination and only then deleted from the source, so a click or
+#      deactivation arriving meanwhile waits for the batch and then finds the row on
+#      the destination; archived rows follow the same way;
+#   3. the bucket is assigned to the destination and no longer marked as moving.
+# An interrupted rebalance can be run again with the same arguments. Export and
+# compact-keys work on one shard at a time (--shard); import writes to shard 0 and
+# is refused once buckets live elsewhere.
+# Row ids are not exported; imported rows get new ids. When moving a database
+# that used KEYGEN_STRATEGY=sequence, copy the url_key_seq value as well
+# (SELECT setval('url_key_seq', <value from the source>)).
+# -------------------------------------------------------
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import redis
+
+from sqlalchemy import bindparam, create_engine, delete, func, insert, select, text
+
+from app import models
+from app.core.config import get_settings
+from app.core.http_cache import redirect_policy
+from app.core.key_codec import compact_columns
+from app.core.ttl_policy import ttl_policy
+from app.database.caching import encode_entry, seconds_until
+from app.core.url_utils import target_url_hash
+from app.database.database import engine
+from app.database.key_filter import KEY_ISSUED_CHANNEL
+from app.database.shards import NUM_BUCKETS, bucket_of
+
+settings = get_settings()
+
+# Columns exported and imported, in file order. Files without the later columns
+# (e.g. expires_at) still import; missing values are NULL.
+COLUMNS = [
+    "key", "secret_key", "target_url", "is_active", "clicks", "expires_at", "max_clicks",
+    "redirect_code", "max_age", "s_maxage", "created_at", "deactivated_at", "last_clicked_at", "shared",
+]
+# Columns written on import; target_hash, key_id and secret_token are derived rather than exported.
+IMPORT_COLUMNS = COLUMNS + ["target_hash", "key_id", "secret_token", "shard_bucket"]
+
+
+def shard_engines() -> list:
+    # Synchronous engines of every shard, by index: DATABASE_URL, then SHARD_DATABASE_URLS.
+    return [engine] + [create_engine(url) for url in settings.shard_database_url_list]
+
+@contextmanager
+def raw_connection(shard: int = 0):
+    # psycopg2 connection from the synchronous engine; COPY needs the DBAPI cursor.
+    connection = (engine if shard == 0 else shard_engines()[shard]).raw_connection()
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+@contextmanager
+def open_output(path: str):
+    if path == "-":
+        yield sys.stdout
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            yield fh
+
+@contextmanager
+def open_input(path: str):
+    if path == "-":
+        yield sys.stdin
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as fh:
+            yield fh
+
+def detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+# ---------------------------- export ----------------------------
+
+def export_urls(path: str, fmt: str, active_only: bool, shard: int):
+    where = "WHERE is_active" if active_only else ""
+    select = f"SELECT {', '.join(COLUMNS)} FROM urls {where} ORDER BY id"
+    if fmt == "jsonl":
+        # One JSON document per line. The quote/delimiter characters never occur in
+        # row_to_json output, so Postgres writes each document without CSV quoting.
+        sql = f"COPY (SELECT row_to_json(u) FROM ({select}) u) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+    else:
+        sql = f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+    started = time.perf_counter()
+    with raw_connection(shard) as connection, open_output(path) as out:
+        cursor = connection.cursor()
+        cursor.copy_expert(sql, out)
+        rows = cursor.rowcount
+        connection.commit()
+    print(f"Exported {rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+# ---------------------------- import ----------------------------
+
+def read_rows(fh, fmt: str):
+    # Yield one dict per input row without loading the whole file.
+    if fmt == "jsonl":
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(fh)
+
+def chunked(rows, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("t", "true", "1", "yes")
+
+def nullable(value):
+    # None (JSON null) as an empty field, which COPY's CSV format reads as NULL.
+    return "" if value is None else value
+
+def import_chunk(cursor, chunk: list[dict]) -> list[tuple]:
+    # COPY one chunk into the staging table and move it into urls. Returns the inserted rows.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        compact = compact_columns(row["key"], row["secret_key"])
+        writer.writerow([
+            row["key"],
+            row["secret_key"],
+            row["target_url"],
+            to_bool(row.get("is_active", True)),
+            int(row.get("clicks") or 0),
+            # Timestamps are passed through as exported (CSV or JSON); Postgres parses both.
+            nullable(row.get("expires_at")),
+            nullable(row.get("max_clicks")),
+            nullable(row.get("redirect_code")),
+            nullable(row.get("max_age")),
+            nullable(row.get("s_maxage")),
+            nullable(row.get("created_at")),
+            nullable(row.get("deactivated_at")),
+            nullable(row.get("last_clicked_at")),
+            # Links that are not shared keep NULL, like links the app creates without dedup.
+            True if to_bool(row.get("shared") or False) else "",
+            "\\x" + target_url_hash(row["target_url"]).hex(),
+            # Empty unquoted fields are NULL in COPY's CSV format.
+            compact["key_id"] if compact["key_id"] is not None else "",
+            "\\x" + compact["secret_token"].hex() if compact["secret_token"] is not None else "",
+            bucket_of(row["key"]),
+        ])
+    buffer.seek(0)
+
+    cursor.execute("TRUNCATE urls_import")
+    cursor.copy_expert(f"COPY urls_import ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    # One active shared link per target (uq_urls_shared_target): a shared link whose target
+    # already has one, in urls or earlier in the chunk, is imported unshared rather than skipped.
+    cursor.execute("""
+        UPDATE urls_import i SET shared = NULL
+        WHERE shared AND is_active AND (
+            EXISTS (SELECT 1 FROM urls u WHERE u.target_hash = i.target_hash AND u.is_active AND u.shared)
+            OR EXISTS (SELECT 1 FROM urls_import o WHERE o.target_hash = i.target_hash AND o.is_active AND o.shared AND o.key < i.key)
+        )
+    """)
+    # DISTINCT ON drops duplicate keys inside the chunk; ON CONFLICT skips keys or
+    # secret keys that already exist, using the unique indexes.
+    # Files written before created_at was exported get the import time, like new links.
+    values = ", ".join("COALESCE(created_at, now())" if column == "created_at" else column for column in IMPORT_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO urls ({', '.join(IMPORT_COLUMNS)})
+        SELECT DISTINCT ON (key) {values} FROM urls_import
+        ON CONFLICT DO NOTHING
+        RETURNING key, target_url, is_active, clicks, expires_at, max_clicks, redirect_code, max_age, s_maxage
+    """)
+    return cursor.fetchall()
+
+def publish_to_redis(client: redis.Redis, rows: list[tuple], warm: bool):
+    # One pipelined round trip per chunk: announce the new keys and optionally cache them
+    # the way the app does: with the TTL the cache policy gives their click count, capped
+    # at their expiry. Click-limited links are never cached (every redirect must be counted),
+    # and neither are links that have already expired.
+    active = [row for row in rows if row[2]]
+    if not active:
+        return
+    pipe = client.pipeline(transaction=False)
+    pipe.publish(KEY_ISSUED_CHANNEL, ",".join(row[0] for row in active))
+    if warm:
+        for key, target_url, _, clicks, expires_at, max_clicks, redirect_code, max_age, s_maxage in active:
+            if max_clicks is not None:
+                continue
+            if ttl := ttl_policy.ttl(clicks, seconds_until(expires_at)):
+                policy = redirect_policy(redirect_code, max_age, s_maxage)
+                pipe.set(key, encode_entry(target_url, expires_at, policy), ex=ttl)
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"  warning: could not update Redis for this chunk ({e})", file=sys.stderr)
+
+def import_urls(path: str, fmt: str, chunk_size: int, warm: bool):
+    if any(shard != 0 or moving_to is not None for shard, moving_to in read_shard_map(engine).values()):
+        # Rows are written to shard 0; those of buckets kept elsewhere would never be found.
+        sys.exit("Some buckets are not on shard 0; import into an unsharded deployment and rebalance afterwards")
+    redis_client = redis.Redis(host=settings.redis_host, port=settings.redis_port, decode_responses=True)
+
+    read = inserted = 0
+    started = time.perf_counter()
+    with raw_connection() as connection, open_input(path) as fh:
+        cursor = connection.cursor()
+        cursor.execute(f"CREATE TEMP TABLE urls_import AS SELECT {', '.join(IMPORT_COLUMNS)} FROM urls WITH NO DATA")
+        for chunk in chunked(read_rows(fh, fmt), chunk_size):
+            rows = import_chunk(cursor, chunk)
+            # Commit per chunk so a failure part-way keeps the chunks already imported.
+            connection.commit()
+            read += len(chunk)
+            inserted += len(rows)
+            publish_to_redis(redis_client, rows, warm)
+            print(f"  {read} rows read, {inserted} inserted", file=sys.stderr)
+    print(
+        f"Imported {inserted} of {read} rows in {time.perf_counter() - started:.1f}s "
+        f"({read - inserted} skipped as duplicates)",
+        file=sys.stderr,
+    )
+
+
+# ---------------------------- compact keys ----------------------------
+
+# Partial indexes that replace ix_urls_key / ix_urls_secret_key: they keep keys and
+# secret keys without a compact form unique and searchable, and stay (nearly) empty.
+PARTIAL_KEY_INDEXES = [
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_urls_key_legacy ON urls (key) WHERE key_id IS NULL",
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_urls_secret_key_legacy ON urls (secret_key) WHERE secret_token IS NULL",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_urls_key",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_urls_secret_key",
+]
+
+def compact_keys(batch_size: int, replace_string_indexes: bool, shard: int):
+    started = time.perf_counter()
+    encoded = 0
+    with raw_connection(shard) as connection:
+        cursor = connection.cursor()
+        last_id = 0
+        while True:
+            # One short transaction per batch, walking the primary key.
+            cursor.execute(
+                "SELECT id, key, secret_key FROM urls WHERE id > %s AND key_id IS NULL ORDER BY id LIMIT %s",
+                (last_id, batch_size),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            values = [
+                (columns["key_id"], columns["secret_token"], row_id)
+                for row_id, key, secret_key in rows
+                if (columns := compact_columns(key or "", secret_key or ""))["key_id"] is not None
+            ]
+            cursor.executemany("UPDATE urls SET key_id = %s, secret_token = %s WHERE id = %s", values)
+            connection.commit()
+            encoded += len(values)
+            last_id = rows[-1][0]
+        print(f"Encoded {encoded} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        if replace_string_indexes:
+            # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction.
+            connection.autocommit = True
+            for sql in PARTIAL_KEY_INDEXES:
+                print(f"  {sql}", file=sys.stderr)
+                cursor.execute(sql)
+
+
+# ---------------------------- shards ----------------------------
+
+def parse_buckets(spec: str) -> list[int]:
+    # "0-1023,2048" -> [0, 1, ..., 1023, 2048]
+    buckets = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        buckets.update(range(int(first), int(last or first) + 1))
+    if not buckets or min(buckets) < 0 or max(buckets) >= NUM_BUCKETS:
+        raise ValueError(f"buckets must be between 0 and {NUM_BUCKETS - 1}")
+    return sorted(buckets)
+
+def read_shard_map(map_engine) -> dict[int, tuple[int, int | None]]:
+    table = models.ShardAssignment.__table__
+    with map_engine.connect() as connection:
+        return {row.bucket: (row.shard, row.moving_to) for row in connection.execute(select(table))}
+
+def write_shard_map(map_engine, placement: dict[int, tuple[int, int | None]]):
+    # Set the (shard, moving_to) of these buckets in one transaction. Buckets plainly on
+    # shard 0 need no row.
+    table = models.ShardAssignment.__table__
+    buckets = list(placement)
+    with map_engine.begin() as connection:
+        for start in range(0, len(buckets), 1000):
+            connection.execute(delete(table).where(table.c.bucket.in_(buckets[start:start + 1000])))
+        now = datetime.now(timezone.utc)
+        rows = [
+            {"bucket": bucket, "shard": shard, "moving_to": moving_to, "updated_at": now}
+            for bucket, (shard, moving_to) in placement.items()
+            if shard != 0 or moving_to is not None
+        ]
+        if rows:
+            connection.execute(insert(table), rows)
+
+def fill_buckets(shard_engine, batch_size: int) -> int:
+    # Give rows written before the shard_bucket column existed their bucket.
+    filled = 0
+    for table in (models.URL.__table__, models.ArchivedURL.__table__):
+        last_id = 0
+        while True:
+            with shard_engine.begin() as connection:
+                rows = connection.execute(
+                    select(table.c.id, table.c.key)
+                    .where(table.c.id > last_id, table.c.shard_bucket.is_(None))
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                connection.execute(
+                    table.update().where(table.c.id == bindparam("row_id")).values(shard_bucket=bindparam("bucket")),
+                    [{"row_id": row.id, "bucket": bucket_of(row.key or "")} for row in rows],
+                )
+            filled += len(rows)
+            last_id = rows[-1].id
+    return filled
+
+def move_rows(source, destination, table, bucket: int, batch_size: int) -> list:
+    # Move the bucket's rows of `table` in batches. Returns the moved rows.
+    # The destination assigns new ids to urls rows; archived rows keep theirs, except on
+    # PostgreSQL, where they get one from the destination's urls sequence (which is what
+    # the archiver copies into urls_archive there), so they cannot collide with later ones.
+    moved = []
+    archive = table is models.ArchivedURL.__table__
+    while True:
+        with source.connect() as src, destination.connect() as dst:
+            rows = src.execute(
+                select(table).where(table.c.shard_bucket == bucket).order_by(table.c.id).limit(batch_size).with_for_update()
+            ).mappings().all()
+            if not rows:
+                break
+            keys = [row["key"] for row in rows]
+            values = [{name: value for name, value in row.items() if name != "id"} for row in rows]
+            if archive:
+                if dst.dialect.name == "postgresql":
+                    ids = dst.execute(
+                        text("SELECT nextval(pg_get_serial_sequence('urls', 'id')) FROM generate_series(1, :count)"), {"count": len(rows)}
+                    ).scalars().all()
+                else:
+                    ids = [row["id"] for row in rows]
+                values = [{**row, "id": row_id} for row, row_id in zip(values, ids)]
+            # Copies left behind by an interrupted run are replaced, so the destination
+            # always ends up with the source's latest version of each row.
+            dst.execute(delete(table).where(table.c.key.in_(keys)))
+            if not archive:
+                # Each database keeps one active shared link per target (uq_urls_shared_target);
+                # a moved link whose target already has one there stops being shared.
+                hashes = {row["target_hash"] for row in values if row["shared"] and row["is_active"]}
+                taken = set(dst.execute(
+                    select(table.c.target_hash).where(table.c.target_hash.in_(hashes), table.c.is_active, table.c.shared)
+                ).scalars()) if hashes else set()
+                for row in values:
+                    if row["target_hash"] in taken:
+                        row["shared"] = None
+            dst.execute(insert(table), values)
+            dst.commit()
+            # Still holding the row locks: updates waiting on them find the rows gone and
+            # go on to the destination.
+            src.execute(delete(table).where(table.c.id.in_([row["id"] for row in rows])))
+            src.commit()
+            moved.extend(rows)
+    return moved
+
+def rebalance(engines: list, buckets: list[int], to: int, batch_size: int, settle: float, announce=None) -> dict:
+    # Move the buckets to shard `to`. `announce` receives the active keys moved per
+    # bucket, so workers whose key filter is being rebuilt cannot miss them.
+    if not 0 <= to < len(engines):
+        raise ValueError(f"shard {to} is not configured (shards 0-{len(engines) - 1})")
+    placement = read_shard_map(engines[0])
+    sources = {}
+    for bucket in buckets:
+        shard, moving_to = placement.get(bucket, (0, None))
+        if moving_to not in (None, to):
+            raise ValueError(f"bucket {bucket} is already moving to shard {moving_to}; finish that rebalance first")
+        if (shard, moving_to) != (to, None):
+            sources[bucket] = shard
+    if not sources:
+        return {"buckets": 0, "urls": 0, "archived": 0}
+
+    write_shard_map(engines[0], {bucket: (shard, to) for bucket, shard in sources.items()})
+    print(f"Marked {len(sources)} buckets as moving to shard {to}; waiting {settle:.0f}s for every worker to notice", file=sys.stderr)
+    time.sleep(settle)
+
+    for shard in set(sources.values()):
+        if filled := fill_buckets(engines[shard], batch_size):
+            print(f"  gave {filled} older rows on shard {shard} their bucket", file=sys.stderr)
+    stats = {"buckets": 0, "urls": 0, "archived": 0}
+    for bucket, shard in sorted(sources.items()):
+        if shard != to:
+            urls = move_rows(engines[shard], engines[to], models.URL.__table__, bucket, batch_size)
+            archived = move_rows(engines[shard], engines[to], models.ArchivedURL.__table__, bucket, batch_size)
+            if announce is not None:
+                announce([row["key"] for row in urls if row["is_active"]])
+            stats["urls"] += len(urls)
+            stats["archived"] += len(archived)
+        write_shard_map(engines[0], {bucket: (to, None)})
+        stats["buckets"] += 1
+    return stats
+
+def rebalance_command(buckets: str, to: int, batch_size: int, settle: float):
+    redis_client = redis.Redis(host=settings.redis_host, port=settings.redis_port, decode_responses=True)
+
+    def announce(keys: list[str]):
+        if not keys:
+            return
+        try:
+            redis_client.publish(KEY_ISSUED_CHANNEL, ",".join(keys))
+        except redis.RedisError as e:
+            print(f"  warning: could not announce moved keys ({e})", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        stats = rebalance(shard_engines(), parse_buckets(buckets), to, batch_size, settle, announce)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(
+        f"Moved {stats['buckets']} buckets to shard {to} ({stats['urls']} links, {stats['archived']} archived) "
+        f"in {time.perf_counter() - started:.1f}s",
+        file=sys.stderr,
+    )
+
+def show_shards():
+    engines = shard_engines()
+    placement = read_shard_map(engines[0])
+    for index, shard_engine in enumerate(engines):
+        buckets = sum(placement.get(bucket, (0, None))[0] == index for bucket in range(NUM_BUCKETS))
+        moving = sum(moving_to == index for _, moving_to in placement.values())
+        with shard_engine.connect() as connection:
+            rows = connection.execute(select(func.count()).select_from(models.URL.__table__)).scalar_one()
+        print(f"shard {index}: {buckets} buckets ({moving} moving in), {rows} links")
+
+
+# ---------------------------- warm ----------------------------
+
+def warm_cache(limit: int, time_budget: float, concurrency: int, chunk_size: int):
+    from app.database.caching import redis_client
+    from app.database.warmup import CacheWarmer
+
+    # Redis only; there is no in-process cache worth filling in a one-off command.
+    warmer = CacheWarmer(redis_client, cache=None, chunk_size=chunk_size)
+    stats = asyncio.run(warmer.run(limit, time_budget, concurrency))
+    print(f"Warm-up {stats['state']}: {stats['loaded']} links in {stats['duration_seconds']}s", file=sys.stderr)
+    if stats["state"] == "failed":
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="URL shortener management commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="stream the urls table to CSV or JSONL")
+    export_cmd.add_argument("path", help="output file, or - for stdout")
+    export_cmd.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    export_cmd.add_argument("--active-only", action="store_true", help="skip deactivated links")
+    export_cmd.add_argument("--shard", type=int, default=0, help="shard to export (0 = DATABASE_URL)")
+
+    import_cmd = commands.add_parser("import", help="load CSV or JSONL rows into the urls table")
+    import_cmd.add_argument("path", help="input file, or - for stdin")
+    import_cmd.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    import_cmd.add_argument("--chunk-size", type=int, default=10_000, help="rows per COPY/INSERT round")
+    import_cmd.add_argument("--warm-redis", action="store_true", help="cache imported active links in Redis")
+
+    warm_cmd = commands.add_parser("warm", help="load the most-clicked links into Redis")
+    warm_cmd.add_argument("--limit", type=int, default=settings.warmup_limit, help="number of links to load")
+    warm_cmd.add_argument("--time-budget", type=float, default=settings.warmup_time_budget, help="seconds before giving up")
+    warm_cmd.add_argument("--concurrency", type=int, default=settings.warmup_concurrency, help="pipelined writes in flight")
+    warm_cmd.add_argument("--chunk-size", type=int, default=settings.warmup_chunk_size, help="rows per cursor fetch")
+
+    compact_cmd = commands.add_parser("compact-keys", help="encode key_id / secret_token for rows that lack them")
+    compact_cmd.add_argument("--batch-size", type=int, default=5000, help="rows updated per transaction")
+    compact_cmd.add_argument(
+        "--replace-string-indexes", action="store_true",
+        help="replace the key and secret_key indexes with partial ones (requires KEY_STORAGE=compact)",
+    )
+    compact_cmd.add_argument("--shard", type=int, default=0, help="shard to encode (0 = DATABASE_URL)")
+
+    commands.add_parser("shards", help="show the shard map and links per shard")
+
+    rebalance_cmd = commands.add_parser("rebalance", help="move buckets of keys to another shard while the app is running")
+    rebalance_cmd.add_argument("--buckets", required=True, help=f"buckets to move, e.g. 0-1023,2048 (0-{NUM_BUCKETS - 1})")
+    rebalance_cmd.add_argument("--to", type=int, required=True, help="destination shard (0 = DATABASE_URL)")
+    rebalance_cmd.add_argument("--batch-size", type=int, default=500, help="rows moved per transaction")
+    rebalance_cmd.add_argument(
+        "--settle", type=float, default=2 * settings.shard_map_refresh_interval,
+        help="seconds to wait for workers to reload the shard map before moving rows",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_urls(args.path, detect_format(args.path, args.format), args.active_only, args.shard)
+    elif args.command == "import":
+        import_urls(args.path, detect_format(args.path, args.format), args.chunk_size, args.warm_redis)
+    elif args.command == "warm":
+        warm_cache(args.limit, args.time_budget, args.concurrency, args.chunk_size)
+    elif args.command == "compact-keys":
+        compact_keys(args.batch_size, args.replace_string_indexes, args.shard)
+    elif args.command == "shards":
+        show_shards()
+    elif args.command == "rebalance":
+        rebalance_command(args.buckets, args.to, args.batch_size, args.settle)
+
+
+if __name__ == "__main__":
+    main()
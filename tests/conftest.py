@@ -1,20 +1,27 @@
 import pytest
-from unittest.mock import AsyncMock
+import pytest_asyncio
+from unittest.mock import AsyncMock, MagicMock
 from collections import defaultdict
+from contextlib import nullcontext
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, computed_field
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from alembic import command
 from alembic.config import Config
 
 from redis.asyncio import Redis
 
 from app.main import app
+from app.api.v1.fast_redirect import fast_redirect
 from app.database import get_db, get_redis
-from app.core.config import get_settings
+from app.database.clicks import click_buffer
+from app.database.key_filter import key_filter
+from app.database.local_cache import invalidation_listener
+from app.database.visitors import visitor_counter
+from app.core.config import get_settings, to_async_url
 
 class TestSettings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -44,6 +51,22 @@ def override_get_settings(test_settings):
     yield
     app.dependency_overrides.pop(get_settings, None)
 
+class MockPipeline:
+    # Queues commands and replays them against the mocked client on execute().
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return [await getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
 @pytest.fixture(scope="session")
 def mocked_redis():
     storage = defaultdict(lambda: None)
@@ -52,20 +75,42 @@ def mocked_redis():
     mock_redis.get = AsyncMock()
     mock_redis.set = AsyncMock()
     mock_redis.delete = AsyncMock()
+    mock_redis.publish = AsyncMock(return_value=0)
+    mock_redis.pipeline = MagicMock(side_effect=lambda transaction=True: MockPipeline(mock_redis))
 
     mock_redis.get.side_effect = lambda key: storage.get(key)
     mock_redis.set.side_effect = lambda key, val, ex=3600*24: storage.update({key: val}) or True
     mock_redis.delete.side_effect = lambda key: storage.pop(key, None) is not None
     
+    # HyperLogLog sketches, counted exactly.
+    sketches = defaultdict(set)
+
+    def pfadd(key, *values):
+        added = not set(values) <= sketches[key]
+        sketches[key].update(values)
+        return int(added)
+
+    mock_redis.pfadd = AsyncMock(side_effect=pfadd)
+    mock_redis.pfcount = AsyncMock(side_effect=lambda *keys: len(set().union(*(sketches.get(key, set()) for key in keys))))
+    mock_redis.expireat = AsyncMock(return_value=True)
+
     mock_redis.ping = AsyncMock()
+    mock_redis.pttl = AsyncMock(return_value=3600 * 1000)
+    mock_redis.expire = AsyncMock(return_value=True)
+    # Token bucket rate limits: always allowed unless a test says otherwise.
+    mock_redis.evalsha = AsyncMock(return_value=[1, "0"])
     return mock_redis
 
 @pytest.fixture(autouse=True, scope="function")
-def mock_get_redis(mocked_redis):
+def mock_get_redis(mocked_redis, monkeypatch):
     async def _get_mock_redis():
         return mocked_redis
     
     app.dependency_overrides[get_redis] = _get_mock_redis
+    # The per-worker components share one client; keep them off the network too, so
+    # connection failures cannot open the Redis circuit breaker during tests.
+    for component in (click_buffer, key_filter, invalidation_listener, fast_redirect, visitor_counter):
+        monkeypatch.setattr(component, "redis", mocked_redis)
     yield
     app.dependency_overrides.pop(get_redis, None)    
 
@@ -76,27 +121,35 @@ def setup_test_db(test_settings):
     alembic_cfg = Config("alembic.ini")
     alembic_cfg.set_main_option("sqlalchemy.url", settings.sqlalchemy_database_url)
     
-    # Use the connection injection pattern to ensure migrations hit the test DB
-    with engine.begin() as conn:
+    # Use the connection injection pattern to ensure migrations hit the test DB.
+    # Alembic manages the transactions itself, since some migrations commit in batches.
+    with engine.connect() as conn:
         alembic_cfg.attributes["connection"] = conn
         command.upgrade(alembic_cfg, "head")
+        conn.commit()
     
     yield engine
     engine.dispose()
 
-@pytest.fixture(scope="function")
-def db_session(setup_test_db):
-    connection = setup_test_db.connect()
-    transaction = connection.begin()
-    
-    Session = sessionmaker(bind=connection, autoflush=False, autocommit=False)
-    session = Session()
+@pytest_asyncio.fixture(scope="function")
+async def db_session(setup_test_db, test_settings):
+    # The async engine is created per test so its connections belong to the test's event loop.
+    engine = create_async_engine(to_async_url(test_settings.sqlalchemy_database_url))
+    connection = await engine.connect()
+    transaction = await connection.begin()
+
+    session = AsyncSession(bind=connection, autoflush=False, expire_on_commit=False)
 
     app.dependency_overrides[get_db] = lambda: session
+    # The redirect fast path opens its own sessions on cache misses.
+    session_factory = fast_redirect.session_factory
+    fast_redirect.session_factory = lambda: nullcontext(session)
 
     yield session
 
-    session.close()
-    transaction.rollback()
-    connection.close()
+    await session.close()
+    await transaction.rollback()
+    await connection.close()
+    await engine.dispose()
     app.dependency_overrides.pop(get_db, None)
+    fast_redirect.session_factory = session_factory
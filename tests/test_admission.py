@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from app.api.v1.admission import ADMIN, CREATE, REDIRECT, AdmissionControlMiddleware, ConcurrencyLimit, route_class
+
+
+def test_route_classes():
+    assert route_class("GET", "/ABC12") == REDIRECT
+    assert route_class("POST", "/url") == CREATE
+    assert route_class("POST", "/urls/batch") == CREATE
+    assert route_class("DELETE", "/admin/ABC12_XYZ") == ADMIN
+    assert route_class("GET", "/readyz") is None
+    assert route_class("GET", "/metrics") is None
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_queues_then_sheds():
+    limit = ConcurrencyLimit("test", limit=1, max_queue=1, max_queue_time=0.05)
+    assert await limit.acquire() is None
+    waiting = asyncio.ensure_future(limit.acquire())
+    await asyncio.sleep(0)
+    # The queue is full: the next request is shed without waiting.
+    assert await limit.acquire() == "queue_full"
+    # The slot is handed over to the waiting request.
+    limit.release()
+    assert await waiting is None
+    assert limit.active == 1
+    # Nobody releases it this time: the request is shed after the queue time.
+    assert await limit.acquire() == "queue_timeout"
+    assert limit.queued == 0
+    limit.release()
+    assert limit.active == 0
+
+@pytest.mark.asyncio
+async def test_middleware_sheds_with_retry_after():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+
+    limits = {name: ConcurrencyLimit(name, 1, 0, 0.05) for name in (REDIRECT, CREATE, ADMIN)}
+    middleware = AdmissionControlMiddleware(app, limits)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/url"}
+    await middleware(scope, None, send)
+    assert calls == ["/url"] and limits[CREATE].active == 0
+
+    # Link creation is shed while redirects are waiting for a slot.
+    limits[REDIRECT]._waiters.append(asyncio.get_running_loop().create_future())
+    await middleware(scope, None, send)
+    assert calls == ["/url"]
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"1") in sent[0]["headers"]
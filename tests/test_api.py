@@ -2,9 +2,11 @@ import pytest
 from httpx import AsyncClient, ASGITransport
 from fastapi import status
 from unittest.mock import AsyncMock
+from sqlalchemy import select
 
 from app import models
 from app.main import app
+from app.core.config import get_settings
 
 
 @pytest.mark.asyncio
@@ -15,6 +17,29 @@ async def test_health_check(test_settings):
         assert response.status_code == status.HTTP_200_OK
         assert response.json() == {"status": "db healthy"}
 
+@pytest.mark.asyncio
+async def test_liveness_and_readiness(test_settings, monkeypatch):
+    from app.database.warmup import cache_warmer
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        # The checker is not running in tests, so the worker counts as alive.
+        response = await client.get("/livez")
+        assert response.status_code == status.HTTP_200_OK
+
+        monkeypatch.setattr(cache_warmer, "state", "running")
+        response = await client.get("/readyz")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["reasons"] == ["cache warm-up running"]
+
+        monkeypatch.setattr(cache_warmer, "state", "done")
+        response = await client.get("/readyz")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        # Redis is optional: without it the worker is degraded but still ready.
+        assert data["status"] in ("ready", "degraded")
+        assert data["databases"]["primary"]["ok"] is True
+        assert set(data["databases"]["primary"]["pool"]) == {"size", "checked_out", "overflow"}
+        assert "latency_ms" in data["redis"] and "event_loop_lag_ms" in data
+
 # @pytest.mark.asyncio
 # async def test_health_check_db_failure(override_settings, override_db):
 #     pass
@@ -37,11 +62,16 @@ async def test_create_short_url(test_settings, db_session, mocked_redis: AsyncMo
         url_key = data["url"]
 
         # DB check
-        db_row: models.URL = db_session.query(models.URL).filter(models.URL.key == url_key, models.URL.is_active).first()
+        result = await db_session.execute(select(models.URL).where(models.URL.key == url_key, models.URL.is_active))
+        db_row: models.URL = result.scalars().first()
         assert db_row.target_url == payload["target_url"]
         
         # Cache check
-        mocked_redis.set.assert_awaited_with(url_key, payload["target_url"], ex=3600*24)
+        # New links are cached with the (jittered) TTL for links without clicks.
+        args, kwargs = mocked_redis.set.await_args
+        assert args == (url_key, payload["target_url"])
+        new_ttl = get_settings().cache_new_ttl
+        assert new_ttl * 0.9 <= kwargs["ex"] <= new_ttl * 1.1
         cached = await mocked_redis.get(url_key)
         assert cached == payload["target_url"]
 
@@ -55,4 +85,620 @@ async def test_forward_to_target_url(test_settings, db_session, mocked_redis):
 
         response = await client.get(f"/{url_key}", follow_redirects=False)
         assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
-        assert response.headers["location"] == "https://example.com"
\ No newline at end of file
+        assert response.headers["location"] == "https://example.com"
+@pytest.mark.asyncio
+async def test_redirect_clicks_are_buffered(test_settings, db_session, mocked_redis):
+    from app.database.clicks import click_buffer
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        response = await client.post("/url", json={"target_url": "https://example.com/clicks"})
+        data = response.json()
+        url_key, secret_key = data["url"], data["admin_url"]
+
+        for _ in range(2):
+            await client.get(f"/{url_key}", follow_redirects=False)
+
+        # Cache hits do not write to the database; the clicks are reported as pending.
+        info = (await client.get(f"/admin/{secret_key}")).json()
+        assert info["clicks"] == 0
+        assert info["pending_clicks"] == 2
+
+        await click_buffer.flush(db_session)
+        info = (await client.get(f"/admin/{secret_key}")).json()
+        assert info["clicks"] == 2
+        assert info["pending_clicks"] == 0
+
+@pytest.mark.asyncio
+async def test_delete_url_evicts_cache(test_settings, db_session, mocked_redis):
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        response = await client.post("/url", json={"target_url": "https://example.com/deleted"})
+        data = response.json()
+
+        response = await client.delete(f"/admin/{data['admin_url']}")
+        assert response.status_code == status.HTTP_200_OK
+        assert await mocked_redis.get(data["url"]) is None
+
+        response = await client.get(f"/{data['url']}", follow_redirects=False)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.asyncio
+async def test_local_cache_serves_repeat_redirects(test_settings, db_session, mocked_redis):
+    from app.database.local_cache import local_cache
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        data = (await client.post("/url", json={"target_url": "https://example.com/l1"})).json()
+
+        await client.get(f"/{data['url']}", follow_redirects=False)
+        redis_gets = mocked_redis.get.await_count
+        response = await client.get(f"/{data['url']}", follow_redirects=False)
+        assert response.headers["location"] == "https://example.com/l1"
+        # The second redirect is answered from the in-process cache without a Redis round trip.
+        assert mocked_redis.get.await_count == redis_gets
+
+        await client.delete(f"/admin/{data['admin_url']}")
+        assert local_cache.get(data["url"]) is None
+        mocked_redis.publish.assert_awaited_with("cache:invalidate", data["url"])
+
+@pytest.mark.asyncio
+async def test_key_filter_rejects_unknown_keys(test_settings, db_session, mocked_redis, monkeypatch):
+    from app.core.bloom import BloomFilter
+    from app.database.key_filter import key_filter
+    from app.database.local_cache import invalidation_listener
+
+    monkeypatch.setattr(key_filter, "bloom", BloomFilter(1000, 0.001))
+    monkeypatch.setattr(key_filter, "ready", True)
+    monkeypatch.setattr(invalidation_listener, "subscribed", True)
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        data = (await client.post("/url", json={"target_url": "https://example.com/filter"})).json()
+
+        redis_gets = mocked_redis.get.await_count
+        response = await client.get("/NOPE0", follow_redirects=False)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        # Rejected before the Redis lookup.
+        assert mocked_redis.get.await_count == redis_gets
+
+        # Keys issued through create_db_url pass the filter.
+        response = await client.get(f"/{data['url']}", follow_redirects=False)
+        assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+
+@pytest.mark.asyncio
+async def test_create_urls_batch(test_settings, db_session, mocked_redis):
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        payload = {"urls": [
+            {"target_url": "https://example.com/batch/1"},
+            {"target_url": "not-a-url"},
+            {"target_url": "https://example.com/batch/2"},
+        ]}
+        response = await client.post("/urls/batch", json=payload)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["created"] == 2
+        assert data["failed"] == 1
+        assert [item["index"] for item in data["items"]] == [0, 1, 2]
+        assert data["items"][1]["error"]
+
+        for item in (data["items"][0], data["items"][2]):
+            url_key = item["url"]["url"]
+            assert await mocked_redis.get(url_key) == item["url"]["target_url"]
+            response = await client.get(f"/{url_key}", follow_redirects=False)
+            assert response.headers["location"] == item["url"]["target_url"]
+
+@pytest.mark.asyncio
+async def test_create_urls_batch_enforces_size_limit(test_settings, db_session, monkeypatch):
+    from app.api.v1.endpoints import urls
+
+    monkeypatch.setattr(urls.settings, "batch_max_size", 2)
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        payload = {"urls": [{"target_url": f"https://example.com/{i}"} for i in range(3)]}
+        response = await client.post("/urls/batch", json=payload)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.asyncio
+async def test_create_rate_limit(test_settings, db_session, mocked_redis, monkeypatch):
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        response = await client.post("/url", json={"target_url": "https://example.com"})
+        assert response.status_code == status.HTTP_200_OK
+        # Each URL of a batch costs one token from the client's bucket.
+        response = await client.post("/urls/batch", json={"urls": [{"target_url": "https://example.com/a"}] * 3})
+        assert response.status_code == status.HTTP_200_OK
+        assert [call.args[3:] for call in mocked_redis.evalsha.await_args_list[-2:]] == [(10.0, 1000, 1), (10.0, 1000, 3)]
+
+        # The bucket is empty: the script reports when the tokens will be there.
+        monkeypatch.setattr(mocked_redis.evalsha, "return_value", [0, "2.5"])
+        response = await client.post("/url", json={"target_url": "https://example.com"})
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.headers["retry-after"] == "3"
+
+@pytest.mark.asyncio
+async def test_create_rate_limit_behind_trusted_proxy(test_settings, db_session, mocked_redis):
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+    # As added by app.main when TRUSTED_PROXIES is set.
+    proxied = ProxyHeadersMiddleware(app, trusted_hosts="10.0.0.1")
+    for peer, bucket in (("10.0.0.1", "ratelimit:create:203.0.113.7"), ("198.51.100.2", "ratelimit:create:198.51.100.2")):
+        transport = ASGITransport(app=proxied, client=(peer, 4000))
+        async with AsyncClient(base_url=test_settings.base_url, transport=transport) as client:
+            # Only a trusted proxy may set the client address.
+            response = await client.post("/url", json={"target_url": "https://example.com"}, headers={"x-forwarded-for": "203.0.113.7"})
+            assert response.status_code == status.HTTP_200_OK
+            assert mocked_redis.evalsha.await_args.args[2] == bucket
+
+@pytest.mark.asyncio
+async def test_dedup_returns_existing_link(test_settings, db_session, mocked_redis, monkeypatch):
+    from app.database import crud
+
+    monkeypatch.setattr(crud.settings, "dedup_target_urls", True)
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        first = (await client.post("/url", json={"target_url": "https://Example.com/dedup"})).json()
+        # Same target after normalization (host case, default port).
+        second = (await client.post("/url", json={"target_url": "https://example.com:443/dedup"})).json()
+        assert second["url"] == first["url"]
+
+        batch = (await client.post("/urls/batch", json={"urls": [
+            {"target_url": "https://example.com/dedup"},
+            {"target_url": "https://example.com/dedup-new"},
+            {"target_url": "https://EXAMPLE.com/dedup-new"},
+        ]})).json()
+        keys = [item["url"]["url"] for item in batch["items"]]
+        assert keys[0] == first["url"]
+        assert keys[1] == keys[2] != first["url"]
+
+        # A deactivated link is not reused.
+        await client.delete(f"/admin/{first['admin_url']}")
+        third = (await client.post("/url", json={"target_url": "https://example.com/dedup"})).json()
+        assert third["url"] != first["url"]
+
+        # Two requests for a new target race past the lookup: the unique index on shared
+        # targets lets one insert win, and the other returns its link.
+        lookup = crud.get_active_db_urls_by_target
+        missed = []
+
+        async def racing_lookup(db, target_urls):
+            if not missed:
+                missed.append(target_urls)
+                return {}
+            return await lookup(db, target_urls)
+
+        monkeypatch.setattr(crud, "get_active_db_urls_by_target", racing_lookup)
+        raced = (await client.post("/url", json={"target_url": "https://example.com/dedup"})).json()
+        assert missed and raced["url"] == third["url"]
+        missed.clear()
+        batch = (await client.post("/urls/batch", json={"urls": [{"target_url": "https://example.com/dedup"}]})).json()
+        assert missed and batch["items"][0]["url"]["url"] == third["url"]
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(test_settings, db_session, mocked_redis):
+    from app.core import metrics
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        response = await client.post("/url", json={"target_url": "https://example.com/metrics"})
+        url_key = response.json()["url"]
+        l1_hits = metrics.REDIRECT_L1_HIT.value
+        # The first redirect fills the in-process cache, the second is served from it.
+        for _ in range(2):
+            await client.get(f"/{url_key}", follow_redirects=False)
+        assert metrics.REDIRECT_L1_HIT.value == l1_hits + 1
+
+        response = await client.get("/metrics")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        # Requests are labelled by route template, not by the requested key.
+        assert 'http_request_duration_seconds_count{route="/{url_key}",method="GET"}' in body
+        assert f'route="/{url_key}"' not in body
+        assert 'redirect_cache_total{outcome="l1_hit"}' in body
+        assert "db_query_duration_seconds_count" in body
+        assert "db_pool_checked_out" in body
+
+@pytest.mark.asyncio
+async def test_open_breaker_skips_redis(test_settings, db_session, mocked_redis):
+    from app.core.circuit_breaker import OPEN
+    from app.database.caching import redis_breaker
+    from app.database.local_cache import local_cache
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        url_key = (await client.post("/url", json={"target_url": "https://example.com/breaker"})).json()["url"]
+        local_cache.clear()
+        mocked_redis.get.reset_mock()
+        redis_breaker._transition(OPEN)
+        try:
+            response = await client.get(f"/{url_key}", follow_redirects=False)
+            assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+            mocked_redis.get.assert_not_awaited()
+            health = (await client.get("/health/cache")).json()
+            assert health["redis"]["state"] == "open"
+        finally:
+            redis_breaker._transition("closed")
+
+@pytest.mark.asyncio
+async def test_cache_warmup_loads_most_clicked_links(test_settings, db_session, mocked_redis, monkeypatch):
+    from contextlib import asynccontextmanager
+    from app.database import warmup
+    from app.database.local_cache import LocalCache
+
+    db_session.add_all([
+        models.URL(key="WARM1", secret_key="WARM1_s", target_url="https://example.com/hot", clicks=500),
+        models.URL(key="WARM2", secret_key="WARM2_s", target_url="https://example.com/warm", clicks=50),
+        models.URL(key="WARM3", secret_key="WARM3_s", target_url="https://example.com/cold", clicks=0, is_active=False),
+    ])
+    await db_session.commit()
+
+    # Redis commands of the lease and the hot list.
+    lists = {}
+    set_value, delete_value = mocked_redis.set.side_effect, mocked_redis.delete.side_effect
+
+    async def set_(key, value, ex=None, nx=False):
+        if nx and await mocked_redis.get(key) is not None:
+            return None
+        return set_value(key, value, ex=ex)
+
+    monkeypatch.setattr(mocked_redis, "set", AsyncMock(side_effect=set_))
+    monkeypatch.setattr(mocked_redis, "delete", AsyncMock(side_effect=lambda key: lists.pop(key, None) is not None or delete_value(key)))
+    monkeypatch.setattr(mocked_redis, "rpush", AsyncMock(side_effect=lambda key, *values: len(lists.setdefault(key, []).extend(values) or lists[key])), raising=False)
+    monkeypatch.setattr(mocked_redis, "lrange", AsyncMock(side_effect=lambda key, start, stop: lists.get(key, [])[start:stop + 1]), raising=False)
+    monkeypatch.setattr(mocked_redis, "mget", AsyncMock(side_effect=lambda keys: [mocked_redis.get.side_effect(key) for key in keys]), raising=False)
+
+    warmer = warmup.CacheWarmer(mocked_redis, LocalCache(max_entries=1, max_bytes=1 << 20, ttl=30), chunk_size=1)
+    # The warmer opens its own session; hand it the test session instead.
+    monkeypatch.setattr(warmup.shard_router.default, "session_factory", asynccontextmanager(lambda: _yield(db_session)))
+    await mocked_redis.delete(warmup.WARMUP_LEASE)
+    stats = await warmer.run(limit=10, time_budget=5, concurrency=2)
+
+    assert stats["state"] == warmup.DONE and stats["loaded"] == 2
+    assert await mocked_redis.get("WARM1") == "https://example.com/hot"
+    assert await mocked_redis.get("WARM3") is None
+    # Only the hottest link fits into the L1 cache.
+    assert warmer.cache.get("WARM1") and warmer.cache.get("WARM2") is None
+
+    # A failing replica is taken out of rotation and the primary is read instead.
+    from sqlalchemy.exc import DBAPIError
+
+    class FailingReplicaSession:
+        async def stream(self, stmt):
+            if stmt.get_execution_options().get("replica") is not None:
+                raise DBAPIError("SELECT", {}, Exception("replica down"))
+            return await db_session.stream(stmt)
+
+    marked_down = []
+    monkeypatch.setattr(warmup.replica_router, "pick", lambda *identifiers: "replica-0")
+    monkeypatch.setattr(warmup.replica_router, "mark_down", lambda replica, error: marked_down.append(replica))
+    monkeypatch.setattr(warmup.shard_router.default, "session_factory", asynccontextmanager(lambda: _yield(FailingReplicaSession())))
+    await mocked_redis.delete(warmup.WARMUP_LEASE)
+    stats = await warmer.run(limit=10, time_budget=5, concurrency=2)
+    assert stats["state"] == warmup.DONE and stats["loaded"] == 2
+    assert marked_down == ["replica-0"]
+
+    # While the lease is held, other workers fill L1 from Redis without querying the database.
+    monkeypatch.setattr(warmup.shard_router.default, "session_factory", lambda: pytest.fail("the database was read"))
+    follower = warmup.CacheWarmer(mocked_redis, LocalCache(max_entries=10, max_bytes=1 << 20, ttl=30), chunk_size=1)
+    stats = await follower.run(limit=10, time_budget=5, concurrency=2)
+    # The hot list holds as many links as the leader's L1 cache.
+    assert stats["state"] == warmup.DONE and stats["loaded"] == 1
+    assert follower.cache.get("WARM1") == "https://example.com/hot" and follower.cache.get("WARM2") is None
+
+    # Chunks that could not be written to Redis are not counted as loaded.
+    monkeypatch.setattr(warmup.shard_router.default, "session_factory", asynccontextmanager(lambda: _yield(db_session)))
+    monkeypatch.setattr(warmup, "safe_redis_set_many", AsyncMock(return_value=False))
+    await mocked_redis.delete(warmup.WARMUP_LEASE)
+    stats = await warmer.run(limit=10, time_budget=5, concurrency=2)
+    assert stats["state"] == warmup.DONE and stats["loaded"] == 0
+    await mocked_redis.delete(warmup.WARMUP_LEASE)
+    await mocked_redis.delete(warmup.HOT_KEYS)
+
+@pytest.mark.asyncio
+async def test_fast_redirect_matches_route(test_settings, db_session, mocked_redis, monkeypatch):
+    from app.api.v1.fast_redirect import fast_redirect
+    from app.database import get_db
+    from app.database.local_cache import local_cache
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        url_key = (await client.post("/url", json={"target_url": "https://example.com/fäst?q=a|b&r=1"})).json()["url"]
+
+        responses = {}
+        for enabled in (True, False):
+            monkeypatch.setattr(fast_redirect, "enabled", enabled)
+            local_cache.clear()
+            hit = await client.get(f"/{url_key}", follow_redirects=False)
+            missing = await client.get("/NOPE9", follow_redirects=False)
+            responses[enabled] = (hit.status_code, hit.headers["location"], missing.status_code, missing.json())
+        assert responses[True] == responses[False]
+        assert responses[True][:3] == (307, "https://example.com/f%C3%A4st?q=a%7Cb&r=1", 404)
+
+        # Cache hits on the fast path never reach the route or open a DB session.
+        monkeypatch.setattr(fast_redirect, "enabled", True)
+        monkeypatch.setitem(app.dependency_overrides, get_db, lambda: pytest.fail("the route was used"))
+        response = await client.get(f"/{url_key}", follow_redirects=False)
+        assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+        # Paths that are not keys still go to the router.
+        assert (await client.get("/metrics")).status_code == status.HTTP_200_OK
+
+@pytest.mark.asyncio
+async def test_expiring_links(test_settings, db_session, mocked_redis, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from app.database import expiry
+    from app.database.expiry import ExpirySweeper
+
+    now = datetime.now(timezone.utc)
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        response = await client.post("/url", json={"target_url": "https://example.com/old", "expires_at": (now - timedelta(minutes=1)).isoformat()})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        # The Redis entry never outlives the link and carries its expiry.
+        mocked_redis.set.reset_mock()
+        response = await client.post("/url", json={"target_url": "https://example.com/soon", "expires_at": (now + timedelta(minutes=10)).isoformat()})
+        url_key = response.json()["url"]
+        args, kwargs = mocked_redis.set.call_args
+        assert 590 <= kwargs["ex"] <= 600
+        assert args[1].endswith("|https://example.com/soon")
+        response = await client.get(f"/{url_key}", follow_redirects=False)
+        assert response.headers["location"] == "https://example.com/soon"
+
+        # Expired rows stop redirecting before the sweeper gets to them, without another query.
+        db_session.add(models.URL(key="EXPD1", secret_key="EXPD1_s", target_url="https://example.com/gone", expires_at=now - timedelta(seconds=1)))
+        await db_session.commit()
+        response = await client.get("/EXPD1", follow_redirects=False)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        purged = []
+        monkeypatch.setattr(expiry.edge_purger, "purge", lambda *keys: purged.extend(keys))
+        sweeper = ExpirySweeper(mocked_redis, interval=60, batch_size=1, max_batches=10)
+        assert await sweeper.sweep(db_session) == 1
+        assert purged == ["EXPD1"]
+        db_url = (await db_session.execute(select(models.URL).where(models.URL.key == "EXPD1"))).scalar_one()
+        await db_session.refresh(db_url)
+        assert db_url.is_active is False
+        mocked_redis.publish.assert_awaited_with("cache:invalidate", "EXPD1")
+
+@pytest.mark.asyncio
+async def test_click_limited_links(test_settings, db_session, mocked_redis):
+    from app.database.expiry import ExpirySweeper
+
+    base_url = test_settings.base_url
+    async with AsyncClient(base_url=base_url, transport=ASGITransport(app=app)) as client:
+        data = (await client.post("/url", json={"target_url": "https://example.com/twice", "max_clicks": 2})).json()
+        assert data["max_clicks"] == 2
+        # Never cached, so every redirect is counted against the limit.
+        assert await mocked_redis.get(data["url"]) is None
+
+        codes = [(await client.get(f"/{data['url']}", follow_redirects=False)).status_code for _ in range(3)]
+        assert codes == [307, 307, 404]
+
+        sweeper = ExpirySweeper(mocked_redis, interval=60, batch_size=100, max_batches=1)
+        assert await sweeper.sweep(db_session) == 1
+        assert await sweeper.sweep(db_session) == 0
+        info = (await client.get(f"/admin/{data['admin_url']}")).json()
+        assert info["clicks"] == 2 and info["is_active"] is False
+
+@pytest.mark.asyncio
+async def test_archiving_moves_inactive_links_out_of_urls(test_settings, db_session, mocked_redis):
+    from datetime import datetime, timedelta, timezone
+    from app.database import crud
+    from app.database.archive import Archiver
+
+    long_ago = datetime.now(timezone.utc) - timedelta(days=60)
+    db_session.add_all([
+        models.URL(key="ARCH1", secret_key="ARCH1_s", target_url="https://example.com/old", is_active=False, deactivated_at=long_ago),
+        models.URL(key="ARCH2", secret_key="ARCH2_s", target_url="https://example.com/recent", is_active=False, deactivated_at=datetime.now(timezone.utc)),
+        models.URL(key="ARCH3", secret_key="ARCH3_s", target_url="https://example.com/idle", created_at=long_ago),
+    ])
+    await db_session.commit()
+
+    archiver = Archiver(mocked_redis, interval=60, batch_size=2, batch_pause=0, inactive_after=30 * 86400, idle_after=0)
+    assert await archiver.archive_pass(db_session) == 1
+    # With an idle limit, unused active links are archived too and evicted from the caches.
+    archiver.idle_after = 30 * 86400
+    assert await archiver.archive_pass(db_session) == 1
+    mocked_redis.publish.assert_awaited_with("cache:invalidate", "ARCH3")
+
+    remaining = (await db_session.execute(select(models.URL.key).where(models.URL.key.like("ARCH%")))).scalars().all()
+    assert remaining == ["ARCH2"]
+    # Archived keys are still taken, and admin lookups still find the links.
+    assert await crud.get_existing_keys(db_session, ["ARCH1", "ARCH3", "FREE1"]) == {"ARCH1", "ARCH3"}
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        info = (await client.get("/admin/ARCH3_s")).json()
+        assert info["target_url"] == "https://example.com/idle" and info["is_active"] is False
+        assert (await client.get("/ARCH3", follow_redirects=False)).status_code == status.HTTP_404_NOT_FOUND
+
+    # Clicks buffered before the link was archived are added to the archived row.
+    from app.database.clicks import CLICKS_DROPPED, click_buffer
+
+    # Clicks left over by earlier tests go first.
+    await click_buffer.flush(db_session)
+    dropped = CLICKS_DROPPED.labels().value
+    await click_buffer.record("ARCH3", 2)
+    await click_buffer.record("GONE1", 1)
+    await click_buffer.flush(db_session)
+    archived = (await db_session.execute(select(models.ArchivedURL.clicks).where(models.ArchivedURL.key == "ARCH3"))).scalar_one()
+    assert archived == 2
+    assert CLICKS_DROPPED.labels().value == dropped + 1
+
+@pytest.mark.asyncio
+async def test_archiver_runs_on_one_worker_per_interval():
+    from unittest.mock import AsyncMock
+    from app.database.archive import Archiver
+
+    leases = {}
+    client = AsyncMock()
+    client.set.side_effect = lambda key, value, nx, ex: leases.setdefault(key, value) == value
+    workers = [Archiver(client, interval=60, batch_size=10, batch_pause=0, inactive_after=0, idle_after=0) for _ in range(3)]
+    tokens = [await worker._take_lease() for worker in workers]
+    assert len([token for token in tokens if token]) == 1
+
+async def _yield(value):
+    yield value
+
+@pytest.mark.asyncio
+async def test_compact_key_storage(test_settings, db_session, mocked_redis, monkeypatch):
+    from app.core.key_codec import key_to_id
+    from app.database import crud
+    from app.database.clicks import click_buffer
+
+    monkeypatch.setattr(crud.settings, "key_storage", "compact")
+    # A row written by an older version, without compact columns.
+    db_session.add(models.URL(key="old-key", secret_key="legacy-secret", target_url="https://example.com/legacy"))
+    await db_session.commit()
+
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        created = (await client.post("/url", json={"target_url": "https://example.com/compact"})).json()
+        key = created["url"].rsplit("/", 1)[-1]
+        db_url = (await db_session.execute(select(models.URL).where(models.URL.key == key))).scalar_one()
+        assert db_url.key_id == key_to_id(key) and len(db_url.secret_token) == 6
+
+        await db_session.execute(models.URL.__table__.update().where(models.URL.key == key).values(key="RENAMED"))
+        await db_session.commit()
+        # Lookups go through key_id, not the key string.
+        assert await crud.get_existing_keys(db_session, [key, "FREE1"]) == {key}
+        assert (await crud.get_db_url_by_key(db_session, key)).target_url == "https://example.com/compact"
+        info = (await client.get(f"/admin/{created['admin_url'].rsplit('/', 1)[-1]}")).json()
+        assert info["target_url"] == "https://example.com/compact"
+
+        await click_buffer.record(key)
+        await click_buffer.flush(db_session)
+        await db_session.refresh(db_url)
+        assert db_url.clicks == 1
+
+        # Rows without a compact form are still found through the string columns.
+        assert (await crud.get_db_url_by_key(db_session, "old-key")).target_url == "https://example.com/legacy"
+        assert (await client.get("/admin/legacy-secret")).status_code == status.HTTP_200_OK
+
+@pytest.mark.asyncio
+async def test_unique_visitors(test_settings, db_session, mocked_redis, monkeypatch):
+    from datetime import date, timedelta
+    from app.api.v1.fast_redirect import fast_redirect
+
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        created = (await client.post("/url", json={"target_url": "https://example.com/visitors"})).json()
+        key = created["url"].rsplit("/", 1)[-1]
+        admin = f"/admin/{created['admin_url'].rsplit('/', 1)[-1]}"
+        # Repeat visits count once; both redirect paths record visitors.
+        for enabled in (True, False):
+            monkeypatch.setattr(fast_redirect, "enabled", enabled)
+            for agent in ("browser-a", "browser-a", "browser-b"):
+                await client.get(f"/{key}", headers={"User-Agent": agent}, follow_redirects=False)
+
+        info = (await client.get(admin)).json()
+        assert info["unique_visitors"] == 2
+        assert info["clicks"] + info["pending_clicks"] == 6
+        two_days_ago = (date.today() - timedelta(days=2)).isoformat()
+        assert (await client.get(admin, params={"visitors_until": two_days_ago})).json()["unique_visitors"] == 0
+
+    # Counting writes the pending visitors of that key only; a full buffer drops and counts new ones.
+    from app.database import visitors
+    from app.database.visitors import VISITORS_DROPPED, visitor_counter
+
+    scope = {"client": ("203.0.113.9", 4000), "headers": [(b"user-agent", b"browser-c")]}
+    visitor_counter.record(key, scope)
+    visitor_counter.record("OTHER", scope)
+    assert await visitor_counter.count(key) == 3
+    assert "OTHER" in visitor_counter._pending and key not in visitor_counter._pending
+    dropped = VISITORS_DROPPED.labels().value
+    monkeypatch.setattr(visitors, "MAX_PENDING", visitor_counter._pending_count)
+    visitor_counter.record("OTHER", {**scope, "headers": [(b"user-agent", b"browser-d")]})
+    assert VISITORS_DROPPED.labels().value == dropped + 1
+    await visitor_counter.flush()
+
+@pytest.mark.asyncio
+async def test_redirect_cache_policy(test_settings, db_session, mocked_redis, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from app.api.v1.fast_redirect import fast_redirect
+    from app.database.local_cache import local_cache
+
+    async def redirect(url_key):
+        response = await client.get(f"/{url_key}", follow_redirects=False)
+        return response.status_code, response.headers["cache-control"]
+
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        assert (await client.post("/url", json={"target_url": "https://example.com", "redirect_code": 303})).status_code == 400
+        default = (await client.post("/url", json={"target_url": "https://example.com/default"})).json()["url"]
+        cached = (await client.post("/url", json={"target_url": "https://example.com/cdn", "redirect_code": 301, "max_age": 60, "s_maxage": 3600})).json()
+        assert cached["redirect_code"] == 301
+        # The policy travels with the cache entry.
+        assert (await mocked_redis.get(cached["url"])).startswith("0|,301,60,3600|")
+        limited = (await client.post("/url", json={"target_url": "https://example.com/once", "redirect_code": 308, "s_maxage": 3600, "max_clicks": 5})).json()["url"]
+        soon = (await client.post("/url", json={
+            "target_url": "https://example.com/soon", "max_age": 3600, "expires_at": (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat(),
+        })).json()["url"]
+
+        for enabled in (True, False):
+            monkeypatch.setattr(fast_redirect, "enabled", enabled)
+            for l1 in (False, True):
+                if not l1:
+                    local_cache.clear()
+                assert await redirect(default) == (307, "no-store")
+                assert await redirect(cached["url"]) == (301, "public, max-age=60, s-maxage=3600")
+                # Click-limited links must reach us on every click, and are not permanent.
+                assert await redirect(limited) == (307, "no-store")
+                # Nothing is cached past the link's expiry.
+                status_code, cache_control = await redirect(soon)
+                max_age = int(cache_control.split("max-age=")[1].split(",")[0])
+                assert status_code == 307 and 590 <= max_age <= 600
+
+@pytest.mark.asyncio
+async def test_admin_info_conditional_get(test_settings, db_session, mocked_redis):
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        created = (await client.post("/url", json={"target_url": "https://example.com/admin"})).json()
+        admin = f"/admin/{created['admin_url']}"
+        response = await client.get(admin)
+        assert response.status_code == 200 and response.headers["cache-control"] == "private, no-cache"
+        etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+
+        revalidated = await client.get(admin, headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304 and revalidated.content == b"" and revalidated.headers["etag"] == etag
+        assert (await client.get(admin, headers={"If-Modified-Since": last_modified})).status_code == 304
+        # If-None-Match wins over If-Modified-Since.
+        assert (await client.get(admin, headers={"If-None-Match": 'W/"other"', "If-Modified-Since": last_modified})).status_code == 200
+
+        # A click changes the info: both validators move.
+        await client.get(f"/{created['url']}", follow_redirects=False)
+        assert (await client.get(admin, headers={"If-None-Match": etag})).status_code == 200
+        assert (await client.get(admin, headers={"If-Modified-Since": last_modified})).status_code == 200
+
+    # Info last changed days ago is still modified at midnight, when the visitors window moves.
+    from datetime import datetime, timedelta, timezone
+    from types import SimpleNamespace
+    from app.api.v1.endpoints.urls import admin_info_last_modified
+
+    long_ago = datetime.now(timezone.utc) - timedelta(days=3)
+    link = SimpleNamespace(pending_clicks=0, created_at=long_ago, deactivated_at=None, last_clicked_at=long_ago)
+    assert admin_info_last_modified(link) == datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+@pytest.mark.asyncio
+async def test_edge_clicks_and_purge(test_settings, db_session, mocked_redis, monkeypatch):
+    from app.api.v1.endpoints import edge, urls
+    from app.core.edge_purge import EdgePurger
+
+    async with AsyncClient(base_url=test_settings.base_url, transport=ASGITransport(app=app)) as client:
+        created = (await client.post("/url", json={"target_url": "https://example.com/edge", "s_maxage": 600})).json()
+        report = {"clicks": {created["url"]: 40, "NOPE9": 0}}
+        assert (await client.post("/edge/clicks", json=report)).status_code == 404
+
+        monkeypatch.setattr(edge.settings, "edge_clicks_token", "secret")
+        assert (await client.post("/edge/clicks", json=report, headers={"Authorization": "Bearer wrong"})).status_code == 401
+        response = await client.post("/edge/clicks", json=report, headers={"Authorization": "Bearer secret"})
+        assert response.json() == {"recorded": 40, "ignored_keys": 1}
+        assert (await client.get(f"/admin/{created['admin_url']}")).json()["pending_clicks"] == 40
+
+        # Deactivating a link queues its purge from the CDN.
+        purged = []
+        monkeypatch.setattr(urls.edge_purger, "purge", lambda *keys: purged.extend(keys))
+        await client.delete(f"/admin/{created['admin_url']}")
+        assert purged == [created["url"]]
+
+    per_link = EdgePurger("{url}", "purge", "", "https://sho.rt")
+    assert [request["url"] for _, request in per_link.requests_for(["ABCDE", "FGHIJ"])] == ["https://sho.rt/ABCDE", "https://sho.rt/FGHIJ"]
+    batch = EdgePurger("https://cdn.example/purge", "POST", "token", "https://sho.rt")
+    [(keys, request)] = batch.requests_for(["ABCDE", "FGHIJ"])
+    assert request["json"] == {"files": ["https://sho.rt/ABCDE", "https://sho.rt/FGHIJ"]}
+    assert request["headers"] == {"Authorization": "Bearer token"}
@@ -0,0 +1,18 @@
+from app.core.bloom import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"K{i:04d}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert bloom.count == 1000
+
+def test_bloom_filter_false_positive_rate_is_close_to_target():
+    bloom = BloomFilter(capacity=5000, error_rate=0.01)
+    for i in range(5000):
+        bloom.add(f"issued-{i}")
+    false_positives = sum(f"absent-{i}" in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.02
+    assert bloom.estimated_false_positive_rate < 0.02
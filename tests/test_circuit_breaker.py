@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["transitions"] == {"closed->open": 1}
+
+
+def test_only_a_probe_after_reset_timeout_ends_the_open_state():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60, success_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_probe(True)
+    assert breaker.state == OPEN
+
+    breaker.opened_at = time.monotonic() - 61
+    breaker.record_probe(True)
+    assert breaker.state == HALF_OPEN and breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_failure_while_half_open_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=0)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.record_probe(True)
+    assert breaker.state == HALF_OPEN
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.transitions["half_open->open"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_timeouts_count_but_cancellations_do_not(monkeypatch):
+    import redis.asyncio as redis
+    from app.database import caching
+
+    async def hang(self, *args, **options):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(redis.Redis, "execute_command", hang)
+    monkeypatch.setattr(caching, "redis_breaker", CircuitBreaker("redis", failure_threshold=5, reset_timeout=60))
+    # A request that goes away cancels its command: Redis is not to blame.
+    task = asyncio.get_running_loop().create_task(caching.redis_client.get("key"))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert caching.redis_breaker.consecutive_failures == 0
+
+    with pytest.raises(asyncio.TimeoutError):
+        await caching.redis_wait(caching.redis_client.get("key"), timeout=0.01)
+    assert caching.redis_breaker.consecutive_failures == 1
@@ -0,0 +1,24 @@
+from app.core.key_codec import MAX_KEY_LENGTH, compact_columns, id_to_key, key_to_id, split_secret_key
+
+
+def test_key_ids_round_trip_and_keep_leading_zeros_apart():
+    keys = ["0", "00", "000", "A", "ZZZZZ", "0AB12", "K3Y", "Z" * MAX_KEY_LENGTH]
+    ids = [key_to_id(key) for key in keys]
+    assert len(set(ids)) == len(keys)
+    assert [id_to_key(key_id) for key_id in ids] == keys
+    # Every key fits a signed BIGINT.
+    assert key_to_id("Z" * MAX_KEY_LENGTH) < 2 ** 63
+
+def test_keys_without_a_compact_form():
+    for key in ["", "abc", "AB-C", "A_B", "Z" * (MAX_KEY_LENGTH + 1)]:
+        assert key_to_id(key) is None
+    assert split_secret_key("ABCDE_short") is None
+    assert split_secret_key("ABCDE") is None
+
+def test_secret_tokens_are_fixed_width():
+    key_id, token = split_secret_key("ABCDE_ZZZZZZZZ")
+    assert key_id == key_to_id("ABCDE")
+    assert len(token) == 6 and token != split_secret_key("ABCDE_00000000")[1]
+    assert compact_columns("ABCDE", "ABCDE_ZZZZZZZZ") == {"key_id": key_id, "secret_token": token}
+    # The token is only kept for secret keys built from the row's own key.
+    assert compact_columns("XYZ12", "ABCDE_ZZZZZZZZ") == {"key_id": key_to_id("XYZ12"), "secret_token": None}
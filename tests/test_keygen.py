@@ -0,0 +1,37 @@
+import pytest
+
+from app.core.keygen import BASE, KeyAllocator, KeyPermutation
+
+
+def test_key_permutation_is_a_bijection():
+    permutation = KeyPermutation(b"test-secret", length=3)
+    images = {permutation.permute(value) for value in range(permutation.domain)}
+    assert images == set(range(BASE ** 3))
+
+def test_key_permutation_depends_on_secret():
+    first = KeyPermutation(b"secret-a", length=5)
+    second = KeyPermutation(b"secret-b", length=5)
+    assert [first.permute(i) for i in range(10)] != [second.permute(i) for i in range(10)]
+
+@pytest.mark.asyncio
+async def test_key_allocator_reserves_blocks_and_widens(monkeypatch):
+    allocator = KeyAllocator(b"test-secret", min_length=2, block_size=50, max_fill=0.5)
+    next_value = 0
+    reservations = 0
+
+    async def fake_reserve(db, count):
+        nonlocal next_value, reservations
+        reservations += 1
+        values = list(range(next_value, next_value + count))
+        next_value += count
+        return values
+
+    monkeypatch.setattr(allocator, "_reserve", fake_reserve)
+    keys = await allocator.allocate(None, 1000)
+    keys += [await allocator.next_key(None) for _ in range(100)]
+
+    assert len(set(keys)) == len(keys)
+    # Half of the 2-character space is handed out before keys widen to 3 characters.
+    assert sum(len(key) == 2 for key in keys) == BASE ** 2 // 2
+    assert {len(key) for key in keys} == {2, 3}
+    assert reservations == 3
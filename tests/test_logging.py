@@ -0,0 +1,74 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from app.core import logging as app_logging
+from app.core.logging import DroppingQueueHandler, EventLog, JsonFormatter, RateLimit
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(app_logging.logger, "handlers", [recorder])
+    # Running the migrations (conftest) disables loggers that exist at that point.
+    monkeypatch.setattr(app_logging.logger, "disabled", False)
+    level = app_logging.logger.level
+    app_logging.logger.setLevel(logging.INFO)
+    yield recorder
+    app_logging.logger.setLevel(level)
+
+def test_events_are_sampled_but_warnings_are_not(recorder):
+    events = EventLog({"cache_hit": 0.1, "never": 0.0}, {})
+    for _ in range(2000):
+        events.log("cache_hit", logging.INFO, "hit %s", "ABCDE")
+        events.log("never", logging.INFO, "dropped")
+    events.log("never", logging.WARNING, "kept")
+    hits = [record for record in recorder.records if record.event == "cache_hit"]
+    assert 100 < len(hits) < 300
+    assert hits[0].fields == {"sample_rate": 0.1}
+    assert [record.getMessage() for record in recorder.records if record.event == "never"] == ["kept"]
+
+def test_rate_limit_reports_suppressed_lines(recorder):
+    limit = RateLimit(2)
+    assert [limit.allow() for _ in range(5)] == [0, 0, None, None, None]
+    limit.updated -= 1
+    assert limit.allow() == 3
+
+    events = EventLog({}, {"not_found": 5})
+    for _ in range(100):
+        events.log("not_found", logging.INFO, "Page not found: %s", "/NOPE9")
+    assert len(recorder.records) == 5
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord("app", logging.INFO, __file__, 1, "key=%s", ("ABCDE",), None)
+    record.event, record.fields = "cache_miss", {"key": "ABCDE"}
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 1
+    queued = handler.queue.get_nowait()
+    assert queued.args == ("ABCDE",)
+    line = json.loads(JsonFormatter().format(queued))
+    assert line["message"] == "key=ABCDE" and line["event"] == "cache_miss" and line["key"] == "ABCDE"
+
+def test_shutdown_reports_dropped_records_through_the_stream_handler(monkeypatch):
+    app_logging.configure_logging()
+    recorder = Recorder()
+    monkeypatch.setattr(app_logging, "_stream_handler", recorder)
+    monkeypatch.setattr(app_logging.queue_handler, "dropped", 3)
+    try:
+        app_logging.shutdown_logging()
+    finally:
+        app_logging.configure_logging()
+    [record] = recorder.records
+    assert record.levelno == logging.WARNING and record.getMessage() == "3 log records were dropped because the log queue was full"
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import manage
+from app.database.caching import decode_entry
+
+
+def test_warm_redis_follows_link_limits():
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=120)
+    rows = [
+        ("PLAIN", "https://example.com/a", True, 0, None, None, None, None, None),
+        ("EXPIRING", "https://example.com/b", True, 0, expires_at, None, 301, 60, 3600),
+        ("EXPIRED", "https://example.com/c", True, 0, datetime.now(timezone.utc) - timedelta(seconds=1), None, None, None, None),
+        ("LIMITED", "https://example.com/d", True, 0, None, 5, None, None, None),
+        ("INACTIVE", "https://example.com/e", False, 0, None, None, None, None, None),
+    ]
+    manage.publish_to_redis(client, rows, warm=True)
+
+    cached = {call.args[0]: (call.args[1], call.kwargs["ex"]) for call in pipe.set.call_args_list}
+    assert set(cached) == {"PLAIN", "EXPIRING"}
+    value, ttl = cached["EXPIRING"]
+    assert 0 < ttl <= 120
+    target_url, expires_in, policy = decode_entry(value)
+    assert target_url == "https://example.com/b" and 0 < expires_in <= 120
+    # The link's own redirect policy is cached with it.
+    assert policy == (301, 60, 3600)
@@ -0,0 +1,89 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import models
+from app.database import crud
+from app.database.database import Base
+from app.database.replicas import Replica, ReplicaRouter, RoutingSession
+
+
+def make_database(path, rows):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for key, target_url in rows:
+            connection.execute(models.URL.__table__.insert().values(key=key, secret_key=f"{key}_s", target_url=target_url, is_active=True, clicks=0))
+    engine.dispose()
+    return create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+@pytest_asyncio.fixture
+async def routed(tmp_path, monkeypatch):
+    # Two local databases: the primary has every row, the replica is behind (no "NEW")
+    # and holds a different target for "BOTH" so the tests can tell which one answered.
+    primary = make_database(tmp_path / "primary.db", [("BOTH", "https://primary.example"), ("NEW", "https://new.example")])
+    replica_engine = make_database(tmp_path / "replica.db", [("BOTH", "https://replica.example")])
+    router = ReplicaRouter([Replica("replica-0", replica_engine)], max_lag=5.0, sticky_seconds=60.0)
+    monkeypatch.setattr(crud, "replica_router", router)
+    session_factory = async_sessionmaker(bind=primary, sync_session_class=RoutingSession, expire_on_commit=False)
+    yield router, session_factory
+    await primary.dispose()
+    for replica in router.replicas:
+        await replica.engine.dispose()
+
+async def target_of(session_factory, key, **kwargs):
+    async with session_factory() as db:
+        db_url = await crud.get_db_url_by_key(db, key, **kwargs)
+        return db_url.target_url if db_url else None
+
+@pytest.mark.asyncio
+async def test_reads_go_to_the_replica(routed):
+    router, session_factory = routed
+    assert await target_of(session_factory, "BOTH") == "https://replica.example"
+    assert await target_of(session_factory, "BOTH", replica=False) == "https://primary.example"
+    assert router.replicas[0].queries == 1
+
+@pytest.mark.asyncio
+async def test_missing_rows_are_confirmed_on_the_primary_when_in_doubt(routed):
+    router, session_factory = routed
+    # A redirect's miss on an up-to-date replica is final: 404s cost one replica query.
+    assert await target_of(session_factory, "NEW") is None
+    assert await target_of(session_factory, "NEW", confirm_missing=True) == "https://new.example"
+    # So is a miss on a replica known to be behind.
+    router.replicas[0].lag = 2.0
+    assert await target_of(session_factory, "NEW") == "https://new.example"
+
+@pytest.mark.asyncio
+async def test_keys_issued_on_other_workers_are_read_from_the_primary(routed, monkeypatch):
+    from app.database import key_filter
+
+    router, session_factory = routed
+    monkeypatch.setattr(key_filter, "replica_router", router)
+    for handler in key_filter.invalidation_listener._handlers[key_filter.KEY_ISSUED_CHANNEL]:
+        handler("OTHER,NEW")
+    assert await target_of(session_factory, "NEW") == "https://new.example"
+
+@pytest.mark.asyncio
+async def test_recent_writes_are_read_from_the_primary(routed):
+    router, session_factory = routed
+    router.remember_write("BOTH")
+    assert await target_of(session_factory, "BOTH") == "https://primary.example"
+
+@pytest.mark.asyncio
+async def test_unhealthy_or_failing_replicas_fall_back_to_the_primary(routed, tmp_path, monkeypatch):
+    router, session_factory = routed
+    router.replicas[0].healthy = False
+    assert await target_of(session_factory, "BOTH") == "https://primary.example"
+
+    # A replica without the table makes the query fail: it is marked down and the primary answers.
+    broken = Replica("broken", create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'empty.db'}"))
+    router = ReplicaRouter([broken], max_lag=5.0, sticky_seconds=60.0)
+    monkeypatch.setattr(crud, "replica_router", router)
+    assert await target_of(session_factory, "BOTH") == "https://primary.example"
+    assert not broken.healthy and router.primary_fallbacks == 1
+    await broken.engine.dispose()
+
+    # A successful check brings a replica back into rotation.
+    await router.check(broken)
+    assert broken.healthy
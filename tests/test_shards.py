@@ -0,0 +1,149 @@
+from collections import Counter
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import manage
+from app import models, schemas
+from app.core import keygen
+from app.database import clicks, crud
+from app.database.database import Base
+from app.database.shards import NUM_BUCKETS, Shard, ShardRouter, bucket_of
+
+
+@pytest_asyncio.fixture
+async def sharded(tmp_path, monkeypatch):
+    # Three local databases; shard 0 plays DATABASE_URL and holds the shard map.
+    sync_engines, async_engines = [], []
+    for index in range(3):
+        path = tmp_path / f"shard{index}.db"
+        sync_engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(sync_engine)
+        sync_engines.append(sync_engine)
+        async_engines.append(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+    router = ShardRouter([
+        Shard(index, f"shard-{index}", async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False))
+        for index, async_engine in enumerate(async_engines)
+    ])
+    monkeypatch.setattr(crud, "shard_router", router)
+    monkeypatch.setattr(clicks, "shard_router", router)
+    monkeypatch.setattr(keygen.settings, "keygen_strategy", "random")
+    yield router, sync_engines
+    for engine in async_engines:
+        await engine.dispose()
+    for engine in sync_engines:
+        engine.dispose()
+
+def shard_of_row(engines, url_key):
+    # Index of the only database holding the key.
+    found = []
+    for index, engine in enumerate(engines):
+        with engine.connect() as connection:
+            if connection.execute(select(models.URL.id).where(models.URL.key == url_key)).first():
+                found.append(index)
+    assert len(found) == 1, found
+    return found[0]
+
+async def create_links(router, count):
+    async with router.default.session_factory() as db:
+        return [await crud.create_db_url(db, schemas.URLBase(target_url=f"https://example.com/{n}")) for n in range(count)]
+
+@pytest.mark.asyncio
+async def test_links_are_routed_by_key_bucket(sharded):
+    router, engines = sharded
+    # Buckets 0-2047 on shard 0, the odd ones above on shard 1, the even ones on shard 2.
+    manage.write_shard_map(engines[0], {bucket: (1 + bucket % 2, None) for bucket in range(NUM_BUCKETS // 2, NUM_BUCKETS)})
+    await router.reload()
+    links = await create_links(router, 40)
+    assert {shard_of_row(engines, link.key) for link in links} == {0, 1, 2}
+
+    async with router.default.session_factory() as db:
+        for link in links:
+            expected = router.shards_for_key(link.key)
+            assert shard_of_row(engines, link.key) == expected[0].index
+            # The secret key leads to the same single shard: admin lookups never fan out.
+            assert router.shards_for_secret_key(link.secret_key) == expected
+            assert (await crud.get_db_url_by_key(db, link.key)).id == link.id
+            assert (await crud.get_db_url_by_secret_key(db, link.secret_key)).key == link.key
+
+        await clicks.click_buffer._apply(db, Counter({link.key: 2 for link in links}))
+        assert (await crud.add_click_by_key(db, links[-1].key)).clicks == 3
+        assert (await crud.deactivate_db_url_by_secret_key(db, links[-1].secret_key)).is_active is False
+        assert await crud.get_db_url_by_key(db, links[-1].key) is None
+        assert {(await crud.get_db_url_by_secret_key(db, link.secret_key)).clicks for link in links[:-1]} == {2}
+        assert await crud.get_existing_keys(db, [link.key for link in links] + ["FREE1"]) == {link.key for link in links}
+
+@pytest.mark.asyncio
+async def test_rebalance_moves_buckets_while_serving(sharded):
+    router, engines = sharded
+    links = await create_links(router, 20)
+    moving = links[0]
+    bucket = bucket_of(moving.key)
+
+    # While the bucket is marked as moving, lookups and clicks find its rows on the source
+    # and new links of the bucket are created on the destination.
+    manage.write_shard_map(engines[0], {bucket: (0, 2)})
+    await router.reload()
+    assert router.shard_for_new_key(moving.key).index == 2
+    async with router.default.session_factory() as db:
+        await clicks.click_buffer._apply(db, Counter({moving.key: 1}))
+        assert (await crud.get_db_url_by_key(db, moving.key)).clicks == 1
+
+    # Archived rows move with their bucket.
+    async with router.shards[0].session_factory() as db:
+        await crud.deactivate_db_url_by_secret_key(db, links[1].secret_key)
+    with engines[0].begin() as connection:
+        connection.execute(models.URL.__table__.update().where(models.URL.key == links[1].key).values(deactivated_at=None))
+    async with router.shards[0].session_factory() as db:
+        await crud.archive_db_urls(db, 0, 100, moving.created_at, None)
+
+    announced = []
+    buckets = sorted({bucket, bucket_of(links[1].key)})
+    stats = manage.rebalance(engines, buckets, to=2, batch_size=1, settle=0, announce=announced.extend)
+    assert stats["buckets"] == len(buckets) and stats["archived"] == 1
+    assert moving.key in announced
+
+    # Until the workers reload the map, the moving state still finds the rows.
+    async with router.default.session_factory() as db:
+        assert (await crud.get_db_url_by_key(db, moving.key)).clicks == 1
+        await router.reload()
+        assert router.shards_for_key(moving.key) == [router.shards[2]]
+        assert shard_of_row(engines, moving.key) == 2
+        assert (await crud.add_click_by_key(db, moving.key)).clicks == 2
+        assert (await crud.get_archived_db_url_by_secret_key(db, links[1].secret_key)).key == links[1].key
+        # Other buckets stayed where they were.
+        for link in links[2:]:
+            if bucket_of(link.key) not in buckets:
+                assert shard_of_row(engines, link.key) == 0
+                assert (await crud.get_db_url_by_key(db, link.key)).id == link.id
+
+    # Running it again has nothing left to do.
+    assert manage.rebalance(engines, buckets, to=2, batch_size=1, settle=0)["buckets"] == 0
+
+@pytest.mark.asyncio
+async def test_failed_flush_retries_only_uncommitted_shards(sharded):
+    router, engines = sharded
+    manage.write_shard_map(engines[0], {bucket: (1 + bucket % 2, None) for bucket in range(NUM_BUCKETS // 2, NUM_BUCKETS)})
+    await router.reload()
+    links = await create_links(router, 40)
+    buffer = clicks.ClickBuffer("memory", flush_interval=60, flush_threshold=10**6, delivery="at_least_once")
+    # Shard 2 comes last, after shards 0 and 1 have committed, and fails once.
+    for link in sorted(links, key=lambda link: router.shards_for_key(link.key)[0].index):
+        await buffer.record(link.key)
+    update = buffer._update
+    failures = []
+
+    async def failing_update(session, shard_clicks):
+        if not failures and router.shards_for_key(next(iter(shard_clicks)))[0].index == 2:
+            failures.append(shard_clicks)
+            raise RuntimeError("shard 2 is down")
+        return await update(session, shard_clicks)
+
+    buffer._update = failing_update
+    async with router.default.session_factory() as db:
+        assert await buffer.flush(db) == 40 - len(failures[0])
+        assert set(buffer._counts) == set(failures[0])
+        assert await buffer.flush(db) == len(failures[0])
+        assert {(await crud.get_db_url_by_key(db, link.key)).clicks for link in links} == {1}
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.database.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_share_one_call():
+    flight = SingleFlight(wait_timeout=1.0)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "https://example.com"
+
+    results = await asyncio.gather(*(flight.load("KEY", loader) for _ in range(50)))
+    assert results == ["https://example.com"] * 50
+    assert calls == 1
+
+    # Once the load has finished, the next miss loads again.
+    await flight.load("KEY", loader)
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_followers_fall_back_when_the_leader_fails():
+    flight = SingleFlight(wait_timeout=1.0)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise RuntimeError("database unavailable")
+        return "https://example.com"
+
+    results = await asyncio.gather(*(flight.load("KEY", loader) for _ in range(3)), return_exceptions=True)
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == ["https://example.com"] * 2
+
+@pytest.mark.asyncio
+async def test_waiting_is_bounded():
+    flight = SingleFlight(wait_timeout=0.05)
+    release = asyncio.Event()
+
+    async def slow_loader():
+        await release.wait()
+        return "slow"
+
+    async def fast_loader():
+        return "fast"
+
+    leader = asyncio.create_task(flight.load("KEY", slow_loader))
+    await asyncio.sleep(0)
+    assert await flight.load("KEY", fast_loader) == "fast"
+    release.set()
+    assert await leader == "slow"
@@ -0,0 +1,31 @@
+from app.core.ttl_policy import TTLPolicy
+
+
+def make_policy(**overrides) -> TTLPolicy:
+    options = dict(new_ttl=100, ttl=1000, hot_ttl=10000, hot_clicks=50, jitter=0.1, refresh_scale=60.0)
+    options.update(overrides)
+    return TTLPolicy(**options)
+
+def test_ttl_depends_on_popularity_and_is_jittered():
+    policy = make_policy()
+    assert all(90 <= policy.ttl(0) <= 110 for _ in range(200))
+    assert all(900 <= policy.ttl(1) <= 1100 for _ in range(200))
+    assert all(9000 <= policy.ttl(50) <= 11000 for _ in range(200))
+    # Entries written together are spread out instead of expiring in the same second.
+    assert len({policy.ttl(1) for _ in range(200)}) > 50
+
+def test_early_refresh_becomes_likely_close_to_expiry():
+    policy = make_policy()
+    near = sum(policy.should_refresh(1) for _ in range(1000))
+    far = sum(policy.should_refresh(3600) for _ in range(1000))
+    assert near > 900
+    assert far == 0
+    assert not make_policy(refresh_scale=0).should_refresh(1)
+    assert not policy.should_refresh(-1)
+
+def test_ttl_never_outlives_link_expiry():
+    policy = make_policy()
+    assert policy.ttl(0, expires_in=30.7) == 30
+    assert all(90 <= policy.ttl(0, expires_in=5000) <= 110 for _ in range(50))
+    # Already expired: nothing to cache.
+    assert policy.ttl(50, expires_in=-3) == 0